@@ -3,8 +3,15 @@ from dash import Dash, Input, Output, State
 import dash
 import dash_bootstrap_components as dbc
 from dash_svg import Svg, G, Path
+from flask import jsonify, request, abort
+from dotenv import load_dotenv
 # from pyconfig import appConfig
 import pylayout
+from database import pool_stats
+from pycache import cache_stats
+from pyexport import export_response
+import hmac
+import os
 
 # Dash app config
 APP_TITLE = 'Global CosmicRay Network for Space Weather Monitoring and STEM Outreach'
@@ -12,6 +19,11 @@ UPDATE_TITLE = 'Updating...'
 DEBUG = 'TRUE'
 THEME = 'LITERA' # Web app theme selection
 
+# Stats routes are only served when the STATS_TOKEN .env variable is set, to requests sending it
+# on their X-Stats-Token header
+load_dotenv()
+STATS_TOKEN = os.getenv('STATS_TOKEN')
+
 # App initiation
 app = Dash(
     APP_TITLE,
@@ -48,6 +60,39 @@ app.layout = dbc.Container(
     id='container-base-app'
 )
 
+''' 
+Routes reporting db connection pool usage and checkout wait times, and hits and misses of the
+figure cache, of the worker serving them. Requests without the stats token get a 404 as if the
+routes did not exist
+
+'''
+def check_stats_token():
+    if not hmac.compare_digest(request.headers.get('X-Stats-Token', ''), STATS_TOKEN):
+        abort(404)
+
+if STATS_TOKEN:
+    @server.route('/stats/db-pool')
+    def db_pool_stats():
+        check_stats_token()
+        return jsonify(pool_stats())
+
+    @server.route('/stats/figure-cache')
+    def figure_cache_stats():
+        check_stats_token()
+        return jsonify(cache_stats())
+
+''' 
+Route exporting the series of a detector, as linked by the download buttons. Query takes optional
+start, end or days, comma separated columns, format (csv, csv.gz, parquet or feather) and filename.
+Products of the download buttons already written for the current data version are served from
+their file, with Range requests; otherwise rows are streamed as they are read, and a Range request
+for a product waits for its file. Other exports are streamed without Range support and never saved.
+
+'''
+@server.route('/export/<detector>')
+def detector_export(detector):
+    return export_response(detector)
+
 ''' 
 Callback for displaying toogle options when navbar is small due to small screen format
 
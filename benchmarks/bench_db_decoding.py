@@ -0,0 +1,114 @@
+''' 
+
+Benchmark of result decoding: Row objects from fetchall() formatted by format_sql, pandas read_sql,
+and fetch_series, which on postgres streams the result by binary COPY TO STDOUT and decodes it into
+numpy arrays. Other dbs fall back to read_sql within fetch_series, so run it against postgres to
+measure the COPY path. A temporary table of hourly rows is created on the db given by .env and
+dropped afterwards.
+
+Run from repository root:   python benchmarks/bench_db_decoding.py
+
+'''
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import get_engine, fetch_series, upsert_df
+
+TABLE = 'bench_decoding'
+COLUMNS = ['counts', 'temp_in_f', 'alti_pressure']
+
+
+def format_sql(sql_data):
+    ''' 
+    Formats sql data fetched from table into datetime index and numeric column, as database.py did
+    before fetch_series
+
+    '''
+    df = pd.DataFrame(sql_data)
+    df['date'] = pd.to_datetime(df['date'])
+    if str(df['date'].dt.tz) != 'UTC':
+        df['date'] = df['date'].dt.tz_localize('UTC')
+    df = df.set_index('date')
+
+    df.sort_index(ascending=True, inplace=True)
+
+    columns_types = df.dtypes.to_list()
+    if len(set(columns_types)) > 1:
+        for col in df.columns.to_list():
+            df[col] = pd.to_numeric(df[col])
+
+    return df
+
+
+def fetchall_format_sql(engine):
+    ''' 
+    Decoding used before fetch_series, building a df from Row objects
+
+    '''
+    with engine.connect() as conn:
+        rows = conn.execute(text(f'SELECT * FROM {TABLE}')).fetchall()
+    return format_sql(rows)
+
+
+def read_sql(engine):
+    ''' 
+    Decoding by pandas read_sql with explicit dtypes and a tz-aware index
+
+    '''
+    with engine.connect() as conn:
+        df = pd.read_sql(text(f'SELECT * FROM {TABLE} ORDER BY date'), conn, dtype={col: 'float64' for col in COLUMNS})
+    df['date'] = pd.to_datetime(df['date'], utc=True)
+    return df.set_index('date')
+
+
+def timed(fn, repeat=5):
+    ''' 
+    Runs fn repeat times, returns best time in seconds and last result
+
+    '''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    engine = get_engine()
+    print(f'backend: {engine.dialect.name}')
+    print(f"{'rows':>8}{'fetchall s':>12}{'read_sql s':>12}{'copy s':>10}{'speedup':>10}  equal")
+
+    for years in (1, 5, 10):
+        index = pd.date_range('2015-01-01', periods=years*365*24, freq='h', tz='UTC', name='date')
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({col: rng.normal(1000, 10, len(index)) for col in COLUMNS}, index=index)
+        df.iloc[::97] = np.nan
+
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {TABLE}'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_df(df, TABLE, engine)
+
+        try:
+            legacy_s, legacy = timed(lambda: fetchall_format_sql(engine))
+            read_sql_s, _ = timed(lambda: read_sql(engine))
+            copy_s, new = timed(lambda: fetch_series(TABLE, COLUMNS))
+        finally:
+            with engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS {TABLE}'))
+
+        equal = legacy[COLUMNS].equals(new) and new.equals(df)
+        print(f'{len(df):>8}{legacy_s:>12.3f}{read_sql_s:>12.3f}{copy_s:>10.3f}{legacy_s / copy_s:>9.1f}x  {equal}')
+
+
+if __name__ == '__main__':
+    main()
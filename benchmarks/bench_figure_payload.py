@@ -0,0 +1,98 @@
+'''
+
+Benchmark of the detector figure payload: every hourly point of every trace, as the figure was built
+before downsampling, against pyfigure.detector_figure downsampling each trace to the points a graph
+of given width can show. Figures are built from synthetic series with outages, no db is needed.
+
+Run from repository root:   python benchmarks/bench_figure_payload.py
+
+'''
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyfigure import detector_figure, POINTS_PER_PIXEL
+from pydownsample import bucket_width
+
+WIDTH = 1600
+
+
+def legacy_figure(df, wdf):
+    '''
+    Traces as built before downsampling, the counts series being sent twice
+
+    '''
+    fig = go.Figure([
+        go.Scatter(x=df.index, y=df['counts_pct'], name='Offline', line=dict(dash='dash', color='red', width=0.5), connectgaps=True),
+        go.Scatter(x=df.index, y=df['counts_pct'], name='Muon Counts % Change', line=dict(color='red', width=1)),
+        go.Scatter(x=wdf.index, y=wdf['temp_pct'], name='Temp(°F) % Change', line=dict(color='green', width=1), connectgaps=True),
+        go.Scatter(x=wdf.index, y=wdf['alti_press_pct'], name='Alt. Pressure % Change', line=dict(color='blue', width=1), connectgaps=True),
+        go.Scatter(x=wdf.index, y=wdf['sea_l_press_pct'], name='Sea Level Press % Change', line=dict(color='orange', width=1)),
+    ])
+    fig.update_layout(title={'text': 'Bench : Real Time Cosmic Muon Monitor (Updated Daily)', 'x': 0.5}, height=280)
+    return fig
+
+
+def synthetic_series(years, seed=0):
+    '''
+    Hourly counts and weather percentage changes with daily cycles, noise, a few multi-day outages
+    and single missing hours
+
+    '''
+    index = pd.date_range('2015-01-01', periods=years*365*24, freq='h', tz='UTC', name='date')
+    rng = np.random.default_rng(seed)
+    hours = np.arange(len(index))
+    df = pd.DataFrame({'counts_pct': np.sin(hours / 24 * 2 * np.pi) + rng.normal(0, 0.5, len(index))}, index=index)
+    for start in rng.integers(0, len(index) - 500, years * 3):
+        df.iloc[start:start + rng.integers(24, 500)] = np.nan
+    df.iloc[::131] = np.nan
+
+    wdf = pd.DataFrame({
+        'temp_pct': np.sin(hours / 24 * 2 * np.pi + 1) + rng.normal(0, 0.2, len(index)),
+        'alti_press_pct': rng.normal(0, 0.3, len(index)).cumsum() / 50,
+        'sea_l_press_pct': rng.normal(0, 0.3, len(index)).cumsum() / 50,
+        'sea_l_pressure_millibar': 1013.0,
+    }, index=index)
+    return df, wdf
+
+
+def timed_payload(build, repeat=3):
+    '''
+    Builds and serializes a figure repeat times, returns best time in seconds, payload bytes and figure
+
+    '''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fig = build()
+        payload = fig.to_json()
+        best = min(best, time.perf_counter() - start)
+    return best, len(payload), fig
+
+
+def main():
+    n_points = WIDTH * POINTS_PER_PIXEL
+    print(f"{'years':>6}{'method':>8}{'legacy KB':>11}{'legacy s':>10}{'new KB':>9}{'new s':>8}{'smaller':>9}{'gaps':>7}{'kept':>6}")
+
+    for years in (1, 5, 10):
+        df, wdf = synthetic_series(years)
+        legacy_s, legacy_bytes, _ = timed_payload(lambda: legacy_figure(df, wdf))
+
+        # Outages a point of the downsampled trace can show
+        valid = df['counts_pct'].dropna()
+        gaps = int((np.diff(valid.index.asi8) > bucket_width(df['counts_pct'], n_points).value).sum())
+
+        for method in ('lttb', 'minmax'):
+            new_s, new_bytes, fig = timed_payload(lambda: detector_figure(df, wdf, 'Bench', n_points, method))
+            kept = int(np.isnan(np.asarray(fig.data[1].y, dtype=float)).sum())
+            print(f'{years:>6}{method:>8}{legacy_bytes / 1024:>11.0f}{legacy_s:>10.3f}{new_bytes / 1024:>9.0f}{new_s:>8.3f}'
+                  f'{legacy_bytes / new_bytes:>8.1f}x{gaps:>7}{kept:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+''' 
+
+Benchmark of the interval based merge_log_dfs against the pairwise merge it replaced, which folded
+logs one at a time through merge_adding_all_timestamps_hourly. Detectors are simulated with dozens
+of overlapping minute logs, as left behind by restarts and rotations.
+
+Run from repository root:   python benchmarks/bench_log_merge.py
+
+'''
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from daily_data_upload import merge_log_dfs
+
+pd.options.mode.chained_assignment = None
+
+
+def legacy_merge_adding_all_timestamps_hourly(merged_logs, log_df, lfreq, trim_base_df, trim_log_df):
+    ''' 
+    Copy of merge_adding_all_timestamps_hourly as it was before merging became interval based.
+    Kept as reference for output and timing comparison.
+
+    '''
+    print('merge_adding_all_timestamps_hourly fn')
+    # Format df to hourly and trim if requested
+    if not merged_logs.empty and trim_base_df:
+        temp = merged_logs.resample('h').sum()
+        # Basic trimming of first and last hour due to timestamps missing
+        temp.drop(temp.head(1).index, inplace=True)
+        temp.drop(temp.tail(1).index, inplace=True)
+        # Replace 0 values to nan
+        temp.loc[temp['counts'] == 0] = np.nan
+        # If initial values on df are all nan, remove until valid value found
+        temp = temp[temp.first_valid_index():]
+        merged_logs = temp
+
+    if not log_df.empty and trim_log_df:
+        temp = log_df.resample('h').sum()
+        temp.drop(temp.head(1).index, inplace=True)
+        temp.drop(temp.tail(1).index, inplace=True)
+        temp.loc[temp['counts'] == 0] = np.nan
+        temp = temp[temp.first_valid_index():]
+        log_df = temp
+
+    # Check if df is not empty after trimming and perform merge
+    if not merged_logs.empty and not log_df.empty:
+
+        # Extract first date from log df to be merged at end of current base df
+        first_log_date = str(log_df.head(1).index[0])
+        # Extract last date from base df
+        last_log_date = str(merged_logs.tail(1).index[0])
+
+        # Check if dates are equal or in the right chronological order ascending
+        if str(merged_logs.head(1).index[0]) <= first_log_date:
+            # If able to find first log date from log df on merged_logs, no detector 
+            # has shutdown and just need to add at end of file whatever is not yet part of base df
+            try:
+                bf_first_log_date = str(merged_logs.iloc[merged_logs.get_loc(first_log_date) - 1].name)
+                print('No shutdown since last log data integration')
+                # Merge
+                merged = pd.concat([merged_logs, log_df])
+                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
+                # Sort fixed merged log files
+                merged = final_merged_logs.sort_index()
+            
+            # else, logs must be merged considering missing counts due to detector shutoff time
+            except:
+                print('Last log date bf shutdown: ', last_log_date, '\nFirst log date after shutdown: ', first_log_date)
+                # Create continuous range of dates to complete df timeline for missing date indexes
+                date_range = pd.date_range(start=last_log_date, end=first_log_date, freq=lfreq, tz='UTC')
+                # Create df containing missing dates as index and np.nan values
+                offline_df = pd.DataFrame(index=date_range, columns=merged_logs.columns, data=np.nan)
+                # Update current logs to include missing detector data time stamps but with nan values for graph
+                complete_logs = pd.concat([offline_df, log_df])
+                merged = pd.concat([merged_logs, complete_logs])
+                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
+                # Sort fixed merged log files
+                merged = final_merged_logs.sort_index()
+
+        # Reverse which file is merged at end of the other to ensure chronological order
+        else:
+            # Extract first date from log df to be merged at end of current base df
+            first_log_date = str(merged_logs.head(1).index[0])
+            # Extract last date from base df
+            last_log_date = str(log_df.tail(1).index[0])
+
+            try:
+                bf_first_log_date = str(log_df.iloc[log_df.get_loc(first_log_date) - 1].name)
+                print('No shutdown since last log data integration')
+                # Merge
+                merged = pd.concat([log_df, merged_logs])
+                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
+                # Sort fixed merged log files
+                merged = final_merged_logs.sort_index()
+            
+            # else, logs must be merged considering missing counts due to detector shutoff time
+            except:
+                print('Last log date bf shutdown: ', last_log_date, '\nFirst log date after shutdown: ', first_log_date)
+                # Create continuous range of dates to complete df timeline for missing date indexes
+                date_range = pd.date_range(start=last_log_date, end=first_log_date, freq=lfreq, tz='UTC')
+                # Create df containing missing dates as index and np.nan values
+                offline_df = pd.DataFrame(index=date_range, columns=merged_logs.columns, data=np.nan)
+                # Update current logs to include missing detector data time stamps but with nan values for graph
+                complete_logs = pd.concat([offline_df, merged_logs])
+                merged = pd.concat([log_df, complete_logs])
+                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
+                # Sort fixed merged log files
+                merged = final_merged_logs.sort_index()
+    
+    # Only merged logs remains after trimming
+    elif not merged_logs.empty:
+        merged = merged_logs
+    # Only log df remains after trimming
+    elif not log_df.empty:
+        merged = log_df
+    # None have data, return empty df
+    else:
+        merged = pd.DataFrame()
+
+    return merged
+
+
+def legacy_merge_log_dfs(log_dfs_list, lfreq='1min'):
+    ''' 
+    Copy of merge_log_dfs as it was before merging became interval based, folding logs pairwise
+    through legacy_merge_adding_all_timestamps_hourly. Frequency of the monitor is given directly
+    instead of being read from settings.
+
+    '''
+    print('merge_log_dfs fn')
+    if len(log_dfs_list) == 0 or log_dfs_list == None:
+        print('Given list of log dfs is empty. Try again with to run the all_monitor_logs_to_dfs() with correct file path')
+    elif len(log_dfs_list) > 1:
+        
+        # Sort logs from latest to earliest based on initial log date to ensure optimal merging
+        # Extract first row date of each log df into list
+        logs_l = [str(df.head(1).index[0]) for df in log_dfs_list]
+        # Make dictionary containing index of corresponding date on provided logs list
+        logs_dict = {}
+        for i in range(len(logs_l)):
+            logs_dict[logs_l[i]] = i
+        # sort values in ascending order
+        logs_l.sort()
+        # Create sorted list of logs
+        new_logs_df_list = []
+        for i in range(len(logs_l)):
+            new_logs_df_list.append(log_dfs_list[logs_dict[logs_l[i]]])
+        
+        # Extract first df on list and to start merging with rest of dfs
+        merged_logs = new_logs_df_list[0].copy(deep=True)
+        # Flag for initial merged df to be trimmed for incomplete hourly logs
+        trim_initial_merged = True
+
+        # Navigate through list of dfs and merge, making the df hourly
+        for i in range(1, len(new_logs_df_list)):
+            print(f'Log file index {i}')
+            merged_logs = legacy_merge_adding_all_timestamps_hourly(merged_logs, new_logs_df_list[i], lfreq, trim_initial_merged, True)
+            trim_initial_merged = False # Set flag to false to no longer trim base df as it has been done
+
+    # Else, the df list only has one df so no merging within list
+    else: 
+        merged_logs = log_dfs_list[0].copy(deep=True)
+        # Sample by hour
+        merged_logs1 = merged_logs.resample('h').sum()
+        # Trim first and last hour because of data missing due to log being incomplete
+        merged_logs1.drop(merged_logs1.head(1).index, inplace=True)
+        merged_logs1.drop(merged_logs1.tail(1).index, inplace=True)
+        merged_logs1.loc[merged_logs1['counts'] == 0] = np.nan
+        
+        # Reassign for return statement accuracy
+        merged_logs = merged_logs1
+
+    return merged_logs
+
+
+
+def synthetic_logs(n_logs=48, days=4, seed=0):
+    ''' 
+    Creates minute logs of one detector that start every few days and overlap the next one,
+    with shutdowns of a few hours between some of them
+
+    Args:       n_logs  -> int number of logs
+                days    -> int number of days recorded by each log
+                seed    -> int seed for random generator
+    Returns:    list of pandas dfs with 'counts' column indexed by UTC 'date'
+
+    '''
+    rng = np.random.default_rng(seed)
+    logs = []
+    start = pd.Timestamp('2024-01-01 00:17', tz='UTC')
+    for _ in range(n_logs):
+        minutes = days*24*60 + int(rng.integers(-600, 600))
+        index = pd.date_range(start, periods=minutes, freq='min', name='date')
+        logs.append(pd.DataFrame({'counts': rng.normal(170, 13, minutes).round()}, index=index))
+        # Next log overlaps the end of this one, or starts after a shutdown
+        start = index[-1] + pd.Timedelta(minutes=int(rng.choice([-300, -30, 90, 600])))
+    # Logs are listed in no particular order, like files within a folder
+    return [logs[i] for i in rng.permutation(n_logs)]
+
+
+def compare(name, logs):
+    ''' 
+    Runs both merges on the same logs, prints timing and the number of hours where they disagree.
+    Legacy merge adds shutdown gaps as minute rows and blanks the last hour before each gap,
+    so its output is resampled to hourly before comparing.
+
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        legacy = legacy_merge_log_dfs(logs)
+        legacy_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = merge_log_dfs(logs, None)
+        new_s = time.perf_counter() - start
+
+    legacy = legacy['counts'].resample('h').sum(min_count=1)
+    new = new['counts']
+    both = legacy.index.union(new.index)
+    legacy, new = legacy.reindex(both), new.reindex(both)
+    differ = int((legacy.ne(new) & ~(legacy.isna() & new.isna())).sum())
+    print(f'{name:<24}{len(logs):>6}{len(new):>8}{legacy_s:>10.3f}{new_s:>10.4f}{legacy_s / new_s:>9.1f}x{differ:>8}')
+
+
+def main():
+    print(f"{'data':<24}{'logs':>6}{'hours':>8}{'legacy s':>10}{'new s':>10}{'speedup':>10}{'differ':>8}")
+    for n_logs in (12, 48, 96):
+        compare(f'synthetic {n_logs} logs', synthetic_logs(n_logs))
+
+
+if __name__ == '__main__':
+    main()
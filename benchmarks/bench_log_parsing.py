@@ -0,0 +1,75 @@
+''' 
+
+Benchmark of parse_log against log_df_formatting on the detector logs available in data/.
+Each log is parsed with both functions, results are checked to be equal and timings are printed.
+
+Run from repository root:   python benchmarks/bench_log_parsing.py
+
+'''
+import contextlib
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from daily_data_upload import log_df_formatting, parse_log
+
+
+def legacy_parse(log_path, detector_name):
+    ''' 
+    Reads and formats a log file the way all_detector_logs_to_dfs did before parse_log
+
+    Args:       log_path        -> str with path of log file
+                detector_name   -> str containing detector name for access to settings
+    Returns:    pandas df
+
+    '''
+    temp = pd.read_csv(log_path, sep='\t', names=['counts'])
+    if temp.head(1)['counts'].str.contains('date').any():
+        temp.drop(temp.head(1).index, inplace=True)
+    # Silence prints of formatting function
+    with contextlib.redirect_stdout(io.StringIO()):
+        return log_df_formatting(temp, detector_name)
+
+
+def timed(fn, *args):
+    ''' 
+    Runs given function and measures its wall-clock time
+
+    Returns:    tuple [result, seconds]
+
+    '''
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    detectors = pd.read_csv('detector_info_settings/detector_locations.csv')
+
+    print(f"{'detector':<22}{'rows':>8}{'MB':>7}{'legacy s':>10}{'parse_log s':>13}{'speedup':>9}  equal")
+    for name, name_path in detectors[['name', 'name_path']].values.tolist():
+        folder = os.path.join('data', name_path)
+        if not os.path.isdir(folder):
+            continue
+
+        for log_file in sorted(f for f in os.listdir(folder) if f.endswith('.log')):
+            log_path = os.path.join(folder, log_file)
+            legacy, legacy_s = timed(legacy_parse, log_path, name)
+            new, new_s = timed(parse_log, log_path, name)
+
+            try:
+                pd.testing.assert_frame_equal(legacy, new, check_dtype=False)
+                equal = True
+            except AssertionError:
+                equal = False
+
+            size = os.path.getsize(log_path) / 1e6
+            print(f'{name:<22}{len(new):>8}{size:>7.1f}{legacy_s:>10.2f}{new_s:>13.3f}{legacy_s / new_s:>8.1f}x  {equal}')
+
+
+if __name__ == '__main__':
+    main()
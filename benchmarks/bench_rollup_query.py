@@ -0,0 +1,77 @@
+''' 
+
+Benchmark of multi-year figure reads: the full hourly history downloaded by fetch_series, as plotted
+before the rollup pyramid, against fetch_rollup picking the coarsest resolution for a figure of given
+pixel width. A temporary hourly table and its rollups are created on the db given by .env and dropped
+afterwards.
+
+Run from repository root:   python benchmarks/bench_rollup_query.py
+
+'''
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import get_engine, fetch_series, fetch_rollup, rollup_series, upsert_df, ROLLUPS
+
+TABLE = 'bench_rollup'
+COLUMNS = ['counts']
+WIDTH = 1200
+
+
+def drop_tables(engine):
+    ''' 
+    Drops the temporary hourly table and its rollups
+
+    '''
+    with engine.begin() as conn:
+        for suffix in ['', *(suffix for suffix, hours in ROLLUPS.values())]:
+            conn.execute(text(f'DROP TABLE IF EXISTS {TABLE}{suffix}'))
+
+
+def timed(fn, repeat=5):
+    ''' 
+    Runs fn repeat times, returns best time in seconds and last result
+
+    '''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    engine = get_engine()
+    print(f"{'years':>6}{'hourly rows':>13}{'hourly s':>10}{'rollup rows':>13}{'rollup s':>10}{'resolution':>12}{'speedup':>10}")
+
+    for years in (1, 5, 10):
+        index = pd.date_range('2015-01-01', periods=years*365*24, freq='h', tz='UTC', name='date')
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({col: rng.normal(18000, 150, len(index)) for col in COLUMNS}, index=index)
+        df.iloc[::97] = np.nan
+
+        drop_tables(engine)
+        with contextlib.redirect_stdout(io.StringIO()):
+            upsert_df(df, TABLE, engine)
+            rollup_series(TABLE, COLUMNS, bind=engine)
+
+        try:
+            hourly_s, hourly = timed(lambda: fetch_series(TABLE, COLUMNS))
+            rollup_s, (rollup, resolution) = timed(lambda: fetch_rollup(TABLE, COLUMNS, width=WIDTH))
+        finally:
+            drop_tables(engine)
+
+        print(f'{years:>6}{len(hourly):>13}{hourly_s:>10.3f}{len(rollup):>13}{rollup_s:>10.3f}{resolution:>12}{hourly_s / rollup_s:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+''' 
+
+Benchmark of the vectorized reduce_shutdown_count_errors against the segment by segment while loop
+it replaced. Outputs are compared on the hourly data within data/*/*_all_logs.csv and on a multi-year
+synthetic series with thousands of shutdowns.
+
+Run from repository root:   python benchmarks/bench_shutdown_qc.py
+
+'''
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from daily_data_upload import reduce_shutdown_count_errors
+
+pd.options.mode.chained_assignment = None
+
+
+def legacy_reduce_shutdown_count_errors(df):
+    ''' 
+    Copy of reduce_shutdown_count_errors as it was before being vectorized, walking each online
+    segment within a while loop. Kept as reference for output and timing comparison.
+
+    Args:       df
+    Returns:    df
+
+    '''
+    # Ensure df is hourly
+    df = df.resample('h').sum()
+    # Re-establish np.nan values due to above function replacing them with 0s
+    df.loc[df['counts'] == 0] = np.nan
+
+    # Add missing dates to ensure graph shows correct on website (i.e. offline is demarket instead of assuming online)
+    start = pd.to_datetime(df.head(1).index.values[0], utc=True)
+    end = pd.to_datetime(df.tail(1).index.values[0], utc=True)
+    t = pd.date_range(start=start, end=end, freq='h', tz='UTC')
+    tdf = pd.DataFrame(index=t, columns=df.columns, data=np.nan)
+    df1 = pd.concat([tdf, df])
+    df2 = df1[~df1.index.duplicated(keep='last')]
+    df = df2.sort_index(ascending=True)
+
+    # Do initial cleanup of anything above or below the mean + std*3
+    df.loc[(df['counts'] > df['counts'].mean() + (3*df['counts'].std())) | (df['counts'] < df['counts'].mean() - (3*df['counts'].std()))] = np.nan
+    df = df[(df.first_valid_index()):df.last_valid_index()]
+    
+    # Extract initial indexes if any
+    f = df.index.get_loc(df.first_valid_index())
+    l = df.index.get_loc(pd.to_datetime(df.isna().idxmax().head(1).values[0], utc=True))
+
+    # If the last index for interval is the same as initial index of df, it means
+    # there have never been any disruptions on data due to shutdowns
+    if l != f:
+
+        while l <= len(df) and f != l:
+            # Deal with spikes after shutdowns, calculate mean and std
+            if (f+24) < l:
+                mean = df[f:(f+24)].mean().values[0]
+                std = df[f:(f+24)].std().values[0]
+            else:
+                mean = df[f:(l - 1)].mean().values[0]
+                std = df[f:(l - 1)].std().values[0]
+            
+            # Check if first three values are lesser or greater than mean +- std, then assign np.nan
+            if df.iloc[f]['counts'] < (mean - (std*1.5)) or df.iloc[f]['counts'] > (mean + (std*2)):
+                df.iloc[f]['counts'] = np.nan
+            if f+1 < len(df) and df.iloc[f+1]['counts'] < (mean - (std*1.5)) or df.iloc[f+2]['counts'] > (mean + (std*2)):
+                df.iloc[(f+1)]['counts'] = np.nan
+            if f+2 < len(df) and df.iloc[f+2]['counts'] < (mean - (std*1.5)) or df.iloc[f+2]['counts'] > (mean + (std*2)):
+                df.iloc[(f+2)]['counts'] = np.nan
+
+            # Deal with spikes before shutdowns
+            if (l-25) > f:
+                mean = df[(l - 25):(l - 1)].mean().values[0]
+                std = df[(l - 25):(l - 1)].std().values[0]
+            else:
+                mean = df[f:(l - 1)].mean().values[0]
+                std = df[f:(l - 1)].std().values[0]
+
+            # Check if last three values are lesser or greater than mean +- std, then assign np.nan
+            if df.iloc[l-1]['counts'] < (mean - (std*1.5)) or df.iloc[l-1]['counts'] > (mean + (std*2)):
+                df.iloc[(l-1)]['counts'] = np.nan
+            if  l-2 > 0 and df.iloc[l-2]['counts'] < (mean - (std*1.5)) or df.iloc[l-2]['counts'] > (mean + (std*2)):
+                df.iloc[(l-2)]['counts'] = np.nan
+            if l-3 > 0 and df.iloc[l-3]['counts'] < (mean - (std*1.5)) or df.iloc[l-3]['counts'] > (mean + (std*2)):
+                df.iloc[(l-3)]['counts'] = np.nan
+
+            # Obtain new start and end index for evaluation of next df slice
+            f = df.index.get_loc(df[l:].first_valid_index())
+            l = df.index.get_loc(pd.to_datetime(df[f:].isna().idxmax().head(1).values[0], utc=True))
+            
+            # if l == f:
+            #     break
+
+    # Ensure all values == 0 are not accounted numerically during graphing and mean/std calculations
+    df.loc[df['counts'] == 0] = np.nan
+    
+    df = df.sort_index()
+
+    return df
+
+
+
+def synthetic_counts(years=10, gaps=3000, seed=0):
+    ''' 
+    Creates an hourly counts df with random shutdowns and spikes before them
+
+    Args:       years   -> int number of years of hourly data
+                gaps    -> int number of shutdowns
+                seed    -> int seed for random generator
+    Returns:    pandas df
+
+    '''
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2019-01-01', periods=years*365*24, freq='h', tz='UTC', name='date')
+    counts = rng.normal(10000, 100, len(index))
+
+    # Shutdowns of 1 to 12 hours, counts right before them are off
+    starts = rng.choice(np.arange(48, len(index) - 96), size=gaps, replace=False)
+    for start in starts:
+        counts[start - 2:start] *= rng.choice([1, 0.9, 1.1])
+        counts[start:start + rng.integers(1, 12)] = 0
+    return pd.DataFrame({'counts': counts}, index=index)
+
+
+def compare(name, df):
+    ''' 
+    Runs both functions on a copy of df, prints timing and whether results are equal
+
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        legacy = legacy_reduce_shutdown_count_errors(df.copy())
+        legacy_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new = reduce_shutdown_count_errors(df.copy())
+        new_s = time.perf_counter() - start
+
+    try:
+        pd.testing.assert_frame_equal(legacy, new)
+        equal = True
+    except AssertionError:
+        equal = False
+
+    shutdowns = int((df['counts'].isna() | (df['counts'] == 0)).astype(int).diff().eq(1).sum())
+    print(f'{name:<36}{len(df):>8}{shutdowns:>7}{legacy_s:>10.3f}{new_s:>10.4f}{legacy_s / new_s:>9.1f}x  {equal}')
+
+
+def main():
+    print(f"{'data':<36}{'rows':>8}{'gaps':>7}{'legacy s':>10}{'new s':>10}{'speedup':>10}  equal")
+    for path in sorted(glob.glob('data/**/*_all_logs.csv', recursive=True)):
+        df = pd.read_csv(path, index_col='date')
+        df.index = pd.to_datetime(df.index, utc=True)
+        compare(os.path.basename(path), df[['counts']])
+
+    compare('synthetic 10 years', synthetic_counts())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+''' 
+
+Benchmark of the concurrent weather download stage against a local stand-in of the IEM ASOS
+download service. The stand-in serves canned csv responses with a delay per station, and fails
+the first request of some stations so retries with backoff are exercised.
+
+Run from repository root:   python benchmarks/bench_weather_fetch.py
+
+'''
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import daily_data_upload
+
+# Seconds taken by stand-in service to answer for each station, stations failing their first request
+DELAYS = {'ATL': 0.5, 'CQT': 0.5, 'SKSM': 3.0, 'DNAA': 0.5, 'ALM': 0.5, 'LYBE': 0.5, 'VCBI': 1.0, 'VCRI': 0.5}
+FLAKY = {'DNAA', 'VCBI'}
+
+CANNED_CSV = (
+    'station,valid,tmpf,dwpf,relh,drct,sknt,p01i,alti,mslp\n'
+    '{station},2024-09-08 00:00,77.00,68.00,73.99,180.00,5.00,0.00,30.01,1016.10\n'
+    '{station},2024-09-08 00:51,75.90,68.00,76.55,170.00,4.00,0.00,30.02,1016.40\n'
+)
+
+
+class StandInIEMHandler(BaseHTTPRequestHandler):
+    ''' 
+    Answers asos.py requests with canned csv data after the station's delay
+
+    '''
+    requests_seen = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        station = parse_qs(urlparse(self.path).query)['station'][0]
+        with self.lock:
+            self.requests_seen[station] = self.requests_seen.get(station, 0) + 1
+            first = self.requests_seen[station] == 1
+
+        time.sleep(DELAYS.get(station, 0.5))
+        if station in FLAKY and first:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = CANNED_CSV.format(station=station).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(base_url, workers):
+    ''' 
+    Downloads all stations with given number of workers and checks every response
+
+    Returns:    tuple [seconds, dict with seconds by station]
+
+    '''
+    StandInIEMHandler.requests_seen = {}
+    stations = {station: {'archive_end': None} for station in DELAYS}
+    station_starts = {station: pd.Timestamp('2024-09-08', tz='UTC') for station in DELAYS}
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = daily_data_upload.fetch_all_weather(station_starts, stations, workers, base_url)
+    seconds = time.perf_counter() - start
+
+    for station, result in results.items():
+        assert result['data'] is not None and result['data'].count(station) == 2, station
+    return seconds, {station: result['seconds'] for station, result in results.items()}
+
+
+def main():
+    # Short backoff so the benchmark measures concurrency rather than waiting
+    daily_data_upload.WEATHER_BACKOFF = 0.25
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInIEMHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/cgi-bin/request/asos.py?'
+
+    serial, _ = run(base_url, workers=1)
+    concurrent, per_station = run(base_url, workers=daily_data_upload.WEATHER_WORKERS)
+    server.shutdown()
+
+    print('Per station seconds (concurrent): ', per_station)
+    print(f'{len(DELAYS)} stations, serial: {serial:.2f}s, {daily_data_upload.WEATHER_WORKERS} workers: {concurrent:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
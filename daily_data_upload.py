@@ -2,20 +2,75 @@
 import pandas as pd
 import numpy as np
 import requests
-from io import StringIO
+from io import StringIO, BytesIO
 from datetime import date, datetime, timedelta
-from detector_info_settings.detector_format_settings import detector_settings
-from database import connect_to_db, connect_to_db_upload, format_sql
-from os import listdir
+from detector_info_settings.detector_format_settings import detector_settings, log_layouts
+from database import table_name, connect_to_db, fetch_series, series_table, create_series_table, upsert_df, lock_table, get_last_date, get_column_sums, get_weather_stats, save_weather_stats, partition_table, expire_series, rollup_series, fetch_detector_weather, bump_data_version, replace_table, ROLLUPS, RAW_SUFFIX, DERIVED_SUFFIX, DERIVED_ROLLUP_COLUMNS
+from os import listdir, getenv
 import os
+import time
+import traceback
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
 from sqlalchemy import text
+from pyexport import build_downloads, expire_exports
 import glob
+import json
 import warnings
 
 # %%
 pd.options.mode.chained_assignment = None
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+# Hours of db data loaded before the new logs' window during incremental ingestion, so shutdown
+# error reduction has the previous 24h statistics and spikes at the window edge can be cleaned up
+INCREMENTAL_CONTEXT = '30D'
+
+# Folder holding one json file per detector with the byte offsets already parsed for each .log file
+CHECKPOINT_DIR = 'app_data/log_checkpoints'
+# Number of bytes at the start of a log file used to recognize it after rotation
+CHECKPOINT_HEAD_BYTES = 64
+
+# Logs ranges larger than this are parsed in blocks of this many bytes and folded into hourly sums,
+# so memory stays bounded on very large logs. Tails are read backwards in blocks of STREAM_TAIL_BYTES
+STREAM_CHUNK_BYTES = 16 * 2**20
+STREAM_TAIL_BYTES = 2**16
+
+# Tables kept for each detector besides its hourly table, which is named as the detector: raw minute
+# rows (database.RAW_SUFFIX) for the last RAW_RETENTION (RAW_RETENTION .env variable overrides it) and the permanent daily and
+# weekly rollups of database.ROLLUPS, which weather stations have too. On postgres, raw and hourly tables
+# are range partitioned on date by month and year, so recent windows are read from a single partition
+# and raw rows expire by dropping whole partitions. Rollups only hold a few hundred rows a year and are
+# plain tables
+RAW_RETENTION = '90D'
+RAW_PARTITION = 'month'
+HOURLY_PARTITION = 'year'
+
+# IEM network metadata of all ASOS stations, cached on disk and refreshed once its time to live is over
+AZOS_GEOJSON_URL = 'http://mesonet.agron.iastate.edu/geojson/network/AZOS.geojson'
+STATION_CACHE_PATH = 'app_data/station_metadata.json'
+STATION_CACHE_TTL = '7D'
+
+# IEM ASOS download service and limits of concurrent weather downloads. The service has protections
+# to keep the number of inbound requests in check, so only a few requests per host run at once and
+# failed ones are retried with an exponential backoff
+IEM_ASOS_URL = 'http://mesonet.agron.iastate.edu/cgi-bin/request/asos.py?'
+WEATHER_WORKERS = 4
+WEATHER_REQUESTS_PER_HOST = 2
+WEATHER_MAX_ATTEMPTS = 6
+WEATHER_BACKOFF = 5
+WEATHER_TIMEOUT = 300
+
+# Weather columns stored for each station, and history downloaded for stations without a table yet
+WEATHER_COLUMNS = ['temp_in_f', 'sea_l_pressure_millibar', 'alti_pressure']
+WEATHER_NEW_STATION_HISTORY = '30D'
+
+# Semaphores limiting concurrent requests to each host
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
 # %% [markdown]
 # # Formatting and download functions
 
@@ -32,204 +87,338 @@ def format_name(detector_name_og):
 
     '''
     print('format_name fn')
-    # Get current data table from db
-    detector_name = detector_name_og.lower()
-
-    # Format detector name to lowercase and check formatting of name 
-    # doesn't have number up front
-    detector_name = detector_name_og.lower()
-    if detector_name.startswith('2') or detector_name.startswith('4'):
-        detector_name = detector_name[1:]+detector_name[0]
-        
-    return detector_name
+    return table_name(detector_name_og)
 
 # %% [markdown]
 # ## get_detector_data
 
 # %%
-def get_detector_data(detector_name):
+def get_detector_data(detector_name, start=None):
     ''' 
     Connects to db and downloads data for specified detector
 
     Args:       detector_name       -> str containing detector name for access to settings
+                start               -> optional datetime, only rows on or after it are downloaded
     Returns:    pandas df
 
     '''
     print('get detector data fn')
-    db = connect_to_db()
-
-    with db.connect() as conn:
-        query = text(f'SELECT * FROM {detector_name}')
-        result = conn.execute(query)
-        counts_data = result.fetchall()
-        conn.close()
-        db.dispose()
+    # New detectors have no table until their first upload
+    if get_last_date(detector_name, connect_to_db()) is None:
+        return pd.DataFrame({'counts': np.array([], dtype=float)}, index=pd.DatetimeIndex([], tz='UTC', name='date'))
 
-        # Format data into pandas df
-        df = format_sql(counts_data)
+    # Only counts on or after start are transferred
+    df = fetch_series(detector_name, ['counts'], start=start)
         
     return df
 
 # %% [markdown]
-# ## get_weather_data
+# # Weather data processing functions
+
+# %% [markdown]
+# ## refresh_station_metadata
 
 # %%
-def get_weather_data(station_id):
+def refresh_station_metadata():
     ''' 
-    Connects to db and downloads data for specified weather station
+    Downloads the IEM AZOS network geojson and saves the properties of each station, indexed by
+    station id, into the station metadata cache file
 
-    Args:       station_id      -> str containing detector name for access to settings
-    Returns:    pandas df
+    Args:       None
+    Returns:    dict with refresh time and station properties by station id
 
     '''
-    print('get_weather_data fn')
-    # Connect to db via sqlalchemy
-    db = connect_to_db()
-        
-    with db.connect() as conn:
-        #Query
-        query = text(f'SELECT * FROM {station_id}')
-        result = conn.execute(query)
-        weather_data = result.fetchall()
-        conn.close()
-        db.dispose()
-        
-        # Format data
-        wdf = format_sql(weather_data)
+    print('refresh_station_metadata fn')
+    # https://mesonet.agron.iastate.edu/sites/networks.php
+    req = requests.get(AZOS_GEOJSON_URL, timeout=60)
+    req.raise_for_status()
+    geojson = req.json()
 
-        # Format index to allow for querying via datetime format and avoid compatibility issues
-        if str(wdf.index.tz) != 'UTC':
-            wdf.index = wdf.index.tz_localize('UTC')
-    
-    return wdf
+    # Only keep properties used to know which data is available for each station
+    stations = {
+        feature['id']: {key: feature['properties'].get(key) for key in ('sid', 'name', 'archive_begin', 'archive_end')}
+        for feature in geojson['features']
+    }
+    cache = {'fetched_at': datetime.utcnow().isoformat(), 'stations': stations}
+
+    # Write to temporary file first so a failed write never leaves cache half written
+    os.makedirs(os.path.dirname(STATION_CACHE_PATH), exist_ok=True)
+    with open(STATION_CACHE_PATH + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(STATION_CACHE_PATH + '.tmp', STATION_CACHE_PATH)
+
+    return cache
 
 # %% [markdown]
-# # Weather data processing functions
+# ## load_station_metadata
+
+# %%
+def load_station_metadata(ttl=STATION_CACHE_TTL):
+    ''' 
+    Loads station metadata from the cache file, refreshing it when it is missing or older than ttl.
+    If the refresh fails, the stale cache is used instead.
+
+    Args:       ttl     -> str or pandas timedelta of how long cached metadata is valid
+    Returns:    dict with station properties by station id
+
+    '''
+    print('load_station_metadata fn')
+    cache = None
+    if os.path.exists(STATION_CACHE_PATH):
+        try:
+            with open(STATION_CACHE_PATH) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            print('Unable to read station metadata cache')
+
+    if cache is None or datetime.utcnow() - datetime.fromisoformat(cache['fetched_at']) > pd.Timedelta(ttl):
+        try:
+            cache = refresh_station_metadata()
+        except Exception as exp:
+            print(f'Unable to refresh station metadata ({exp})')
+            if cache is None:
+                return {}
+            print(f"Using station metadata cached at {cache['fetched_at']}")
+
+    return cache['stations']
 
 # %% [markdown]
 # ## fetch_weather
 
 # %%
-def fetch_weather(my_station, enddt, startdt):
+def fetch_weather(my_station, enddt, startdt, stations=None, base_url=IEM_ASOS_URL):
     ''' 
     Downloads specified station's data from Iowa State University's website
 
     Args:       my_station      -> str with station id name
                 enddt           -> str with datetime index for latest known recorded weather data on site
                 startdt         -> str with datetime index for the last known recorded data on db
-    Returns:    pandas df
+                stations        -> optional dict of station metadata from load_station_metadata, loaded
+                                    from cache if not given
+                base_url        -> str with url of IEM ASOS download service
+    Returns:    str with csv data, or None if not available
 
     '''
 
     print('fetch_weather fn')
-    """Main loop."""
-    # print('Entered fetch_weather function')
-    # Step 1: Fetch global METAR geojson metadata
-    # https://mesonet.agron.iastate.edu/sites/networks.php
-    req = requests.get(
-        "http://mesonet.agron.iastate.edu/geojson/network/AZOS.geojson",
-        timeout=60,
+    # Step 1: Look up station within cached global METAR metadata
+    if stations is None:
+        stations = load_station_metadata()
+
+    props = stations.get(my_station)
+    if props is None:
+        print(f'Station {my_station} not found within station metadata')
+        return None
+
+    # We want stations with data to today (archive_end is null)
+    if props["archive_end"] is None:
+        print('archive_end is null = data to today')
+
+    uri = (
+        f"{base_url}"
+        f"station={my_station}&data=all&year1={startdt.year}"
+        f"&month1={startdt.month}&day1={startdt.day}&"
+        f"year2={enddt.year}&month2={enddt.month}&day2={enddt.day}&"
+        "tz=Etc%2FUTC&format=onlycomma&latlon=no&elev=no&missing=M&trace=T&"
+        "direct=yes&report_type=3"
     )
-    geojson = req.json()
-    for feature in geojson["features"]:
-        station_id = feature["id"]
-        if station_id == my_station:
-            
-            props = feature["properties"]
-            # We want stations with data to today (archive_end is null)
-            if props["archive_end"] is None:
-                print('archive_end is null = data to today')
-
-            # print(f'Fetching data for station {station_id}')
-            # uri = (
-            #     "http://mesonet.agron.iastate.edu/cgi-bin/request/asos.py?"
-            #     f"station={station_id}&data=all&year1=1928&month1=1&day1=1&"
-            #     f"year2={enddt.year}&month2={enddt.month}&day2={enddt.day}&"
-            #     "tz=Etc%2FUTC&format=onlycomma&latlon=no&elev=no&missing=M&trace=T&"
-            #     "direct=yes&report_type=3"
-            # )
-            uri = (
-                "http://mesonet.agron.iastate.edu/cgi-bin/request/asos.py?"
-                f"station={station_id}&data=all&year1={startdt.year}"
-                f"&month1={startdt.month}&day1={startdt.day}&"
-                f"year2={enddt.year}&month2={enddt.month}&day2={enddt.day}&"
-                "tz=Etc%2FUTC&format=onlycomma&latlon=no&elev=no&missing=M&trace=T&"
-                "direct=yes&report_type=3"
-            )
-            # print('uri: ', uri)
-
-            res = requests.get(uri, timeout=300)
-            # print('received response type: ', type(res))
-            return res
+
+    return download_weather_csv(uri)
 
 # %% [markdown]
-# ## daily_weather_to_db fn
+# ## download_weather_csv
 
 # %%
-def daily_weather_to_db():
+def download_weather_csv(uri):
     ''' 
-    Downloads specified station's data from Iowa State University's website
+    Fetches data from the IEM download service. At most WEATHER_REQUESTS_PER_HOST requests run at
+    once per host, each waiting up to WEATHER_TIMEOUT seconds. Failed requests (including responses
+    starting with ERROR) are retried up to WEATHER_MAX_ATTEMPTS times after waiting
+    WEATHER_BACKOFF * 2^attempt seconds.
 
-    Args:       my_station      -> str with station id name
-                enddt           -> str with datetime index for latest known recorded weather data on site
-                startdt         -> str with datetime index for the last known recorded data on db
+    Args:       uri     -> str with url to fetch
+    Returns:    str with csv data, or None if all attempts failed
+
+    '''
+    host = urlparse(uri).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.setdefault(host, threading.BoundedSemaphore(WEATHER_REQUESTS_PER_HOST))
+
+    for attempt in range(WEATHER_MAX_ATTEMPTS):
+        try:
+            with semaphore:
+                res = requests.get(uri, timeout=WEATHER_TIMEOUT)
+            res.raise_for_status()
+            if not res.text.startswith('ERROR'):
+                return res.text
+            print(f'download_weather_csv({uri}) returned {res.text[:100]}')
+        except requests.RequestException as exp:
+            print(f'download_weather_csv({uri}) failed with {exp}')
+
+        # Wait outside of semaphore so other stations can use the host meanwhile
+        if attempt < WEATHER_MAX_ATTEMPTS - 1:
+            time.sleep(WEATHER_BACKOFF * 2**attempt)
+
+    print(f'Exhausted attempts to download {uri}')
+    return None
+
+# %% [markdown]
+# ## fetch_all_weather
+
+# %%
+def fetch_all_weather(station_starts, stations=None, workers=WEATHER_WORKERS, base_url=IEM_ASOS_URL):
+    ''' 
+    Downloads data of several stations concurrently within a thread pool, so slow stations do not
+    hold up the rest
+
+    Args:       station_starts  -> dict with last known recorded datetime on db by station id
+                stations        -> optional dict of station metadata from load_station_metadata
+                workers         -> int number of threads downloading at once
+                base_url        -> str with url of IEM ASOS download service
+    Returns:    dict with csv data (or None if download failed) and seconds taken by station id
+
+    '''
+    print('fetch_all_weather fn')
+    if stations is None:
+        stations = load_station_metadata()
+
+    def timed_fetch(my_station, startdt):
+        start = time.perf_counter()
+        data = fetch_weather(my_station, date.today(), startdt, stations, base_url)
+        return {'data': data, 'seconds': round(time.perf_counter() - start, 2)}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(timed_fetch, my_station, startdt): my_station for my_station, startdt in station_starts.items()}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            print(f"Station {futures[future]} downloaded in {results[futures[future]]['seconds']}s")
+
+    return results
+
+# %% [markdown]
+# ## format_weather_csv
+
+# %%
+def format_weather_csv(data):
+    ''' 
+    Formats csv data downloaded from IEM into a date index df with temperature and pressure columns
+
+    Args:       data    -> str with csv data
+    Returns:    pandas df
+
+    '''
+    print('format_weather_csv fn')
+    # Read as cvs from json file format
+    wdf = pd.read_csv(StringIO(data), sep=',')
+    wdf[wdf=='M'] = np.nan
+
+    # Slice only for needed information based on dates and consider if temperature in farenheit
+    if 'tmpc' in wdf.columns.to_list() and 'tmpf' not in wdf.columns.to_list():
+        wdf['tmpc'] = wdf['tmpc'].apply(pd.to_numeric)
+        wdf['tmpf'] = (wdf['tmpc'] * 9/5) + 32
+    wdf['tmpf'] = wdf['tmpf'].apply(pd.to_numeric)
+
+    if 'mslp' in wdf.columns.to_list():
+        wdf['mslp'] = wdf['mslp'].apply(pd.to_numeric)
+    else:
+        wdf['mslp'] = np.nan
+    
+    if 'alti' in wdf.columns.to_list():
+        wdf['alti'] = wdf['alti'].apply(pd.to_numeric)
+    else:
+        wdf['alti'] = np.nan
+    
+    # Rename columns
+    wdf = wdf.rename(columns={'valid':'date', 'tmpf':'temp_in_f', 'mslp':'sea_l_pressure_millibar', 'alti':'alti_pressure'})
+
+    # Transform dates and make into index
+    wdf['date'] = pd.to_datetime(wdf['date'], utc=True)
+    wdf = wdf[['date'] + WEATHER_COLUMNS]
+    wdf = wdf.set_index('date')
+    wdf.sort_index(inplace=True, ascending=True)
+
+    return wdf
+
+# %% [markdown]
+# ## qc_weather_window
+
+# %%
+def qc_weather_window(wdf, stats):
+    ''' 
+    Removes potential data errors due to shutdowns in some areas, caused by power outages like Abuja,
+    by making rows with values beyond mean +- 4 std into np.nan. Mean and std of each column include
+    the rest of the station's history through its running statistics, so only the new window of data
+    is evaluated. Columns are evaluated one after the other, rows removed by one column no longer
+    count towards the statistics of the next.
+
+    Args:       wdf     -> hourly df with new window of weather data
+                stats   -> dict with [count, sum, sum of squares] by column for station's history
+                            outside of the window
     Returns:    pandas df
 
+    '''
+    for col in WEATHER_COLUMNS:
+        n, total, total_sq = stats[col]
+        values = wdf[col].dropna()
+        n += len(values)
+        total += values.sum()
+        total_sq += (values**2).sum()
+        if n < 2:
+            continue
+
+        mean = total / n
+        std = np.sqrt(max(total_sq - total**2 / n, 0) / (n - 1))
+        wdf.loc[(wdf[col] > mean + (4*std)) | (wdf[col] < mean - (4*std))] = np.nan
+
+    return wdf
+
+# %% [markdown]
+# ## daily_weather_to_db fn
+
+# %%
+def daily_weather_to_db(workers=WEATHER_WORKERS):
+    ''' 
+    Downloads the new data of every station within settings csv from Iowa State University's
+    website, concurrently, then formats it and upserts it to db
+
+    Only the hours of the new window are resampled, evaluated for errors and upserted. Running count,
+    sum and sum of squares of each station column are kept in the weather_stats table (seeded from
+    the station table the first time) so errors are still evaluated against the whole history.
+
+    Args:       workers     -> int number of stations downloaded at once
+    Returns:    None
+
     '''
     print('daily_weather_to_db fn')
     # Get detector name, path, and station ids from detector settings
     detectors = pd.read_csv('detector_info_settings/detector_locations.csv')
     station_ids = list(set(detectors['weather_station'].to_list()))
-    
-    for my_station in station_ids:
 
-        print('Station id: ', my_station, ' counts: ', station_ids.count(my_station))
-        # Get table from database then sort from most recent to least
-        weather_db = get_weather_data(my_station)
-        weather_db = weather_db.resample('h').sum()
-        weather_db.sort_index(ascending=True, inplace=True)
+    # Metadata of all stations from one cache refresh at most
+    stations = load_station_metadata()
+    engine = connect_to_db()
 
+    station_starts = {}
+    for my_station in station_ids:
         # Get last known date of data from current table
-        oldest_ts = pd.to_datetime(weather_db.tail(1).index.values[0])
-
-        # fetch
-        weatherjson = fetch_weather(my_station, date.today(), oldest_ts)
-        # Read as cvs from json file format
-        wdf = pd.read_csv(StringIO(weatherjson.text), sep=',')
-        wdf[wdf=='M'] = np.nan
-
-        # Slice only for needed information based on dates and consider if temperature in farenheit
-        # print('Columns: ', wdf.columns.to_list())
-        if 'tmpc' in wdf.columns.to_list() and 'tmpf' not in wdf.columns.to_list():
-            wdf['tmpc'] = wdf['tmpc'].apply(pd.to_numeric)
-            wdf['tmpf'] = (wdf['tmpc'] * 9/5) + 32
-        wdf['tmpf'] = wdf['tmpf'].apply(pd.to_numeric)
-
-        if 'mslp' in wdf.columns.to_list():
-            wdf['mslp'] = wdf['mslp'].apply(pd.to_numeric)
-        else:
-            wdf['mslp'] = np.nan
-        
-        if 'alti' in wdf.columns.to_list():
-            wdf['alti'] = wdf['alti'].apply(pd.to_numeric)
-        else:
-            wdf['alti'] = np.nan
-        
-        # Rename columns
-        wdf = wdf.rename(columns={'valid':'date', 'tmpf':'temp_in_f', 'mslp':'sea_l_pressure_millibar', 'alti':'alti_pressure'})
-
-        # Transform dates and make into index
-        wdf['date'] = pd.to_datetime(wdf['date'], utc=True)
-        wdf = wdf[['date','temp_in_f', 'sea_l_pressure_millibar', 'alti_pressure']]
-        wdf = wdf.set_index('date')
-        wdf.sort_index(inplace=True, ascending=True)
-
-        # Merge old and newly downloaded data
-        merged = pd.concat([weather_db, wdf])
-        f_merged = merged[~merged.index.duplicated(keep='last')]
-        f_merged.sort_index(ascending=True, inplace=True)
-        wdf = f_merged
-        print('merged: ', wdf.head(1), wdf.tail(1))
+        last_date = get_last_date(my_station.lower(), engine)
+        if last_date is None:
+            last_date = pd.Timestamp.now(tz='UTC') - pd.Timedelta(WEATHER_NEW_STATION_HISTORY)
+        station_starts[my_station] = last_date
+        print('Station id: ', my_station, ' last date on db: ', last_date)
+
+    # fetch all stations at once
+    downloads = fetch_all_weather(station_starts, stations, workers)
+
+    for my_station in station_ids:
+        if downloads[my_station]['data'] is None:
+            print(f'No data downloaded for station {my_station}')
+            continue
+
+        wdf = format_weather_csv(downloads[my_station]['data'])
+        if wdf.empty:
+            continue
 
         # Resample as an hourly df with mean instead of sum
         wdf = wdf.resample('h').mean()
@@ -238,147 +427,38 @@ def daily_weather_to_db():
         wdf.loc[wdf['temp_in_f'] == 0, 'temp_in_f'] = np.nan
         wdf.loc[wdf['sea_l_pressure_millibar'] == 0, 'sea_l_pressure_millibar'] = np.nan
         wdf.loc[wdf['alti_pressure'] == 0, 'alti_pressure'] = np.nan
-        
-        # Remove potential data errors due to shutdowns in some areas
-        # Caused by power outages like Abuja
-        wdf.loc[
-            (wdf['temp_in_f'] > wdf['temp_in_f'].mean() + (4*wdf['temp_in_f'].std())) |
-            (wdf['temp_in_f'] < wdf['temp_in_f'].mean() - (4*wdf['temp_in_f'].std()))] = np.nan
-        wdf.loc[
-            (wdf['sea_l_pressure_millibar'] > wdf['sea_l_pressure_millibar'].mean() + (4*wdf['sea_l_pressure_millibar'].std())) |
-            (wdf['sea_l_pressure_millibar'] < wdf['sea_l_pressure_millibar'].mean() - (4*wdf['sea_l_pressure_millibar'].std()))] = np.nan
-        wdf.loc[
-            (wdf['alti_pressure'] > wdf['alti_pressure'].mean() + (4*wdf['alti_pressure'].std())) |
-            (wdf['alti_pressure'] < wdf['alti_pressure'].mean() - (4*wdf['alti_pressure'].std()))] = np.nan
-
-        # Connect to DB via postgresql and send to db
-        engine, conn = connect_to_db_upload()
-        wdf.to_sql(
-            con=engine, name=f'{my_station.lower()}', if_exists='replace', index_label='date')
-        print(f'Table {my_station.lower()} sent to DB successfully')
-
-        # Make primary key for table via PSYCOPG2
-        cur = conn.cursor()
-        cur.execute(f"""ALTER TABLE {my_station.lower()} ADD PRIMARY KEY (date)""")
-        conn.commit()
-        cur.close()
-        print('Query for primary key sent successfully')
 
+        table_name = my_station.lower()
+        start, end = wdf.index[0], wdf.index[-1]
 
-# %% [markdown]
-# # Detector Data processing functions
+        # Statistics, error removal and upsert are all within one transaction
+        with engine.begin() as conn:
+            lock_table(conn, table_name)
 
-# %% [markdown]
-# ## merge_adding_all_timestamps_hourly
+            # Running statistics of station, seeded from whole table if not stored yet
+            stats = get_weather_stats(my_station, conn)
+            if set(stats) != set(WEATHER_COLUMNS):
+                stats = get_column_sums(table_name, WEATHER_COLUMNS, conn)
 
-# %%
-def merge_adding_all_timestamps_hourly(merged_logs, log_df, lfreq, trim_base_df, trim_log_df):
-    ''' 
-    Merges two provided log df files, first being the base or earliest data, second, most recent data,
-    then trims for error reduction and adjusts data frequency to hourly
+            # Remove contribution of stored hours that are about to be replaced
+            window_sums = get_column_sums(table_name, WEATHER_COLUMNS, conn, start, end)
+            stats = {col: [a - b for a, b in zip(stats[col], window_sums[col])] for col in WEATHER_COLUMNS}
 
-    Args:       detector_name_path  -> folder containing log files to be merged
-                detector_name       -> str containing detector name for access to settings
-    Returns:    merged pandas df
+            wdf = qc_weather_window(wdf, stats)
+            upsert_df(wdf, table_name, conn, partition=HOURLY_PARTITION)
+            rollup_series(table_name, WEATHER_COLUMNS, start, conn)
 
-    '''
-    print('merge_adding_all_timestamps_hourly fn')
-    # Format df to hourly and trim if requested
-    if not merged_logs.empty and trim_base_df:
-        temp = merged_logs.resample('h').sum()
-        # Basic trimming of first and last hour due to timestamps missing
-        temp.drop(temp.head(1).index, inplace=True)
-        temp.drop(temp.tail(1).index, inplace=True)
-        # Replace 0 values to nan
-        temp.loc[temp['counts'] == 0] = np.nan
-        # If initial values on df are all nan, remove until valid value found
-        temp = temp[temp.first_valid_index():]
-        merged_logs = temp
-
-    if not log_df.empty and trim_log_df:
-        temp = log_df.resample('h').sum()
-        temp.drop(temp.head(1).index, inplace=True)
-        temp.drop(temp.tail(1).index, inplace=True)
-        temp.loc[temp['counts'] == 0] = np.nan
-        temp = temp[temp.first_valid_index():]
-        log_df = temp
-
-    # Check if df is not empty after trimming and perform merge
-    if not merged_logs.empty and not log_df.empty:
-
-        # Extract first date from log df to be merged at end of current base df
-        first_log_date = str(log_df.head(1).index[0])
-        # Extract last date from base df
-        last_log_date = str(merged_logs.tail(1).index[0])
-
-        # Check if dates are equal or in the right chronological order ascending
-        if str(merged_logs.head(1).index[0]) <= first_log_date:
-            # If able to find first log date from log df on merged_logs, no detector 
-            # has shutdown and just need to add at end of file whatever is not yet part of base df
-            try:
-                bf_first_log_date = str(merged_logs.iloc[merged_logs.get_loc(first_log_date) - 1].name)
-                print('No shutdown since last log data integration')
-                # Merge
-                merged = pd.concat([merged_logs, log_df])
-                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
-                # Sort fixed merged log files
-                merged = final_merged_logs.sort_index()
-            
-            # else, logs must be merged considering missing counts due to detector shutoff time
-            except:
-                print('Last log date bf shutdown: ', last_log_date, '\nFirst log date after shutdown: ', first_log_date)
-                # Create continuous range of dates to complete df timeline for missing date indexes
-                date_range = pd.date_range(start=last_log_date, end=first_log_date, freq=lfreq, tz='UTC')
-                # Create df containing missing dates as index and np.nan values
-                offline_df = pd.DataFrame(index=date_range, columns=merged_logs.columns, data=np.nan)
-                # Update current logs to include missing detector data time stamps but with nan values for graph
-                complete_logs = pd.concat([offline_df, log_df])
-                merged = pd.concat([merged_logs, complete_logs])
-                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
-                # Sort fixed merged log files
-                merged = final_merged_logs.sort_index()
-
-        # Reverse which file is merged at end of the other to ensure chronological order
-        else:
-            # Extract first date from log df to be merged at end of current base df
-            first_log_date = str(merged_logs.head(1).index[0])
-            # Extract last date from base df
-            last_log_date = str(log_df.tail(1).index[0])
+            # Add contribution of new hours
+            for col in WEATHER_COLUMNS:
+                values = wdf[col].dropna()
+                stats[col] = [stats[col][0] + len(values), stats[col][1] + values.sum(), stats[col][2] + (values**2).sum()]
+            save_weather_stats(my_station, stats, conn)
 
-            try:
-                bf_first_log_date = str(log_df.iloc[log_df.get_loc(first_log_date) - 1].name)
-                print('No shutdown since last log data integration')
-                # Merge
-                merged = pd.concat([log_df, merged_logs])
-                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
-                # Sort fixed merged log files
-                merged = final_merged_logs.sort_index()
-            
-            # else, logs must be merged considering missing counts due to detector shutoff time
-            except:
-                print('Last log date bf shutdown: ', last_log_date, '\nFirst log date after shutdown: ', first_log_date)
-                # Create continuous range of dates to complete df timeline for missing date indexes
-                date_range = pd.date_range(start=last_log_date, end=first_log_date, freq=lfreq, tz='UTC')
-                # Create df containing missing dates as index and np.nan values
-                offline_df = pd.DataFrame(index=date_range, columns=merged_logs.columns, data=np.nan)
-                # Update current logs to include missing detector data time stamps but with nan values for graph
-                complete_logs = pd.concat([offline_df, merged_logs])
-                merged = pd.concat([log_df, complete_logs])
-                final_merged_logs = merged[~merged.index.duplicated(keep='last')]
-                # Sort fixed merged log files
-                merged = final_merged_logs.sort_index()
-    
-    # Only merged logs remains after trimming
-    elif not merged_logs.empty:
-        merged = merged_logs
-    # Only log df remains after trimming
-    elif not log_df.empty:
-        merged = log_df
-    # None have data, return empty df
-    else:
-        merged = pd.DataFrame()
+        print(f'Table {table_name} upserted successfully from {start} to {end}')
 
-    return merged
+
+# %% [markdown]
+# # Detector Data processing functions
 
 # %% [markdown]
 # ## merge_logs_dfs
@@ -386,62 +466,58 @@ def merge_adding_all_timestamps_hourly(merged_logs, log_df, lfreq, trim_base_df,
 # %%
 def merge_log_dfs(log_dfs_list, detector_name):
     '''  
-    Organizes each log df within a list of dfs chronologically, then merges them all.
-    This includes adding missing time between end of one log to the other as np.NaN
-    values due to monitor shutdowns.
+    Merges all log dfs of a monitor at once, treating each as an hourly interval. Each log's first and
+    last hour are trimmed as their counts are incomplete, as are leading hours without counts. Where
+    intervals overlap, the log that starts later takes precedence (ties go to the later one on the
+    list), as it holds the most recent recording of those hours. Missing time between logs due to
+    monitor shutdowns is added as np.NaN values.
 
-    Args:       detector_name -> string containing detector name from settings
-                log_dfs_list -> list containing n number of log dfs from a specific
-                                monitor data folder
-    Returns:    merged pandas df with all logs
+    Args:       log_dfs_list    -> list containing n number of log dfs from a specific
+                                   monitor data folder, minute rows or hourly sums
+                detector_name   -> string containing detector name from settings
+    Returns:    merged hourly pandas df with all logs
 
     '''
     print('merge_log_dfs fn')
-    if len(log_dfs_list) == 0 or log_dfs_list == None:
+    log_dfs_list = [df for df in (log_dfs_list or []) if not df.empty]
+    if len(log_dfs_list) == 0:
         print('Given list of log dfs is empty. Try again with to run the all_monitor_logs_to_dfs() with correct file path')
-    elif len(log_dfs_list) > 1:
-        
-        # Sort logs from latest to earliest based on initial log date to ensure optimal merging
-        # Extract first row date of each log df into list
-        logs_l = [str(df.head(1).index[0]) for df in log_dfs_list]
-        # Make dictionary containing index of corresponding date on provided logs list
-        logs_dict = {}
-        for i in range(len(logs_l)):
-            logs_dict[logs_l[i]] = i
-        # sort values in ascending order
-        logs_l.sort()
-        # Create sorted list of logs
-        new_logs_df_list = []
-        for i in range(len(logs_l)):
-            new_logs_df_list.append(log_dfs_list[logs_dict[logs_l[i]]])
-        
-        # Extract first df on list and to start merging with rest of dfs
-        merged_logs = new_logs_df_list[0].copy(deep=True)
-        # Extract frequency of data from given monitor
-        lfreq = detector_settings[detector_name]['freq']
-        # Flag for initial merged df to be trimmed for incomplete hourly logs
-        trim_initial_merged = True
-
-        # Navigate through list of dfs and merge, making the df hourly
-        for i in range(1, len(new_logs_df_list)):
-            print(f'Log file index {i}')
-            merged_logs = merge_adding_all_timestamps_hourly(merged_logs, new_logs_df_list[i], lfreq, trim_initial_merged, True)
-            trim_initial_merged = False # Set flag to false to no longer trim base df as it has been done
-
-    # Else, the df list only has one df so no merging within list
-    else: 
-        merged_logs = log_dfs_list[0].copy(deep=True)
-        # Sample by hour
-        merged_logs1 = merged_logs.resample('h').sum()
-        # Trim first and last hour because of data missing due to log being incomplete
-        merged_logs1.drop(merged_logs1.head(1).index, inplace=True)
-        merged_logs1.drop(merged_logs1.tail(1).index, inplace=True)
-        merged_logs1.loc[merged_logs1['counts'] == 0] = np.nan
-        
-        # Reassign for return statement accuracy
-        merged_logs = merged_logs1
+        return pd.DataFrame()
+
+    # Hourly sums of all logs in one pass, keyed by log and hour
+    log_ids = np.repeat(np.arange(len(log_dfs_list)), [len(df) for df in log_dfs_list])
+    stacked = pd.concat(log_dfs_list)[['counts']]
+    hourly = stacked.groupby([log_ids, stacked.index.floor('h')]).sum()
+    hourly.index.names = ['log', 'date']
+    log_level = hourly.index.get_level_values('log')
+    hours = pd.Series(hourly.index.get_level_values('date').asi8, index=log_level)
+
+    # Interval of each log, from its first hour with counts to the hour before its last one
+    one_hour = pd.Timedelta('1h').value
+    first = hours.groupby(level=0).min()
+    last = hours.groupby(level=0).max()
+    valid = (hourly['counts'].to_numpy() != 0) & (hours.to_numpy() > first.loc[log_level].to_numpy()) \
+        & (hours.to_numpy() < last.loc[log_level].to_numpy())
+    starts = hours[valid].groupby(level=0).min()
+    if starts.empty:
+        return pd.DataFrame(columns=['counts'], index=pd.DatetimeIndex([], tz='UTC', name='date'))
+    ends = last.loc[starts.index] - one_hour
+
+    # Later starting logs take precedence, so each one overwrites the hours of its interval
+    log_starts = [log_dfs_list[i].index.min().value for i in starts.index]
+    grid_start = starts.min()
+    winner = np.full((ends.max() - grid_start) // one_hour + 1, -1)
+    for i in np.argsort(log_starts, kind='stable'):
+        winner[(starts.iloc[i] - grid_start) // one_hour:(ends.iloc[i] - grid_start) // one_hour + 1] = starts.index[i]
+
+    # Take each hour from its winning log, hours without one are left as np.nan
+    grid = pd.date_range(pd.Timestamp(grid_start, tz='UTC'), periods=len(winner), freq='h', name='date')
+    merged = hourly.reindex(pd.MultiIndex.from_arrays([winner, grid], names=['log', 'date']))
+    merged.index = grid
+    # Replace 0 values to nan
+    merged.loc[merged['counts'] == 0] = np.nan
 
-    return merged_logs
+    return merged
 
 # %% [markdown]
 # ## log_df_formatting
@@ -450,7 +526,8 @@ def merge_log_dfs(log_dfs_list, detector_name):
 def log_df_formatting(logs_df, detector_name):
     ''' 
     Formats given logs into a datetime and counts column df. If desired, you can keep the
-    additional counts columns in case needed for later.
+    additional counts columns in case needed for later. Only used for detectors without a
+    'layout' in settings, parse_log is used otherwise.
     
     Args:       logs_df         -> pandas df containing non-formatted data where only one column
                                     named 'counts' exists and has all data.
@@ -553,17 +630,351 @@ def log_df_formatting(logs_df, detector_name):
     
     return ldf2
 
+# %% [markdown]
+# ## localize_log_dates
+
+# %%
+def localize_log_dates(dates, monitor_tz):
+    ''' 
+    Localizes naive log dates to the monitor location's timezone and converts them to UTC.
+    Dates that are already timezone aware are only converted.
+
+    Args:       dates       -> pandas datetime series
+                monitor_tz  -> str with timezone of monitor from settings
+    Returns:    pandas datetime series in UTC
+
+    '''
+    if dates.dt.tz is None:
+        # Localize to monitor location's timezone, ambiguous to infer fall DST change an hour back, 
+        # and nonexistent for clocks moving forward due to DST
+        try:
+            dates = dates.dt.tz_localize(monitor_tz, ambiguous='infer', nonexistent='shift_forward')
+        except Exception:
+            # If duplicate dates due to localization into a timezone with daylight, choose to keep one
+            dates = dates.dt.tz_localize(monitor_tz, ambiguous=True, nonexistent='shift_forward')
+
+    # Format to UTC so it can be merged with the weather app's data that is also UTC
+    if str(dates.dt.tz) != 'UTC':
+        dates = dates.dt.tz_convert('UTC')
+
+    return dates
+
+# %% [markdown]
+# ## parse_log
+
+# %%
+def parse_log(source, detector_name):
+    ''' 
+    Parses a log file into a date index and counts column df based on the layout declared for the
+    detector in settings. Only the counts and date fields are read, with explicit dtypes and an
+    explicit date format, instead of splitting whole lines and guessing each date's format.
+
+    Args:       source          -> str with path of log file or binary file-like object with log lines
+                detector_name   -> str containing detector name for access to settings
+    Returns:    pandas df containing formatted logs as date index and counts column
+
+    '''
+    settings = detector_settings[detector_name]
+    layout = log_layouts[settings['layout']]
+    counts_col = settings['counts_col']
+
+    # Date columns to be read, skipping fields not needed to build the date
+    first_date_col = settings['date_col'] + layout['skip_date_fields']
+    date_cols = list(range(first_date_col, settings['date_col'] + layout['date_fields']))
+
+    # If log has column titles on first line, skip it
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            first_line = f.readline()
+    else:
+        position = source.tell()
+        first_line = source.readline()
+        source.seek(position)
+    skiprows = 1 if b'date' in first_line else 0
+
+    ldf = pd.read_csv(
+        source,
+        sep=layout['sep'],
+        header=None,
+        skiprows=skiprows,
+        usecols=[counts_col] + date_cols,
+        dtype={counts_col:'float64', **{col:str for col in date_cols}},
+        skipinitialspace=True,
+        on_bad_lines='skip',
+        engine='c',
+    )
+
+    # Join date fields if date was split by separator
+    dates = ldf[date_cols[0]]
+    for col in date_cols[1:]:
+        dates = dates + ' ' + ldf[col]
+
+    # Transform date column string into a datetime format type, unparsable dates become NaT
+    ldf['date'] = pd.to_datetime(dates, format=layout['date_format'], errors='coerce')
+    ldf = ldf.rename(columns={counts_col:'counts'})
+    ldf = ldf.loc[ldf['date'].notna(), ['date', 'counts']]
+
+    ldf['date'] = localize_log_dates(ldf['date'], settings['timezone'])
+
+    return ldf.set_index('date')
+
+# %% [markdown]
+# ## load_log_checkpoints
+
+# %%
+def load_log_checkpoints(detector_name):
+    ''' 
+    Loads checkpoints of log files already parsed for given detector. Each checkpoint is keyed
+    by the log path and holds its inode, size, byte offset where next read starts, a fingerprint
+    of the first bytes of the file and the last parsed timestamp.
+
+    Args:       detector_name   -> str containing detector name for access to settings
+    Returns:    dict
+
+    '''
+    path = os.path.join(CHECKPOINT_DIR, f'{detector_name}.json')
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f'Unable to read checkpoints {path}, logs will be read from the start')
+        return {}
+
+# %% [markdown]
+# ## save_log_checkpoints
+
+# %%
+def save_log_checkpoints(detector_name, checkpoints):
+    ''' 
+    Saves checkpoints of log files for given detector, dropping entries of logs that no longer exist.
+    File is written to a temporary path first and then replaced so a crash never leaves it half written.
+
+    Args:       detector_name   -> str containing detector name for access to settings
+                checkpoints     -> dict of checkpoints keyed by log path
+    Returns:    None
+
+    '''
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = os.path.join(CHECKPOINT_DIR, f'{detector_name}.json')
+    checkpoints = {log: c for log, c in checkpoints.items() if os.path.exists(log)}
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoints, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+# %% [markdown]
+# ## get_new_log_range
+
+# %%
+def get_new_log_range(log_path, checkpoint):
+    ''' 
+    Finds the byte range of the complete lines appended to a log file since its checkpoint, without
+    reading them. If the file was rotated (different inode or first bytes) or truncated (smaller than
+    the checkpoint offset) the range starts at the beginning of the file.
+
+    Args:       log_path    -> str with path of log file
+                checkpoint  -> dict with last checkpoint of log file or None if never read
+    Returns:    tuple [int offset where new lines start, int offset where they end, os.stat_result, bytes head]
+
+    '''
+    stat = os.stat(log_path)
+
+    with open(log_path, 'rb') as f:
+        head = f.read(CHECKPOINT_HEAD_BYTES)
+        offset = 0
+
+        if checkpoint is not None:
+            if (checkpoint['inode'] == stat.st_ino and checkpoint['head'] == head.hex()
+                    and checkpoint['offset'] <= stat.st_size):
+                offset = checkpoint['offset']
+            else:
+                print(f'Log {log_path} rotated or truncated, reading from start')
+
+        # Only read up to size at time of stat, lines written after are read next run.
+        # Look backwards for the last newline to leave a partially written last line for next run
+        end = stat.st_size
+        while end > offset:
+            block_start = max(offset, end - STREAM_TAIL_BYTES)
+            f.seek(block_start)
+            last_newline = f.read(end - block_start).rfind(b'\n')
+            if last_newline >= 0:
+                end = block_start + last_newline + 1
+                break
+            end = block_start
+
+    return offset, end, stat, head
+
+# %% [markdown]
+# ## iter_log_chunks
+
+# %%
+def iter_log_chunks(log_path, start, end, chunk_bytes=STREAM_CHUNK_BYTES):
+    ''' 
+    Reads a byte range of a log file in blocks of about chunk_bytes, each ending at a line break,
+    so no more than one block is held in memory at a time
+
+    Args:       log_path    -> str with path of log file
+                start       -> int offset where range starts, at the start of a line
+                end         -> int offset where range ends, right after a line break
+                chunk_bytes -> int number of bytes read at a time
+    Returns:    generator of tuples [int offset where block starts, bytes with complete lines]
+
+    '''
+    with open(log_path, 'rb') as f:
+        f.seek(start)
+        block_start = start
+        carry = b''
+
+        while block_start + len(carry) < end:
+            data = carry + f.read(min(chunk_bytes, end - block_start - len(carry)))
+            cut = data.rfind(b'\n') + 1
+            # A single line longer than a block is kept whole within the next one
+            if cut == 0:
+                carry = data
+                continue
+            yield block_start, data[:cut]
+            block_start += cut
+            carry = data[cut:]
+
+# %% [markdown]
+# ## parse_log_bytes
+
+# %%
+def parse_log_bytes(data, detector_name):
+    ''' 
+    Parses complete lines of a log file held in memory, based on the layout of the detector or the
+    legacy formatting if it has none
+
+    Args:       data            -> bytes with complete lines of a log file
+                detector_name   -> str containing detector name for access to settings
+    Returns:    pandas df with 'counts' column indexed by UTC 'date'
+
+    '''
+    if 'layout' in detector_settings[detector_name]:
+        return parse_log(BytesIO(data), detector_name)
+
+    # Remove empty lines and column titles
+    lines = [line for line in data.decode(errors='replace').splitlines() if line.strip() and 'date' not in line]
+    # Format df based on monitor settings
+    return log_df_formatting(pd.DataFrame({'counts': lines}), detector_name)
+
+# %% [markdown]
+# ## stream_log_to_hourly
+
+# %%
+def stream_log_to_hourly(log_path, detector_name, start=0, end=None, chunk_bytes=STREAM_CHUNK_BYTES, raw_since=None, raw_dfs=None):
+    ''' 
+    Parses a byte range of a log file block by block, folding each block into hourly sums and number
+    of minutes logged so memory stays bounded by the block size regardless of the log size. Hours
+    split between two blocks are added back together.
+
+    Args:       log_path        -> str with path of log file
+                detector_name   -> str containing detector name for access to settings
+                start           -> int offset where range starts, at the start of a line
+                end             -> int offset where range ends, right after a line break, or None for end of file
+                chunk_bytes     -> int number of bytes parsed at a time
+                raw_since       -> optional UTC timestamp, parsed rows from it on are kept whole
+                raw_dfs         -> optional list where dfs of rows kept whole are appended
+    Returns:    tuple [pandas df with 'counts' and 'minutes' columns indexed by UTC hourly 'date',
+                       pandas timestamp of last line parsed or None]
+
+    '''
+    print('stream_log_to_hourly fn')
+    if end is None:
+        end = os.path.getsize(log_path)
+
+    hourly_list = []
+    last_ts = None
+    for _, data in iter_log_chunks(log_path, start, end, chunk_bytes):
+        temp = parse_log_bytes(data, detector_name)
+        if temp.empty:
+            continue
+        last_ts = temp.index.max() if last_ts is None else max(last_ts, temp.index.max())
+        if raw_dfs is not None:
+            raw_dfs.append(temp[temp.index >= raw_since])
+        hourly = temp['counts'].groupby(temp.index.floor('h')).agg(['sum', 'count'])
+        hourly_list.append(hourly.set_axis(['counts', 'minutes'], axis=1))
+
+    if not hourly_list:
+        return pd.DataFrame({'counts': [], 'minutes': []}, index=pd.DatetimeIndex([], tz='UTC', name='date')), last_ts
+
+    # Hours split between blocks show up twice, once per block
+    hourly = pd.concat(hourly_list).groupby(level=0).sum()
+    hourly.index.name = 'date'
+
+    return hourly, last_ts
+
+# %% [markdown]
+# ## find_rewind_offset
+
+# %%
+def find_rewind_offset(log_path, detector_name, start, end, last_ts):
+    ''' 
+    Finds the offset of the first line logged on the hour before the last one, reading backwards
+    from end of range in growing blocks, so the last incomplete hour gets parsed whole next run
+
+    Args:       log_path        -> str with path of log file
+                detector_name   -> str containing detector name for access to settings
+                start           -> int offset where parsed range starts, at the start of a line
+                end             -> int offset where parsed range ends, right after a line break
+                last_ts         -> pandas timestamp of last line parsed
+    Returns:    int offset where next run should start reading
+
+    '''
+    rewind_ts = last_ts.floor('h') - pd.Timedelta('1h')
+    block_bytes = STREAM_TAIL_BYTES
+
+    with open(log_path, 'rb') as f:
+        while True:
+            block_start = max(start, end - block_bytes)
+            f.seek(block_start)
+            data = f.read(end - block_start)
+            # Leave out the first line unless it starts the range, as it may be partial
+            if block_start > start:
+                first_line_end = data.find(b'\n') + 1
+                block_start += first_line_end
+                data = data[first_line_end:]
+
+            # Byte offset where each line starts
+            newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n'))
+            line_starts = block_start + np.concatenate(([0], newlines[:-1] + 1))
+
+            temp = parse_log_bytes(data, detector_name) if len(data) else pd.DataFrame()
+            keep = int((temp.index >= rewind_ts).sum()) if not temp.empty else 0
+
+            # Stop once block also holds lines older than the rewind hour, or covers the whole range
+            if keep < len(line_starts) or block_start == start:
+                keep = min(keep, len(line_starts))
+                return int(line_starts[-keep]) if keep > 0 else end
+
+            block_bytes *= 4
+
 # %% [markdown]
 # ## all_detector_logs_to_dfs
 
 # %%
-def all_detector_logs_to_dfs(detector_name_path, detector_name):
+def all_detector_logs_to_dfs(detector_name_path, detector_name, checkpoints=None, raw_since=None, raw_dfs=None):
     ''' 
     Creates a df of merged log files. This assumes all logs within given monitor folder
     name share same format style. Log files should be reviewed before applying this function.
 
+    If checkpoints are given, only lines appended since the last checkpoint of each log are parsed
+    and checkpoints are updated in place. The new offset is rewound to the start of the hour before
+    the last parsed one, so the hour that was still incomplete (and trimmed) is parsed again whole
+    on next run. Checkpoints should only be saved once the parsed data is uploaded.
+
+    Ranges larger than STREAM_CHUNK_BYTES are parsed block by block into hourly sums, which merging
+    takes as the same hourly counts as minute data, so very large logs fit in memory. Checkpoints keep the timestamp of the last line parsed either way. If raw_dfs
+    is given, parsed rows from raw_since on are also appended to it whole, one df per log.
+
     Args:       detector_name_path  -> folder containing log files to be merged
                 detector_name       -> str containing detector name for access to settings
+                checkpoints         -> optional dict of checkpoints from load_log_checkpoints
+                raw_since           -> optional UTC timestamp of oldest row kept whole
+                raw_dfs             -> optional list where dfs of rows kept whole are appended
     Returns:    merged pandas df
 
     '''
@@ -577,28 +988,88 @@ def all_detector_logs_to_dfs(detector_name_path, detector_name):
     logs_df_list = []
 
     for log_file in logs_list:
-        # Read log file as df separating rows
-        temp = pd.read_csv(detector_name_path+'/'+log_file, sep='\t', names=['counts'])
-        # If df has column titles, remove as it causes issues with below functions
-        if temp.head(1)['counts'].str.contains('date').any():
-            temp.drop(temp.head(1).index, inplace=True)
-        # Format df based on monitor settings
-        temp = log_df_formatting(temp, detector_name)
-        # Append to list of dfs
+        log_path = os.path.join(detector_name_path, log_file)
+
+        checkpoint = None
+        if checkpoints is not None:
+            # Skip log right away if it has not changed since last checkpoint
+            checkpoint = checkpoints.get(log_path)
+            stat = os.stat(log_path)
+            if checkpoint is not None and checkpoint['inode'] == stat.st_ino and checkpoint['size'] == stat.st_size:
+                print(f'No new lines on {log_file}')
+                continue
+
+        offset, end, stat, head = get_new_log_range(log_path, checkpoint)
+        if end <= offset:
+            continue
+
+        if end - offset > STREAM_CHUNK_BYTES:
+            log_raw_dfs = [] if raw_dfs is not None else None
+            temp, last_ts = stream_log_to_hourly(log_path, detector_name, offset, end, raw_since=raw_since, raw_dfs=log_raw_dfs)
+            if log_raw_dfs:
+                raw_dfs.append(pd.concat(log_raw_dfs))
+        else:
+            with open(log_path, 'rb') as f:
+                f.seek(offset)
+                temp = parse_log_bytes(f.read(end - offset), detector_name)
+            last_ts = temp.index.max()
+            if raw_dfs is not None:
+                raw_dfs.append(temp[temp.index >= raw_since])
+        if temp.empty:
+            continue
         logs_df_list.append(temp)
 
+        if checkpoints is not None:
+            checkpoints[log_path] = {
+                'inode': stat.st_ino,
+                'size': stat.st_size,
+                'offset': find_rewind_offset(log_path, detector_name, offset, end, last_ts),
+                'head': head.hex(),
+                'last_ts': str(last_ts),
+            }
+
     return logs_df_list
 
+# %% [markdown]
+# ## edge_window_stats
+
+# %%
+def edge_window_stats(values, starts, ends):
+    ''' 
+    Calculates mean and standard deviation of values[start:end] for many windows of up to 24 values
+    at once, ignoring np.nan values like pandas does
+
+    Args:       values  -> numpy array of float values
+                starts  -> numpy array of int positions where each window starts
+                ends    -> numpy array of int positions where each window ends (excluded)
+    Returns:    tuple [numpy array of means, numpy array of standard deviations]
+
+    '''
+    # Matrix with one row per window, positions past window end are np.nan
+    positions = starts[:, None] + np.arange(24)[None, :]
+    windows = np.where(positions < ends[:, None], values[np.minimum(positions, len(values) - 1)], np.nan)
+
+    # Windows with less than 2 values have no std (or mean), same as pandas
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmean(windows, axis=1), np.nanstd(windows, axis=1, ddof=1)
+
 # %% [markdown]
 # ## reduce_shutdown_count_errors
 
 # %%
-def reduce_shutdown_count_errors(df):
+def reduce_shutdown_count_errors(df, sums=None):
     ''' 
     Removes any values before and after shutdowns (up to 3) where values are greater or less than
     the mean for a 24 (or less, if not enough available) window of data +- the standard dev.*1.5
+    All shutdown edges are found and evaluated at once with numpy instead of segment by segment.
+
+    Values beyond the mean +- 3 std are removed first. When df is only a window of the history, sums
+    of the whole history give that mean and std, so the window is cleaned as on a full upload.
 
     Args:       df
+                sums    -> optional [count, sum, sum of squares] of counts of the whole history
+                            including df, as from database.get_column_sums
     Returns:    df
 
     '''
@@ -619,56 +1090,51 @@ def reduce_shutdown_count_errors(df):
     df = df2.sort_index(ascending=True)
 
     # Do initial cleanup of anything above or below the mean + std*3
-    df.loc[(df['counts'] > df['counts'].mean() + (3*df['counts'].std())) | (df['counts'] < df['counts'].mean() - (3*df['counts'].std()))] = np.nan
+    if sums is None:
+        mean, std = df['counts'].mean(), df['counts'].std()
+    else:
+        n, total, total_sq = sums
+        mean = total / n if n else np.nan
+        std = np.sqrt(max(total_sq - total**2 / n, 0) / (n - 1)) if n > 1 else np.nan
+    df.loc[(df['counts'] > mean + (3*std)) | (df['counts'] < mean - (3*std))] = np.nan
     df = df[(df.first_valid_index()):df.last_valid_index()]
     
-    # Extract initial indexes if any
-    f = df.index.get_loc(df.first_valid_index())
-    l = df.index.get_loc(pd.to_datetime(df.isna().idxmax().head(1).values[0], utc=True))
-
-    # If the last index for interval is the same as initial index of df, it means
-    # there have never been any disruptions on data due to shutdowns
-    if l != f:
-
-        while l <= len(df) and f != l:
-            # Deal with spikes after shutdowns, calculate mean and std
-            if (f+24) < l:
-                mean = df[f:(f+24)].mean().values[0]
-                std = df[f:(f+24)].std().values[0]
-            else:
-                mean = df[f:(l - 1)].mean().values[0]
-                std = df[f:(l - 1)].std().values[0]
-            
-            # Check if first three values are lesser or greater than mean +- std, then assign np.nan
-            if df.iloc[f]['counts'] < (mean - (std*1.5)) or df.iloc[f]['counts'] > (mean + (std*2)):
-                df.iloc[f]['counts'] = np.nan
-            if f+1 < len(df) and df.iloc[f+1]['counts'] < (mean - (std*1.5)) or df.iloc[f+2]['counts'] > (mean + (std*2)):
-                df.iloc[(f+1)]['counts'] = np.nan
-            if f+2 < len(df) and df.iloc[f+2]['counts'] < (mean - (std*1.5)) or df.iloc[f+2]['counts'] > (mean + (std*2)):
-                df.iloc[(f+2)]['counts'] = np.nan
-
-            # Deal with spikes before shutdowns
-            if (l-25) > f:
-                mean = df[(l - 25):(l - 1)].mean().values[0]
-                std = df[(l - 25):(l - 1)].std().values[0]
-            else:
-                mean = df[f:(l - 1)].mean().values[0]
-                std = df[f:(l - 1)].std().values[0]
-
-            # Check if last three values are lesser or greater than mean +- std, then assign np.nan
-            if df.iloc[l-1]['counts'] < (mean - (std*1.5)) or df.iloc[l-1]['counts'] > (mean + (std*2)):
-                df.iloc[(l-1)]['counts'] = np.nan
-            if  l-2 > 0 and df.iloc[l-2]['counts'] < (mean - (std*1.5)) or df.iloc[l-2]['counts'] > (mean + (std*2)):
-                df.iloc[(l-2)]['counts'] = np.nan
-            if l-3 > 0 and df.iloc[l-3]['counts'] < (mean - (std*1.5)) or df.iloc[l-3]['counts'] > (mean + (std*2)):
-                df.iloc[(l-3)]['counts'] = np.nan
-
-            # Obtain new start and end index for evaluation of next df slice
-            f = df.index.get_loc(df[l:].first_valid_index())
-            l = df.index.get_loc(pd.to_datetime(df[f:].isna().idxmax().head(1).values[0], utc=True))
-            
-            # if l == f:
-            #     break
+    # Find every online segment in one pass via run-length encoding of the nan mask
+    values = df['counts'].to_numpy(dtype='float64', copy=True)
+    online = np.concatenate(([0], (~np.isnan(values)).astype(np.int8), [0]))
+    f = np.flatnonzero(np.diff(online) == 1)
+    l = np.flatnonzero(np.diff(online) == -1)
+
+    # Last segment reaches end of df so it has no shutdown after it, and segments shorter
+    # than 3 hours never have a valid std within their edge windows, so neither are evaluated
+    f, l = f[:-1], l[:-1]
+    f, l = f[(l - f) >= 3], l[(l - f) >= 3]
+
+    if len(f) > 0:
+        # Deal with spikes after shutdowns, mean and std of first 24 values (or until the one before last)
+        mean, std = edge_window_stats(values, f, np.where((f + 24) < l, f + 24, l - 1))
+        low, high = mean - (std*1.5), mean + (std*2)
+
+        # Check if first three values are lesser or greater than mean +- std, then assign np.nan.
+        # Second value is also removed when the third one is too high
+        c0, c1, c2 = values[f], values[f + 1], values[f + 2]
+        values[f[(c0 < low) | (c0 > high)]] = np.nan
+        values[f[(c1 < low) | (c2 > high)] + 1] = np.nan
+        values[f[(c2 < low) | (c2 > high)] + 2] = np.nan
+
+        # Deal with spikes before shutdowns, mean and std of the 24 values before the last one
+        # (or from segment start), once values after shutdown are removed
+        mean, std = edge_window_stats(values, np.where((l - 25) > f, l - 25, f), l - 1)
+        low, high = mean - (std*1.5), mean + (std*2)
+
+        # Check if last three values are lesser or greater than mean +- std, then assign np.nan.
+        # Only values greater than mean are removed when they are the first row of df
+        c1, c2, c3 = values[l - 1], values[l - 2], values[l - 3]
+        values[l[(c1 < low) | (c1 > high)] - 1] = np.nan
+        values[l[((l - 2 > 0) & (c2 < low)) | (c2 > high)] - 2] = np.nan
+        values[l[((l - 3 > 0) & (c3 < low)) | (c3 > high)] - 3] = np.nan
+
+        df['counts'] = values
 
     # Ensure all values == 0 are not accounted numerically during graphing and mean/std calculations
     df.loc[df['counts'] == 0] = np.nan
@@ -681,44 +1147,89 @@ def reduce_shutdown_count_errors(df):
 # ## process_and_upload_logs
 
 # %%
-def process_and_upload_logs(detector_data, detector_file_path, detector_name_og, detector_name):
+def process_and_upload_logs(detector_data, detector_file_path, detector_name_og, detector_name, incremental=False):
     ''' 
     Function that handles the overall processing of new logs and insertion into table
 
-    Args:       detector_data       -> df containing all detector logs
+    Args:       detector_data       -> df containing all detector logs, or None when incremental
                 detector_file_path  -> local/server path for files for specified detector locations
                 detector_name_og    -> name as str without any formatting enforced for naming files and subfolder
                 detector_name       -> name as str having been formatted for purposes of accessing right table on 
                                         db
+                incremental         -> bool, if True only the time window covered by the new logs (plus
+                                        INCREMENTAL_CONTEXT before it) is downloaded, processed and upserted
+                                        instead of replacing the whole table
+    Returns:    int number of hourly rows sent to db
 
     '''
     print('process_and_upload_logs fn')
-    # List of formatted logs into dfs
-    log_dfs_list = all_detector_logs_to_dfs(detector_file_path, detector_name_og)
+    # List of formatted logs into dfs, only parsing lines appended since last run, and their rows within raw retention
+    raw_since = pd.Timestamp.now(tz='UTC') - pd.Timedelta(getenv('RAW_RETENTION', RAW_RETENTION))
+    raw_dfs = []
+    checkpoints = load_log_checkpoints(detector_name_og)
+    log_dfs_list = all_detector_logs_to_dfs(detector_file_path, detector_name_og, checkpoints, raw_since, raw_dfs)
+
+    if len(log_dfs_list) == 0:
+        print(f'No new log data for {detector_name_og}')
+        return 0
 
     # Merge all found logs into a df
     hourly_logs = merge_log_dfs(log_dfs_list, detector_name_og)
+    if hourly_logs.empty:
+        print(f'No complete hours on new log data for {detector_name_og}')
+        return 0
+
+    if incremental:
+        # Only download db rows for the affected window and the context needed by error reduction
+        window_start = hourly_logs.index.min()
+        context_start = window_start - pd.Timedelta(INCREMENTAL_CONTEXT)
+        print('Incremental window starts at: ', window_start)
+        detector_data = get_detector_data(detector_name=detector_name, start=context_start)
 
     # Merge db data with new log data
     df = pd.concat([detector_data, hourly_logs])
     df1 = df[~df.index.duplicated(keep='last')]
     df1 = df1.sort_index(ascending=True)
-    
+
+    # Incremental windows are cleaned against the statistics of the whole history, as on full uploads:
+    # stored hours before the context plus the merged hours from it
+    engine = connect_to_db()
+    sums = None
+    if incremental:
+        history = get_column_sums(detector_name, ['counts'], engine)['counts']
+        context = get_column_sums(detector_name, ['counts'], engine, start=context_start)['counts']
+        values = df1['counts'].replace(0, np.nan).dropna()
+        sums = [history[0] - context[0] + len(values), history[1] - context[1] + values.sum(), history[2] - context[2] + (values**2).sum()]
+
     # Filter out low counts or out of standard deviation data each time detectors disconnect
-    df = reduce_shutdown_count_errors(df1)
+    df = reduce_shutdown_count_errors(df1, sums)
     
-    # Upload to db
-    engine, conn = connect_to_db_upload()
-    cur = conn.cursor()
-    df.to_sql(con=engine, name=f'{detector_name}', if_exists='replace', index_label='date')
-    print('Table sent to DB successfully')
-    
-    # Make primary key for table via PSYCOPG2
-    cur = conn.cursor()
-    cur.execute(f"""ALTER TABLE {detector_name} ADD PRIMARY KEY (date)""")
-    conn.commit()
-    cur.close()
-    print('Query for primary key sent successfully')
+    # Upload to db, rollups of the hours sent are refreshed within the same transaction. The data version
+    # of the detector is bumped once its derived series are rebuilt by daily_derived_to_db
+    if incremental:
+        # Insert new hours and update existing ones within a single transaction,
+        # table and its primary key stay in place for readers
+        with engine.begin() as conn:
+            rows = upsert_df(df.loc[context_start:], detector_name, conn, partition=HOURLY_PARTITION)
+            rollup_series(detector_name, ['counts'], context_start, conn)
+    else:
+        # Replace whole table within a single transaction, readers keep seeing the previous one until it commits
+        with engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {conn.dialect.identifier_preparer.quote(detector_name)}'))
+            rows = upsert_df(df, detector_name, conn, partition=HOURLY_PARTITION)
+            rollup_series(detector_name, ['counts'], bind=conn)
+        print('Table sent to DB successfully')
+
+    # Raw rows as logged, logs starting later take precedence like on merging, then expired ones are dropped
+    raw_dfs = sorted([raw for raw in raw_dfs if not raw.empty], key=lambda raw: raw.index.min())
+    if raw_dfs:
+        raw = pd.concat(raw_dfs)[['counts']]
+        raw = raw[~raw.index.duplicated(keep='last')].sort_index()
+        upsert_df(raw, detector_name + RAW_SUFFIX, engine, partition=RAW_PARTITION)
+    expire_series(detector_name + RAW_SUFFIX, raw_since, engine)
+
+    # Data is on db, next run can start reading after parsed lines
+    save_log_checkpoints(detector_name_og, checkpoints)
 
     # Delete log files to avoid clutter since already on db
     l=glob.glob(os.path.join(detector_file_path, '*.log'))
@@ -738,46 +1249,332 @@ def process_and_upload_logs(detector_data, detector_file_path, detector_name_og,
             except:
                 print(f'Error deleting file/file not found - {file}')
 
+    return rows
 
 # %% [markdown]
 # # Main Function call
 
+# %% [markdown]
+# ## process_detector
+
+# %%
+def process_detector(row, homedir, incremental):
+    ''' 
+    Processes and uploads the new logs of one detector. Any error is caught and reported so a
+    failing detector does not stop the others, whether run serially or within a worker process.
+
+    Args:       row         -> list with name, name_path and weather_station of detector from settings csv
+                homedir     -> str with folder containing detector subfolders
+                incremental -> bool passed to process_and_upload_logs
+    Returns:    dict with detector name, status, rows uploaded, seconds taken and error if any
+
+    '''
+    print('\n\n**************\nDetector: ', row[0])
+    start = time.perf_counter()
+    summary = {'detector': row[0], 'status': 'ok', 'rows': 0, 'seconds': 0.0, 'error': None}
+
+    try:
+        # Format name for file naming and db table access
+        detector_name = format_name(detector_name_og=row[0])
+
+        # Download db tables as dfs, only needed when replacing the whole table
+        if incremental:
+            detector_db = None
+        else:
+            detector_db = get_detector_data(detector_name=detector_name)
+
+        # Process detector count logs, join them to db table and upload to db, then delete older files
+        summary['rows'] = process_and_upload_logs(detector_data=detector_db, detector_file_path=f'{homedir}/{row[1]}', detector_name_og=row[0], detector_name=detector_name, incremental=incremental)
+
+    except Exception as exp:
+        traceback.print_exc()
+        summary['status'] = 'failed'
+        summary['error'] = repr(exp)
+
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
 # %% [markdown]
 # ## daily_logs_to_db fn
 
 # %%
-def daily_logs_to_db():
+def daily_logs_to_db(incremental=True, workers=None):
+    ''' 
+    Processes new logs of every detector within settings csv and uploads them to db
+
+    Detectors are independent from each other (own log folder, checkpoint file and table), so with
+    more than one worker they are processed concurrently within a process pool. Weather station
+    tables shared by several detectors are not written here but by daily_weather_to_db, once per
+    station, and db upserts take a per-table lock.
+
+    Args:       incremental -> bool, if True each detector table is upserted only for the window
+                                covered by its new logs, else the whole table is downloaded and replaced
+                workers     -> int number of worker processes, defaults to INGEST_WORKERS environment
+                                variable or 1 to process detectors serially
+    Returns:    list of dicts with summary of each detector
+
+    '''
     print('daily_logs_and_weather_to_db fn')
     # Home directory
     homedir = 'data/'
 
+    if workers is None:
+        workers = int(getenv('INGEST_WORKERS', 1))
+
     # Get detector name, path, and station ids from detector settings
     detectors = pd.read_csv('./detector_info_settings/detector_locations.csv')
     detectors_info = detectors[['name','name_path', 'weather_station']].values.tolist()
-    
 
     # For each available detector row within settings csv as df
-    for row in detectors_info:
-        print('\n\n**************\nDetector: ', row[0])
-        # Format name for file naming and db table access
-        detector_name = format_name(detector_name_og=row[0])
-        
-        # Download db tables as dfs
-        detector_db = get_detector_data(detector_name=detector_name)
-        
-        # Process detector count logs, join them to db table and upload to db, then delete older files
-        process_and_upload_logs(detector_data=detector_db, detector_file_path=f'{homedir}/{row[1]}', detector_name_og=row[0], detector_name=detector_name)
+    if workers <= 1:
+        summaries = [process_detector(row, homedir, incremental) for row in detectors_info]
+    else:
+        # Spawn fresh processes so no db connection or engine is inherited from parent
+        summaries = []
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+            futures = [pool.submit(process_detector, row, homedir, incremental) for row in detectors_info]
+            for future in as_completed(futures):
+                summaries.append(future.result())
+
+    # Summary report of nightly run
+    print('\n\n**************\nSummary')
+    for summary in sorted(summaries, key=lambda x: x['detector']):
+        print(f"{summary['detector']:<22} {summary['status']:<7} rows: {summary['rows']:<6} {summary['seconds']}s {summary['error'] or ''}")
+
+    failed = [summary['detector'] for summary in summaries if summary['status'] != 'ok']
+    print(f'{len(summaries) - len(failed)} detectors processed, {len(failed)} failed {failed if failed else ""}')
+
+    return summaries
+
+
+# %% [markdown]
+# # Derived series functions
+
+# %% [markdown]
+# ## derive_detector_series
+
+# %%
+def derive_detector_series(aligned):
+    ''' 
+    Calculates the series plotted by the dashboard from the counts of a detector joined with the
+    weather of its station. Weather series are only filled on dates station had a row for.
+
+    The Percentage Change quantifies the change from one number to another 
+    and expresses the change as an increase or decrease.
+
+        i.e.: 10 apples to 20 apples change = 100% increase (change)
+
+    Percentage change equals the change in value divided by the 
+    absolute value of the original value, multiplied by 100.
+
+        i.e.: (V2 - V1)/ |V1|  * 100
+
+    For purposes of this calculation, our V2 is the mean of the counts of muons
+
+    Args:       aligned -> pandas df from database.fetch_detector_weather
+    Returns:    pandas df with counts, weather and derived float columns, and 'has_weather'
+
+    '''
+    df = aligned.sort_index()
+
+    # Calculate hourly moving average
+    df['hourly_mov_average'] = df['counts'].rolling(window='24h').mean()
+
+    df['counts_pct'] = ((df['counts'] - df['counts'].mean()) / df['counts'].mean() * 100)
+    df['temp_pct'] = 0.2*((df['temp_in_f'] - df['temp_in_f'].mean())/ df['temp_in_f'].mean()*100)
+    df['alti_press_pct'] = 5*((df['alti_pressure'] - df['alti_pressure'].mean()) / df['alti_pressure'].mean() * 100)
+    df['sea_l_press_pct'] = ((df['sea_l_pressure_millibar'] - df['sea_l_pressure_millibar'].mean()) / df['sea_l_pressure_millibar'].mean() * 100)
+
+    # Change/delta of counts, pressure and temp - not really used but physics lab was calculating for later use
+    df['delta_counts'] = np.log(df['counts'] / df['counts'].mean())
+    df['delta_temp'] = df['temp_in_f'] - df['temp_in_f'].mean()
+    df['delta_alti_pressure'] = df['alti_pressure'] - df['alti_pressure'].mean()
+    df['delta_sea_l_pressure'] = df['sea_l_pressure_millibar'] - df['sea_l_pressure_millibar'].mean()
+
+    return df
+
+# %% [markdown]
+# ## daily_derived_to_db fn
+
+# %%
+def daily_derived_to_db():
+    ''' 
+    Rebuilds the derived series table of every detector within settings csv from its hourly counts and
+    station weather, once both are uploaded, so the dashboard only reads them. Each table and its
+    rollups of DERIVED_ROLLUP_COLUMNS are built under a staging name and swapped in within one
+    transaction that also bumps the detector's data version, so readers never see a missing or
+    partial table and cached figures and exports are invalidated once per run. Series equal to the
+    stored ones are left in place with their version, so their caches and exports stay valid.
+
+    Args:       None
+    Returns:    dict with new data version by detector table name, for detectors whose series changed
+
+    '''
+    print('daily_derived_to_db fn')
+    engine = connect_to_db()
+    detectors = pd.read_csv('./detector_info_settings/detector_locations.csv')
+    versions = {}
+
+    for name, station in detectors[['name', 'weather_station']].values.tolist():
+        detector_name = format_name(name)
+        table_name = detector_name + DERIVED_SUFFIX
+        staging_name = table_name + '_staging'
+        suffixes = [''] + [suffix for suffix, hours in ROLLUPS.values()]
+        try:
+            if get_last_date(detector_name, engine) is None:
+                print(f'No counts on db for {name}')
+                continue
+
+            derived = derive_detector_series(fetch_detector_weather(detector_name, station.lower(), WEATHER_COLUMNS, bind=engine))
+            if get_last_date(table_name, engine) is not None and fetch_series(table_name, list(derived.columns), bind=engine).equals(derived.astype('float64')):
+                print(f'No changes on derived series of {name}')
+                continue
+
+            with engine.begin() as conn:
+                # Staging tables left by an interrupted run are built again from scratch
+                for suffix in suffixes:
+                    conn.execute(text(f'DROP TABLE IF EXISTS {conn.dialect.identifier_preparer.quote(staging_name + suffix)}'))
+                upsert_df(derived, staging_name, conn)
+                rollup_series(staging_name, DERIVED_ROLLUP_COLUMNS, bind=conn)
+
+            with engine.begin() as conn:
+                for suffix in suffixes:
+                    replace_table(staging_name + suffix, table_name + suffix, conn)
+                versions[detector_name] = bump_data_version(detector_name, conn)
+
+        except Exception:
+            traceback.print_exc()
+
+    print(f'Derived series versions: {versions}')
+    return versions
+
 
+# %% [markdown]
+# # Export artifacts functions
+
+# %% [markdown]
+# ## daily_exports_to_disk
+
+# %%
+def daily_exports_to_disk():
+    ''' 
+    Writes the export files of the download buttons (pyexport.DOWNLOADS) of every detector within
+    settings csv for its current data version, once derived series are uploaded, so each download is
+    served from a file instead of being computed on request. Files of older versions are replaced and
+    the ones left unused past pyexport.EXPORT_RETENTION removed.
+
+    Args:       None
+    Returns:    dict with lists of export file paths by DOWNLOADS label, by detector name
+
+    '''
+    print('daily_exports_to_disk fn')
+    detectors = pd.read_csv('./detector_info_settings/detector_locations.csv')
+    paths = {}
+
+    for name in detectors['name']:
+        try:
+            paths[name] = build_downloads(name)
+        except Exception:
+            traceback.print_exc()
+
+    print(f'Export files written: {sum(len(files) for labels in paths.values() for files in labels.values())}, expired removed: {expire_exports()}')
+    return paths
+
+# %% [markdown]
+# # Local database seeding
+
+# %% [markdown]
+# ## seed_db_from_csv
+
+# %%
+def seed_db_from_csv(homedir='data/'):
+    ''' 
+    Loads the hourly history saved as {name}_all_logs.csv within each detector folder into its table,
+    and creates an empty table for each weather station, so a new db (e.g. the sqlite backend) can run
+    the dashboard and ingestion without a copy of the server db
+
+    Args:       homedir -> str with folder containing detector subfolders
+    Returns:    dict with number of rows seeded by table
+
+    '''
+    print('seed_db_from_csv fn')
+    engine = connect_to_db()
+    detectors = pd.read_csv('./detector_info_settings/detector_locations.csv')
+    seeded = {}
+
+    for name, name_path in detectors[['name', 'name_path']].values.tolist():
+        # File name casing differs between folders
+        files = [f for f in glob.glob(os.path.join(homedir, name_path, '*_all_logs.csv')) if os.path.basename(f).lower() == f'{name.lower()}_all_logs.csv']
+        if not files:
+            print(f'No history csv for {name}')
+            continue
+
+        df = pd.read_csv(files[0], usecols=['date', 'counts'], dtype={'counts': 'float64'})
+        df['date'] = pd.to_datetime(df['date'], utc=True)
+        df = df.set_index('date').sort_index()
+        seeded[format_name(name)] = upsert_df(df, format_name(name), engine)
+
+    for table_name in seeded:
+        rollup_series(table_name, ['counts'], bind=engine)
+
+    with engine.begin() as conn:
+        for station in detectors['weather_station'].str.lower().unique():
+            create_series_table(series_table(station, WEATHER_COLUMNS, HOURLY_PARTITION), conn, HOURLY_PARTITION)
+
+    daily_derived_to_db()
+
+    return seeded
 
 # %% [markdown]
-# # Execute daily_logs_to_db
+# # Schema management
+
+# %% [markdown]
+# ## manage_tables
 
 # %%
-daily_logs_to_db()
+def manage_tables():
+    ''' 
+    Converts the hourly detector and weather station tables created before partitioning into range
+    partitioned ones, and builds the rollups of tables that have none yet or lack some of their columns.
+    Tables that are already partitioned are left as they are and complete rollups only get their last
+    bucket refreshed, so it can run before every ingestion.
+
+    Args:       None
+    Returns:    list of str with names of tables converted
+
+    '''
+    print('manage_tables fn')
+    engine = connect_to_db()
+    detectors = pd.read_csv('./detector_info_settings/detector_locations.csv')
+    detector_tables = [format_name(name) for name in detectors['name']]
+    station_tables = list(detectors['weather_station'].str.lower().unique())
+
+    converted = [table_name for table_name in detector_tables + station_tables if partition_table(table_name, HOURLY_PARTITION, engine)]
+
+    # Rollups of tables that have none yet are built whole, others only refresh their last bucket
+    for table_name in detector_tables:
+        rollup_series(table_name, ['counts'], get_last_date(table_name, engine), engine)
+    for table_name in station_tables:
+        rollup_series(table_name, WEATHER_COLUMNS, get_last_date(table_name, engine), engine)
+
+    return converted
 
 # %% [markdown]
-# # Execute daily_weather_to_db
+# # Execute daily_logs_to_db and daily_weather_to_db
 
 # %%
-# Format station data and upload to db
-daily_weather_to_db()
\ No newline at end of file
+# Only run when executed as a script so functions can be imported by benchmarks and worker processes
+if __name__ == '__main__':
+    # Partition tables left from before the schema was managed here and build missing rollups
+    manage_tables()
+
+    daily_logs_to_db()
+
+    # Format station data and upload to db
+    daily_weather_to_db()
+
+    # Series plotted by the dashboard, from the counts and weather just uploaded
+    daily_derived_to_db()
+
+    # Download files for the data versions just written
+    daily_exports_to_disk()
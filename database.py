@@ -4,93 +4,1008 @@ File with all necessary functions for data download from server
 
 '''
 import pandas as pd
+import numpy as np
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+from io import BytesIO
 from dotenv import load_dotenv
 from os import getenv
-from sqlalchemy import create_engine
-import psycopg2
-
-
-def format_sql(sql_data):
-    ''' 
-    Formats sql data fetched from table into datetime index and numeric column
-    Args:       sql_data -> sqlalchemy row.Row object
-    Returns:    pandas df
-
-    '''
-    # CSV file into a dataframe
-    df = pd.DataFrame(sql_data)
-    df['date'] = pd.to_datetime(df['date'])
-        
-    # Make sure current table is on UTC format
-    print(df['date'].dt.tz)
-    if str(df['date'].dt.tz) != 'UTC':
-        df['date'] = df['date'].dt.tz_localize('UTC')
-    df = df.set_index('date')
-
-    df.sort_index(ascending=True, inplace=True)
-    
-    columns_types = df.dtypes.to_list()
-    if len(set(columns_types)) > 1:
-        for col in df.columns.to_list():
-            df[col] = pd.to_numeric(df[col])
-            
-    return df
+from sqlalchemy import create_engine, event, inspect, text, MetaData, Table, Column, DateTime, Float, String, BigInteger
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import QueuePool
 
-def connect_to_db():
+# Storage backend, 'postgres' for the server on .env DB* variables or 'sqlite' for an embedded file db at
+# SQLITE_PATH that needs no services, e.g. for running ingestion, dashboard and benchmarks offline
+DB_BACKEND = 'postgres'
+SQLITE_PATH = 'app_data/muon.sqlite'
+
+# Defaults of the process wide connection pool, each can be overridden by the .env variable of same name.
+# Connections are checked with a ping before use and replaced after DB_POOL_RECYCLE seconds, so the ones
+# dropped by the server or a firewall while idle are never handed out
+POOL_SETTINGS = {
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': 1,
+}
+
+# Bucket sizes fetch_series can aggregate rows into, as named by postgres date_trunc, and the
+# equivalent truncation of dates stored as text on sqlite (weeks start on monday like on postgres),
+# written like stored dates so truncated dates can be compared with and stored next to them
+RESOLUTIONS = ('hour', 'day', 'week', 'month', 'year')
+SQLITE_TRUNCATE = {
+    'hour': "strftime('%Y-%m-%d %H:00:00.000000', {date})",
+    'day': "strftime('%Y-%m-%d 00:00:00.000000', {date})",
+    'week': "date({date}, '-6 days', 'weekday 1') || ' 00:00:00.000000'",
+    'month': "strftime('%Y-%m-01 00:00:00.000000', {date})",
+    'year': "strftime('%Y-01-01 00:00:00.000000', {date})",
+}
+# Format sqlalchemy stores DateTime values with on sqlite, always in UTC
+SQLITE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Pyramid of rollup tables kept for hourly tables, as suffix added to the hourly table name and number
+# of hours in a bucket of each resolution, from finest to coarsest. Rollups store the mean of each column
+# as {col} and the statistics below as {col}_{stat}
+ROLLUPS = {'day': ('_daily', 24), 'week': ('_weekly', 168)}
+ROLLUP_STATS = ('min', 'max', 'count', 'coverage')
+
+# Suffixes of the tables holding the raw rows of each detector as logged, and the series derived
+# from its counts and weather
+RAW_SUFFIX = '_minute'
+DERIVED_SUFFIX = '_derived'
+
+# Columns of the derived series tables that get rollups, the ones plotted by the dashboard
+DERIVED_ROLLUP_COLUMNS = ['counts_pct', 'temp_pct', 'alti_press_pct', 'sea_l_press_pct']
+
+# Periods postgres tables can be range partitioned by on date, as pandas period frequency and the
+# suffix given to the name of each partition
+PARTITION_PERIODS = {'month': ('M', '%Y_%m'), 'year': ('Y', '%Y')}
+
+# Rows per df yielded when streaming a table
+STREAM_CHUNK_ROWS = 50000
+
+# Microseconds between unix epoch and postgres epoch, 2000-01-01 UTC
+PG_EPOCH_MICROSECONDS = 946684800 * 10**6
+
+# Engine shared by all callers of this process, and pid of process it is pooling connections for
+_engine = None
+_engine_pid = os.getpid()
+_engine_lock = threading.Lock()
+
+# Time spent waiting for a pooled connection on this process
+_pool_waits = {'checkouts': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+_pool_waits_lock = threading.Lock()
+
+
+class TimedQueuePool(QueuePool):
+    ''' 
+    QueuePool that records how long each checkout waits for a connection, which grows once all
+    pooled connections are in use and shows the pool is too small for the load
+
+    '''
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            with _pool_waits_lock:
+                _pool_waits['checkouts'] += 1
+                _pool_waits['total_wait'] += wait
+                _pool_waits['max_wait'] = max(_pool_waits['max_wait'], wait)
+
+
+def table_name(detector_name_og):
+    ''' 
+    Gets the name of the counts table of a detector, lowercase and with no number up front, which
+    its raw, derived and rollup tables extend with a suffix
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+    Returns:    str
+
+    '''
+    detector_name = detector_name_og.lower()
+    if detector_name.startswith('2') or detector_name.startswith('4'):
+        detector_name = detector_name[1:]+detector_name[0]
+
+    return detector_name
+
+def _dispose_inherited_engine():
     ''' 
-    Creates an engine object based on sqlalchemy and psycopg2
+    Drops pooled connections inherited from parent process without closing them, as they are
+    still in use by the parent. Runs on child right after a fork, e.g. gunicorn workers.
+
+    Args:       None
+    Returns:    None
+
+    '''
+    global _engine_pid
+    if _engine is not None:
+        _engine.dispose(close=False)
+    _engine_pid = os.getpid()
+    with _pool_waits_lock:
+        _pool_waits.update({'checkouts': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_inherited_engine)
+
+def get_engine():
+    ''' 
+    Gets the engine shared by the whole process, creating it on first use for the backend and
+    pool settings from .env. Once created, .env is no longer read, so later calls only cost a lookup.
+
     Args:       None
     Returns:    sqlalchemy engine
 
     '''
-    # Extract environment variables
-    load_dotenv()
-    DBNAME=getenv('DBNAME')
-    DBUSER=getenv('DBUSER')
-    DBHOST=getenv('DBHOST')
-    DBPORT=getenv('DBPORT')
-    DBPWRD=getenv('DBPWRD')
+    global _engine
+    engine = _engine
+    if engine is not None and _engine_pid == os.getpid():
+        return engine
 
-    try:
-        connection_string = f'postgresql+psycopg2://{DBUSER}:{DBPWRD}@{DBHOST}:{DBPORT}/{DBNAME}'
-        conn = create_engine(connection_string)
+    with _engine_lock:
+        # Fallback for forks not seen by register_at_fork
+        if _engine_pid != os.getpid():
+            _dispose_inherited_engine()
+
+        engine = _engine
+        if engine is None:
+            load_dotenv()
+            if getenv('DB_BACKEND', DB_BACKEND) == 'sqlite':
+                connection_string = f"sqlite:///{getenv('SQLITE_PATH', SQLITE_PATH)}"
+            else:
+                DBNAME=getenv('DBNAME')
+                DBUSER=getenv('DBUSER')
+                DBHOST=getenv('DBHOST')
+                DBPORT=getenv('DBPORT')
+                DBPWRD=getenv('DBPWRD')
+                connection_string = f'postgresql+psycopg2://{DBUSER}:{DBPWRD}@{DBHOST}:{DBPORT}/{DBNAME}'
+
+            settings = {key: int(getenv(key, default)) for key, default in POOL_SETTINGS.items()}
+            if connection_string.startswith('sqlite'):
+                os.makedirs(os.path.dirname(os.path.abspath(connection_string[len('sqlite:///'):])), exist_ok=True)
+            engine = create_engine(
+                connection_string,
+                poolclass=TimedQueuePool,
+                pool_size=settings['DB_POOL_SIZE'],
+                max_overflow=settings['DB_MAX_OVERFLOW'],
+                pool_timeout=settings['DB_POOL_TIMEOUT'],
+                pool_recycle=settings['DB_POOL_RECYCLE'],
+                pool_pre_ping=bool(settings['DB_POOL_PRE_PING']),
+            )
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _configure_sqlite)
+            _engine = engine
+
+    return engine
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    ''' 
+    Lets readers work while a writer commits and makes writers wait for each other instead of failing,
+    as dashboard workers and nightly ingestion share the same file
+
+    '''
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.close()
+
+def pool_stats():
+    ''' 
+    Reports usage of the connection pools of this process and how long checkouts waited
+
+    Args:       None
+    Returns:    dict with pid, checkout wait times in seconds and connections of each pool
+
+    '''
+    with _pool_waits_lock:
+        waits = dict(_pool_waits)
+    waits['mean_wait'] = waits['total_wait'] / waits['checkouts'] if waits['checkouts'] else 0.0
+
+    pools = [{
+        'size': engine.pool.size(),
+        'checked_in': engine.pool.checkedin(),
+        'checked_out': engine.pool.checkedout(),
+        'overflow': engine.pool.overflow(),
+    } for engine in [_engine] if engine is not None]
 
-        print('Connected to muon database successfully')
-        return conn
+    return {'pid': os.getpid(), **waits, 'pools': pools}
+
+def connect_to_db():
+    ''' 
+    Gets the sqlalchemy engine shared by the whole process
+    Args:       None
+    Returns:    sqlalchemy engine
+
+    '''
+    try:
+        return get_engine()
 
     except:
         print('Unable to connect to muon database')
         return None
 
-def connect_to_db_upload():
+def begin(bind):
     ''' 
-    Creates an engine object based on sqlalchemy and psycopg2
+    Starts a transaction on given engine, or reuses the one of given connection so several
+    operations can be committed together
+
+    Args:       bind    -> sqlalchemy engine or connection
+    Returns:    context manager yielding a connection
+
+    '''
+    if isinstance(bind, Connection):
+        return nullcontext(bind)
+    return bind.begin()
+
+def lock_table(conn, table_name):
+    ''' 
+    Takes a transaction level advisory lock on a table name, released on commit or rollback.
+    Sqlite has no advisory locks but already lets a single writer at a time.
+
+    Args:       conn        -> sqlalchemy connection within a transaction
+                table_name  -> str with name of table on db
+    Returns:    None
+
+    '''
+    if conn.dialect.name == 'sqlite':
+        return
+    conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:name))'), {'name': table_name})
+
+def insert(table, conn):
+    ''' 
+    Creates an insert statement supporting on_conflict_do_update for the dialect of conn
+
+    Args:       table   -> sqlalchemy table
+                conn    -> sqlalchemy connection
+    Returns:    sqlalchemy insert statement
+
+    '''
+    if conn.dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+def bind_date(value, conn):
+    ''' 
+    Formats a datetime to be compared with the date column. Sqlite stores dates as UTC text, so values
+    are converted to that same text for comparisons to hold.
+
+    Args:       value   -> datetime, str or None
+                conn    -> sqlalchemy connection
+    Returns:    value as accepted by the dialect of conn
+
+    '''
+    if value is None or conn.dialect.name != 'sqlite':
+        return value
+    value = pd.Timestamp(value)
+    value = value.tz_localize('UTC') if value.tz is None else value.tz_convert('UTC')
+    return value.strftime(SQLITE_DATE_FORMAT)
+
+def to_utc(value):
+    ''' 
+    Converts a date read from db, tz-aware on postgres or UTC text on sqlite, into a UTC timestamp
+
+    Args:       value   -> datetime or str
+    Returns:    pandas timestamp in UTC
+
+    '''
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tz is None else value.tz_convert('UTC')
+
+def get_last_date(table_name, bind):
+    ''' 
+    Gets the most recent date stored on given table without downloading it
+
+    Args:       table_name  -> str with name of table on db
+                bind        -> sqlalchemy engine or connection
+    Returns:    pandas timestamp in UTC, or None if table does not exist or is empty
+
+    '''
+    with begin(bind) as conn:
+        if not inspect(conn).has_table(table_name):
+            return None
+        last = conn.execute(text(f'SELECT max(date) FROM {conn.dialect.identifier_preparer.quote(table_name)}')).scalar()
+
+    return None if last is None else to_utc(last)
+
+def get_column_sums(table_name, columns, bind, start=None, end=None):
+    ''' 
+    Calculates count, sum and sum of squares of the non null values of each column on the db,
+    optionally within a date window, which is enough to know their mean and standard deviation
+
+    Args:       table_name  -> str with name of table on db
+                columns     -> list of str with column names
+                bind        -> sqlalchemy engine or connection
+                start       -> optional datetime where window starts (included)
+                end         -> optional datetime where window ends (included)
+    Returns:    dict with [count, sum, sum of squares] by column, all 0 if table does not exist
+
+    '''
+    with begin(bind) as conn:
+        if not inspect(conn).has_table(table_name):
+            return {col: [0, 0.0, 0.0] for col in columns}
+
+        quote = conn.dialect.identifier_preparer.quote
+        aggregates = ', '.join(f'count({quote(col)}), coalesce(sum({quote(col)}), 0), coalesce(sum({quote(col)}*{quote(col)}), 0)' for col in columns)
+        query = f'SELECT {aggregates} FROM {quote(table_name)}'
+        conditions = []
+        if start is not None:
+            conditions.append('date >= :start')
+        if end is not None:
+            conditions.append('date <= :end')
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        row = conn.execute(text(query), {'start': bind_date(start, conn), 'end': bind_date(end, conn)}).one()
+
+    return {col: [int(row[3*i]), float(row[3*i + 1]), float(row[3*i + 2])] for i, col in enumerate(columns)}
+
+def weather_stats_table():
+    ''' 
+    Describes side table holding running count, sum and sum of squares of each weather station column
+
     Args:       None
-    Returns:    sqlalchemy engine
+    Returns:    sqlalchemy table
 
     '''
-    load_dotenv()
-    DBNAME=getenv('DBNAME')
-    DBUSER=getenv('DBUSER')
-    DBHOST=getenv('DBHOST')
-    DBPORT=getenv('DBPORT')
-    DBPWRD=getenv('DBPWRD')
+    return Table(
+        'weather_stats',
+        MetaData(),
+        Column('station', String, primary_key=True),
+        Column('col', String, primary_key=True),
+        Column('n', BigInteger),
+        Column('total', Float),
+        Column('total_sq', Float),
+    )
 
-    try:
-        connection_string = f'postgresql://{DBUSER}:{DBPWRD}@{DBHOST}:{DBPORT}/{DBNAME}'
-        engine = create_engine(connection_string)
+def get_weather_stats(station_id, conn):
+    ''' 
+    Gets running statistics stored for a weather station
 
-        print('Connected to muon database successfully')
+    Args:       station_id  -> str with station id name
+                conn        -> sqlalchemy connection
+    Returns:    dict with [count, sum, sum of squares] by column, empty if none stored yet
 
-    except:
-        print('Unable to connect to muon database via sqlalchemy')
-        engine = None
-    
-    try:
-        conn = psycopg2.connect(f"dbname={DBNAME} user={DBUSER} host={DBHOST} port={DBPORT} password={DBPWRD}")
-        print('Connected to muon database successfully')
-    except:
-        print('Unable to connect to muon database via psycopg2')
-        conn = None
+    '''
+    table = weather_stats_table()
+    table.create(conn, checkfirst=True)
+    rows = conn.execute(table.select().where(table.c.station == station_id)).fetchall()
+
+    return {row.col: [row.n, row.total, row.total_sq] for row in rows}
+
+def save_weather_stats(station_id, stats, conn):
+    ''' 
+    Saves running statistics of a weather station, replacing the stored ones
+
+    Args:       station_id  -> str with station id name
+                stats       -> dict with [count, sum, sum of squares] by column
+                conn        -> sqlalchemy connection
+    Returns:    None
+
+    '''
+    table = weather_stats_table()
+    stmt = insert(table, conn)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['station', 'col'],
+        set_={col: stmt.excluded[col] for col in ('n', 'total', 'total_sq')},
+    )
+    conn.execute(stmt, [
+        {'station': station_id, 'col': col, 'n': int(n), 'total': float(total), 'total_sq': float(total_sq)}
+        for col, (n, total, total_sq) in stats.items()
+    ])
+
+def data_versions_table():
+    ''' 
+    Describes side table holding the version of the data of each detector, bumped every time the
+    nightly ingestion rebuilds its derived series
+
+    Args:       None
+    Returns:    sqlalchemy table
+
+    '''
+    return Table(
+        'data_versions',
+        MetaData(),
+        Column('name', String, primary_key=True),
+        Column('version', BigInteger),
+        Column('updated_at', DateTime(timezone=True)),
+    )
+
+def get_data_version(name, bind=None):
+    ''' 
+    Gets the current version of the data of a detector
+
+    Args:       name    -> str with formatted detector name, as its table on db
+                bind    -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    int version, or None if its data was never stamped
+
+    '''
+    table = data_versions_table()
+    with begin(get_engine() if bind is None else bind) as conn:
+        if not inspect(conn).has_table(table.name):
+            return None
+        return conn.execute(table.select().with_only_columns(table.c.version).where(table.c.name == name)).scalar()
+
+def bump_data_version(name, conn):
+    ''' 
+    Increments the version of the data of a detector, starting at 1. Meant to run within the transaction
+    writing its data, so readers see the new version and the new data at once.
+
+    Args:       name    -> str with formatted detector name, as its table on db
+                conn    -> sqlalchemy connection within a transaction
+    Returns:    int new version
+
+    '''
+    table = data_versions_table()
+    table.create(conn, checkfirst=True)
+    stmt = insert(table, conn).values(name=name, version=1, updated_at=pd.Timestamp.now(tz='UTC').to_pydatetime())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': table.c.version + 1, 'updated_at': stmt.excluded.updated_at},
+    )
+    conn.execute(stmt)
+
+    return get_data_version(name, conn)
 
-    return engine, conn
\ No newline at end of file
+def series_table(table_name, columns, partition=None):
+    ''' 
+    Describes a date indexed table of float columns, date being the primary key
+
+    Args:       table_name  -> str with name of table on db
+                columns     -> list of str with column names
+                partition   -> optional str in PARTITION_PERIODS, table is range partitioned on date on postgres
+    Returns:    sqlalchemy table
+
+    '''
+    return Table(
+        table_name,
+        MetaData(),
+        Column('date', DateTime(timezone=True), primary_key=True),
+        *[Column(col, Float) for col in columns],
+        **({} if partition is None else {'postgresql_partition_by': 'RANGE (date)'}),
+    )
+
+def get_partitions(table_name, conn):
+    ''' 
+    Lists the partitions of a range partitioned postgres table with the dates each one holds
+
+    Args:       table_name  -> str with name of table on db
+                conn        -> sqlalchemy connection
+    Returns:    dict with [lower, upper) UTC timestamps by partition name, None if table is missing,
+                not partitioned or db is not postgres
+
+    '''
+    if conn.dialect.name != 'postgresql':
+        return None
+    name = conn.dialect.identifier_preparer.quote(table_name)
+    if conn.execute(text('SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)'), {'name': name}).scalar() != 'p':
+        return None
+
+    rows = conn.execute(text('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:name)
+    '''), {'name': name}).fetchall()
+
+    partitions = {}
+    for partition, bound in rows:
+        # Bound reads FOR VALUES FROM ('...') TO ('...'), default partitions have none
+        values = re.findall(r"'([^']+)'", bound)
+        if len(values) == 2:
+            partitions[partition] = (to_utc(values[0]), to_utc(values[1]))
+
+    return partitions
+
+def create_series_table(table, conn, partition=None, start=None, end=None):
+    ''' 
+    Creates a date indexed table if it does not exist yet. On postgres with a partition period, the table
+    is range partitioned on date with a BRIN index on date besides its primary key, and partitions holding
+    start to end are added if missing. Scans of a time window only read the partitions it overlaps, and
+    old data can be dropped a partition at a time. Tables that already exist unpartitioned are left as
+    they are, see partition_table.
+
+    Args:       table       -> sqlalchemy table from series_table
+                conn        -> sqlalchemy connection
+                partition   -> optional str in PARTITION_PERIODS
+                start       -> optional datetime of first row to be stored
+                end         -> optional datetime of last row to be stored
+    Returns:    None
+
+    '''
+    if partition is None or conn.dialect.name != 'postgresql':
+        table.create(conn, checkfirst=True)
+        return
+
+    quote = conn.dialect.identifier_preparer.quote
+    partitions = get_partitions(table.name, conn)
+    if partitions is None:
+        if inspect(conn).has_table(table.name):
+            return
+        table.create(conn)
+        conn.execute(text(f'CREATE INDEX {quote(table.name + "_date_brin")} ON {quote(table.name)} USING brin (date)'))
+        partitions = {}
+
+    if start is None:
+        return
+    freq, suffix = PARTITION_PERIODS[partition]
+    end = start if end is None else end
+    for period in pd.period_range(to_utc(start).tz_localize(None), to_utc(end).tz_localize(None), freq=freq):
+        name = f'{table.name}_p{period.strftime(suffix)}'
+        if name in partitions:
+            continue
+        lower = period.start_time.tz_localize('UTC')
+        upper = (period + 1).start_time.tz_localize('UTC')
+        conn.execute(text(f"CREATE TABLE {quote(name)} PARTITION OF {quote(table.name)} FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+
+def partition_table(table_name, partition, bind):
+    ''' 
+    Converts an unpartitioned postgres table into a range partitioned one holding the same rows, within
+    a single transaction so readers keep seeing the old table until it commits
+
+    Args:       table_name  -> str with name of table on db
+                partition   -> str in PARTITION_PERIODS
+                bind        -> sqlalchemy engine or connection
+    Returns:    bool, True if table was converted, False if it is missing, already partitioned or db is not postgres
+
+    '''
+    with begin(bind) as conn:
+        if conn.dialect.name != 'postgresql' or not inspect(conn).has_table(table_name) or get_partitions(table_name, conn) is not None:
+            return False
+
+        quote = conn.dialect.identifier_preparer.quote
+        lock_table(conn, table_name)
+        inspector = inspect(conn)
+        columns = [col['name'] for col in inspector.get_columns(table_name) if col['name'] != 'date']
+        primary_key = inspector.get_pk_constraint(table_name)['name']
+        first, last = conn.execute(text(f'SELECT min(date), max(date) FROM {quote(table_name)}')).one()
+
+        # Old table and its primary key are renamed so the new ones can take their names
+        old_name = f'{table_name}_unpartitioned'
+        conn.execute(text(f'ALTER TABLE {quote(table_name)} RENAME TO {quote(old_name)}'))
+        if primary_key is not None:
+            conn.execute(text(f'ALTER TABLE {quote(old_name)} RENAME CONSTRAINT {quote(primary_key)} TO {quote(old_name + "_pkey")}'))
+
+        create_series_table(series_table(table_name, columns, partition), conn, partition, first, last)
+        names = ', '.join(quote(col) for col in ['date', *columns])
+        conn.execute(text(f'INSERT INTO {quote(table_name)} ({names}) SELECT {names} FROM {quote(old_name)}'))
+        conn.execute(text(f'DROP TABLE {quote(old_name)}'))
+
+    print(f'Partitioned {table_name} by {partition}')
+    return True
+
+def replace_table(staging_name, table_name, conn):
+    ''' 
+    Puts a table built under a staging name in place of another one, within the transaction of conn so
+    readers keep seeing the old table until it commits and never a missing or partial one. The primary
+    key of the staging table takes the name of the replaced one, so the next staging table can be built.
+
+    Args:       staging_name    -> str with name of table to be renamed
+                table_name      -> str with name of table to be replaced, dropped if it exists
+                conn            -> sqlalchemy connection within a transaction
+    Returns:    None
+
+    '''
+    quote = conn.dialect.identifier_preparer.quote
+    lock_table(conn, table_name)
+    primary_key = inspect(conn).get_pk_constraint(staging_name)['name']
+
+    conn.execute(text(f'DROP TABLE IF EXISTS {quote(table_name)}'))
+    conn.execute(text(f'ALTER TABLE {quote(staging_name)} RENAME TO {quote(table_name)}'))
+    if conn.dialect.name == 'postgresql' and primary_key is not None:
+        conn.execute(text(f'ALTER TABLE {quote(table_name)} RENAME CONSTRAINT {quote(primary_key)} TO {quote(table_name + "_pkey")}'))
+
+def expire_series(table_name, before, bind):
+    ''' 
+    Removes rows older than given date from a table. Partitioned postgres tables only drop the partitions
+    that end before that date, which frees their space right away and leaves no dead rows for vacuum to
+    clean up, so rows are kept until their whole partition expires. Other tables delete the rows.
+
+    Args:       table_name  -> str with name of table on db
+                before      -> datetime, rows older than it are removed
+                bind        -> sqlalchemy engine or connection
+    Returns:    int number of partitions dropped, or rows deleted if table is not partitioned
+
+    '''
+    with begin(bind) as conn:
+        if not inspect(conn).has_table(table_name):
+            return 0
+        quote = conn.dialect.identifier_preparer.quote
+        lock_table(conn, table_name)
+
+        partitions = get_partitions(table_name, conn)
+        if partitions is None:
+            deleted = conn.execute(text(f'DELETE FROM {quote(table_name)} WHERE date < :before'), {'before': bind_date(before, conn)}).rowcount
+            print(f'Deleted {deleted} rows older than {before} from {table_name}')
+            return deleted
+
+        expired = [name for name, (lower, upper) in partitions.items() if upper <= to_utc(before)]
+        for name in expired:
+            conn.execute(text(f'DROP TABLE {quote(name)}'))
+
+    print(f'Dropped {len(expired)} partitions older than {before} from {table_name}')
+    return len(expired)
+
+def rollup_series(table_name, columns, start=None, bind=None):
+    ''' 
+    Refreshes the pyramid of rollup tables of an hourly table, one per resolution of ROLLUPS, holding the
+    mean of each column by bucket as {col} next to its min, max, number of hours with a value and coverage,
+    the fraction of the bucket's hours with a value. Only buckets from the one holding start on are
+    recomputed and upserted, so rollups follow the window touched by new data. Rollup tables that are
+    missing or lack a column are created or extended and recomputed whole.
+
+    Args:       table_name  -> str with name of hourly table on db
+                columns     -> list of str with column names of hourly table
+                start       -> optional datetime, all hourly rows are rolled up if None
+                bind        -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    dict with number of rollup rows upserted by resolution
+
+    '''
+    rows = {}
+    with begin(get_engine() if bind is None else bind) as conn:
+        if not inspect(conn).has_table(table_name):
+            return rows
+        quote = conn.dialect.identifier_preparer.quote
+        rollup_columns = [name for col in columns for name in (col, *(f'{col}_{stat}' for stat in ROLLUP_STATS))]
+        float_type = Float().compile(dialect=conn.dialect)
+
+        for resolution, (suffix, hours) in ROLLUPS.items():
+            rollup_table = table_name + suffix
+            lock_table(conn, rollup_table)
+
+            rollup_start = start
+            inspector = inspect(conn)
+            if not inspector.has_table(rollup_table):
+                create_series_table(series_table(rollup_table, rollup_columns), conn)
+                rollup_start = None
+            else:
+                existing = {col['name'] for col in inspector.get_columns(rollup_table)}
+                for col in rollup_columns:
+                    if col not in existing:
+                        conn.execute(text(f'ALTER TABLE {quote(rollup_table)} ADD COLUMN {quote(col)} {float_type}'))
+                        rollup_start = None
+
+            date_expr = truncate_date(conn, resolution)
+            # Whole bucket holding start is recomputed
+            where = f' WHERE date >= {truncate_date(conn, resolution, ":start")}' if rollup_start is not None else ''
+            aggregates = ''.join(
+                f', avg({quote(col)}), min({quote(col)}), max({quote(col)}), count({quote(col)}), count({quote(col)}) / {hours}.0'
+                for col in columns
+            )
+            names = ', '.join(quote(col) for col in ['date', *rollup_columns])
+            updates = ', '.join(f'{quote(col)} = excluded.{quote(col)}' for col in rollup_columns)
+            # WHERE true tells sqlite ON CONFLICT is not part of a join
+            rows[resolution] = conn.execute(text(f'''
+                INSERT INTO {quote(rollup_table)} ({names})
+                SELECT * FROM (SELECT {date_expr} AS date{aggregates} FROM {quote(table_name)}{where} GROUP BY 1) AS r
+                WHERE true ON CONFLICT (date) DO UPDATE SET {updates}
+            '''), {'start': bind_date(rollup_start, conn)}).rowcount
+
+    print(f'Rolled up {table_name} into {rows}')
+    return rows
+
+def pick_resolution(start, end, width):
+    ''' 
+    Picks the coarsest resolution of the rollup pyramid whose buckets are still no wider than one pixel
+    when the time window is drawn across given number of pixels, so coarser data looks the same on screen
+
+    Args:       start   -> datetime where window starts
+                end     -> datetime where window ends
+                width   -> int number of pixels window is drawn across
+    Returns:    str, 'hour' or a resolution of ROLLUPS
+
+    '''
+    hours_per_pixel = (to_utc(end) - to_utc(start)) / pd.Timedelta('1h') / max(width, 1)
+    resolution = 'hour'
+    for name, (suffix, hours) in ROLLUPS.items():
+        if hours <= hours_per_pixel:
+            resolution = name
+
+    return resolution
+
+def fetch_rollup(table_name, columns=None, start=None, end=None, width=None, bind=None):
+    ''' 
+    Downloads a time window of an hourly table at the coarsest resolution that still fills given pixel
+    width, reading its rollup table instead of every hour when the window spans many pixels per bucket.
+    Hourly rows are returned with the same statistic columns as rollups, each hour being a bucket of one.
+
+    Args:       table_name  -> str with name of hourly table on db
+                columns     -> list of str with column names, or None for all columns of hourly table
+                start       -> optional datetime where window starts (included), first date on table if None
+                end         -> optional datetime where window ends (included), last date on table if None
+                width       -> optional int number of pixels window is drawn across, hourly rows if None
+                bind        -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    tuple [pandas df indexed by UTC 'date' with {col} mean and {col}_{stat} columns of
+                ROLLUP_STATS for each column, str with resolution read]
+
+    '''
+    with begin(get_engine() if bind is None else bind) as conn:
+        if columns is None:
+            columns = [col['name'] for col in inspect(conn).get_columns(table_name) if col['name'] != 'date']
+
+        resolution = 'hour'
+        if width is not None:
+            if start is None or end is None:
+                first, last = conn.execute(text(f'SELECT min(date), max(date) FROM {conn.dialect.identifier_preparer.quote(table_name)}')).one()
+                start = first if start is None else start
+                end = last if end is None else end
+            if start is not None and end is not None:
+                resolution = pick_resolution(start, end, width)
+            # Rollups are only read once ingestion has built them
+            if resolution != 'hour' and not inspect(conn).has_table(table_name + ROLLUPS[resolution][0]):
+                resolution = 'hour'
+
+        if resolution == 'hour':
+            hourly = fetch_series(table_name, columns, start, end, bind=conn)
+            df = pd.DataFrame(index=hourly.index)
+            for col in columns:
+                has_value = hourly[col].notna().astype(float)
+                df[col] = hourly[col]
+                df[f'{col}_min'] = hourly[col]
+                df[f'{col}_max'] = hourly[col]
+                df[f'{col}_count'] = has_value
+                df[f'{col}_coverage'] = has_value
+            return df, resolution
+
+        # Bucket holding start begins before it
+        if start is not None:
+            start = to_utc(start).floor('D')
+            if resolution == 'week':
+                start -= pd.Timedelta(days=start.weekday())
+        rollup_columns = [name for col in columns for name in (col, *(f'{col}_{stat}' for stat in ROLLUP_STATS))]
+        df = fetch_series(table_name + ROLLUPS[resolution][0], rollup_columns, start, end, bind=conn)
+
+    return df, resolution
+
+def upsert_df(df, table_name, engine, chunksize=5000, partition=None):
+    ''' 
+    Inserts or updates the rows of a date indexed df into given table using
+    INSERT ... ON CONFLICT (date) DO UPDATE. All batches are sent within one transaction,
+    so readers keep seeing the previous version of the table until it commits.
+    Table is created with a primary key on date if it does not exist yet, and partitions for the
+    dates of df are added on partitioned tables. A transaction level advisory lock on the table name
+    serializes concurrent upserts to the same table.
+
+    Args:       df          -> pandas df with a tz-aware 'date' index and numeric columns
+                table_name  -> str with name of table on db
+                engine      -> sqlalchemy engine, or connection to upsert within its transaction
+                chunksize   -> int number of rows sent per INSERT statement
+                partition   -> optional str in PARTITION_PERIODS to range partition table by on postgres
+    Returns:    int number of rows upserted
+
+    '''
+    if df.empty:
+        return 0
+
+    # Describe table based on df columns, date being the primary key
+    table = series_table(table_name, df.columns, partition)
+
+    # Replace np.nan values with None so they are stored as NULL
+    records = df.reset_index(names='date')
+    records['date'] = records['date'].dt.tz_convert('UTC')
+    records = records.astype(object).where(records.notna(), None).to_dict('records')
+
+    with begin(engine) as conn:
+        # Build insert statement that updates all value columns on date conflicts
+        stmt = insert(table, conn)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['date'],
+            set_={col: stmt.excluded[col] for col in df.columns},
+        )
+
+        lock_table(conn, table_name)
+        create_series_table(table, conn, partition, df.index.min(), df.index.max())
+        for i in range(0, len(records), chunksize):
+            conn.execute(stmt, records[i:i + chunksize])
+
+    print(f'Upserted {len(records)} rows into {table_name}')
+    return len(records)
+
+def truncate_date(conn, resolution, date='date'):
+    ''' 
+    Builds the expression truncating a date to the start of its bucket of given resolution
+
+    Args:       conn        -> sqlalchemy connection
+                resolution  -> str in RESOLUTIONS
+                date        -> str with sql expression of date, the date column by default
+    Returns:    str with sql expression
+
+    '''
+    if conn.dialect.name == 'sqlite':
+        return SQLITE_TRUNCATE[resolution].format(date=date)
+    # Truncate on UTC wall time so buckets do not depend on the session time zone
+    return f"date_trunc('{resolution}', CAST({date} AS timestamptz) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+
+def series_query(conn, table_name, columns, start=None, end=None, resolution=None):
+    ''' 
+    Builds the query selecting given columns of a date indexed table within a time window, optionally
+    averaged into buckets of given resolution. Identifiers are quoted by the dialect, window bounds are
+    left as :start and :end placeholders.
+
+    Args:       conn        -> sqlalchemy connection
+                table_name  -> str with name of table on db
+                columns     -> list of str with column names
+                start       -> optional datetime where window starts (included)
+                end         -> optional datetime where window ends (included)
+                resolution  -> optional str in RESOLUTIONS, rows are averaged by date truncated to it
+    Returns:    str with query
+
+    '''
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise ValueError(f'Unknown resolution {resolution}, expected one of {RESOLUTIONS}')
+    quote = conn.dialect.identifier_preparer.quote
+
+    if resolution is None:
+        date_expr = 'date'
+        select = ''.join(f', {quote(col)}' for col in columns)
+    else:
+        date_expr = truncate_date(conn, resolution)
+        select = ''.join(f', avg({quote(col)}) AS {quote(col)}' for col in columns)
+
+    query = f'SELECT {date_expr} AS date{select} FROM {quote(table_name)}'
+    conditions = []
+    if start is not None:
+        conditions.append('date >= :start')
+    if end is not None:
+        conditions.append('date <= :end')
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    if resolution is not None:
+        query += ' GROUP BY 1'
+    query += ' ORDER BY 1'
+
+    return query
+
+def fetch_series(table_name, columns=None, start=None, end=None, resolution=None, bind=None):
+    ''' 
+    Downloads only the given columns of a date indexed table within a time window, optionally
+    averaged into buckets of given resolution by the db. Window bounds are sent as bound parameters.
+
+    Args:       table_name  -> str with name of table on db
+                columns     -> list of str with column names, or None for all columns
+                start       -> optional datetime where window starts (included)
+                end         -> optional datetime where window ends (included)
+                resolution  -> optional str in RESOLUTIONS, rows are averaged by date truncated to it
+                bind        -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    pandas df with float columns indexed by UTC 'date', sorted ascending
+
+    '''
+    with begin(get_engine() if bind is None else bind) as conn:
+        if columns is None:
+            columns = [col['name'] for col in inspect(conn).get_columns(table_name) if col['name'] != 'date']
+        query = series_query(conn, table_name, columns, start, end, resolution)
+        df = read_frame(query, {'start': bind_date(start, conn), 'end': bind_date(end, conn)}, columns, conn)
+
+    return df
+
+def stream_series(table_name, columns=None, start=None, end=None, chunksize=STREAM_CHUNK_ROWS, bind=None):
+    ''' 
+    Same as fetch_series without resolution, but rows are read through a named server-side cursor and
+    yielded as dfs of up to chunksize rows, so reading a full history never holds more than one chunk
+
+    Args:       table_name  -> str with name of table on db
+                columns     -> list of str with column names, or None for all columns
+                start       -> optional datetime where window starts (included)
+                end         -> optional datetime where window ends (included)
+                chunksize   -> int number of rows per df
+                bind        -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    generator of pandas dfs with float columns indexed by UTC 'date', in ascending order
+
+    '''
+    with begin(get_engine() if bind is None else bind) as conn:
+        if columns is None:
+            columns = [col['name'] for col in inspect(conn).get_columns(table_name) if col['name'] != 'date']
+        query = series_query(conn, table_name, columns, start, end)
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunksize).execute(text(query), {'start': bind_date(start, conn), 'end': bind_date(end, conn)})
+
+        for rows in result.partitions(chunksize):
+            df = pd.DataFrame.from_records(rows, columns=['date', *columns])
+            df['date'] = pd.to_datetime(df['date'], utc=True, format='ISO8601')
+            yield df.set_index('date').astype(float)
+
+def read_frame(query, params, columns, conn):
+    ''' 
+    Runs a query returning a 'date' column followed by numeric columns and decodes the result straight
+    into typed columns. On postgres the result is streamed by binary COPY TO STDOUT. Nulls are sent as
+    NaN so every row has the same size, and rows are read as a numpy structured array without a python
+    object per value. Other dbs fall back to pandas read_sql.
+
+    Args:       query   -> str with SELECT query, using :name placeholders for params
+                params  -> dict with values of query placeholders
+                columns -> list of str with names of columns after 'date'
+                conn    -> sqlalchemy connection
+    Returns:    pandas df with float columns indexed by UTC 'date'
+
+    '''
+    if conn.dialect.name != 'postgresql':
+        df = pd.read_sql(text(query), conn, params=params, dtype={col: 'float64' for col in columns})
+        df['date'] = pd.to_datetime(df['date'], utc=True, format='ISO8601')
+        df = df.set_index('date')
+        df.columns = columns
+        return df
+
+    # COPY takes no bound parameters, so sqlalchemy compiles the query for psycopg2, escaping literal %,
+    # and psycopg2 fills in the parameters, quoting values like it does when binding them
+    compiled = text(query).compile(dialect=conn.dialect)
+    cursor = conn.connection.cursor()
+    query = cursor.mogrify(str(compiled), compiled.construct_params(params)).decode()
+    quote = conn.dialect.identifier_preparer.quote
+    select = ''.join(f", coalesce({quote(col)}::float8, 'NaN')" for col in columns)
+    buffer = BytesIO()
+    cursor.copy_expert(f'COPY (SELECT date::timestamptz{select} FROM ({query}) AS q ORDER BY 1) TO STDOUT WITH (FORMAT binary)', buffer)
+    cursor.close()
+    data = buffer.getbuffer()
+
+    # Skip signature, flags and header extension, and leave out the trailer
+    header_bytes = 19 + int.from_bytes(data[15:19], 'big')
+    # Each row holds number of fields, then the length and value of each field
+    row = np.dtype([('fields', '>i2'), ('date_length', '>i4'), ('date', '>i8')]
+                   + [field for i in range(len(columns)) for field in ((f'length{i}', '>i4'), (f'value{i}', '>f8'))])
+    rows = np.frombuffer(data[header_bytes:len(data) - 2], dtype=row)
+
+    # Timestamps are sent as microseconds since 2000-01-01 UTC
+    dates = pd.to_datetime(rows['date'].astype('int64') + PG_EPOCH_MICROSECONDS, unit='us', utc=True)
+    df = pd.DataFrame({col: rows[f'value{i}'].astype('float64') for i, col in enumerate(columns)},
+                      index=pd.DatetimeIndex(dates, name='date'))
+
+    return df
+
+def fetch_detector_weather(detector_table, station_table, weather_columns, start=None, end=None, spike_column='alti_pressure', spike_sigmas=4, bind=None):
+    ''' 
+    Downloads counts of a detector joined on date with the weather of its station in one query. Weather
+    is limited to the range of the counts, and weather rows whose spike_column is further than spike_sigmas
+    standard deviations from its mean over that range are blanked, comparing squared deviation against
+    the variance so no square root is taken per row.
+
+    Args:       detector_table  -> str with name of detector table on db
+                station_table   -> str with name of weather station table on db
+                weather_columns -> list of str with weather column names
+                start           -> optional datetime where window starts (included)
+                end             -> optional datetime where window ends (included)
+                spike_column    -> str with weather column checked for spikes
+                spike_sigmas    -> number of standard deviations beyond which a weather row is a spike
+                bind            -> sqlalchemy engine or connection, the shared engine if None
+    Returns:    pandas df indexed by UTC 'date' of counts, with 'counts', weather columns and 'has_weather',
+                1 where station had a row for that date and 0 otherwise
+
+    '''
+    with begin(get_engine() if bind is None else bind) as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        spike = quote(spike_column)
+
+        conditions = []
+        if start is not None:
+            conditions.append('date >= :start')
+        if end is not None:
+            conditions.append('date <= :end')
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        weather_select = ''.join(f', {quote(col)}' for col in weather_columns)
+        # Weather values are blanked on spike rows, squared deviation compared against the variance
+        is_spike = f'(w.{spike} - stats.mean) * (w.{spike} - stats.mean) > {spike_sigmas**2} * stats.var'
+        joined_select = ''.join(f', CASE WHEN {is_spike} THEN NULL ELSE w.{quote(col)} END AS {quote(col)}' for col in weather_columns)
+
+        # Sample variance from sums, as sqlite has no var_samp
+        query = f"""
+            WITH c AS (
+                SELECT date, counts FROM {quote(detector_table)}{where}
+            ),
+            w AS (
+                SELECT date{weather_select} FROM {quote(station_table)}
+                WHERE date >= (SELECT min(date) FROM c) AND date <= (SELECT max(date) FROM c)
+            ),
+            stats AS (
+                SELECT avg({spike}) AS mean,
+                    (sum({spike} * {spike}) - sum({spike}) * sum({spike}) / count({spike})) / nullif(count({spike}) - 1, 0) AS var
+                FROM w
+            )
+            SELECT c.date AS date, c.counts AS counts{joined_select},
+                CASE WHEN w.date IS NULL THEN 0 ELSE 1 END AS has_weather
+            FROM c CROSS JOIN stats LEFT JOIN w ON w.date = c.date
+            ORDER BY 1
+        """
+        df = read_frame(query, {'start': bind_date(start, conn), 'end': bind_date(end, conn)}, ['counts', *weather_columns, 'has_weather'], conn)
+
+    return df
@@ -6,20 +6,36 @@ This file contains important settings for each monitor data including:
     - what column number holds 'date' data based on splits made within string
     - what 'timezone' is assigned to each monitor for localization before making into UTC
     - what frequency 'freq' does the data coming from the monitor have (usually every minute)
+    - what 'layout' the monitor's log lines follow, as declared in log_layouts below
+
+Each layout in log_layouts declares how its lines are read by daily_data_upload.parse_log:
+    - 'sep': field delimiter passed to pandas read_csv
+    - 'date_fields': number of fields the date is split into by 'sep', starting at 'date_col'
+    - 'skip_date_fields': leading date fields not needed to build the date (i.e. day of week)
+    - 'date_format': explicit strptime format of the date fields joined by a space
 '''
+log_layouts = {
+    # i.e.: 317 -1 -1 Thu Jul 11 18:40:02 2024
+    'ctime_space': {'sep':r'\s+', 'date_fields':5, 'skip_date_fields':1, 'date_format':'%b %d %H:%M:%S %Y'},
+    # i.e.: 2542, 218, 117, 234, Mon Jul 22 15:06:18 2024
+    'ctime_comma': {'sep':',', 'date_fields':1, 'skip_date_fields':0, 'date_format':'%a %b %d %H:%M:%S %Y'},
+    # i.e.: 2024-06-05T10:09:40.580Z,0,0,0,106,64,103,0,924,725,935,
+    'iso_comma': {'sep':',', 'date_fields':1, 'skip_date_fields':0, 'date_format':'%Y-%m-%dT%H:%M:%S.%f%z'},
+}
+
 detector_settings = {
-    '2Paddle': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min'}, 
-    '4Paddle': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min'},
-    'MarkV': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min'},
-    'Abuja': {'splits':3, 'counts_val':2, 'counts_col':1, 'date_col':3, 'timezone':'Africa/Lagos', 'freq':'1min'},
-    'APO': {'splits':3, 'counts_val':2, 'counts_col':1, 'date_col':3, 'timezone':'US/Mountain', 'freq':'1min'},
-    'Chara_Muon002': {'splits':11, 'counts_val':1, 'counts_col':4,  'date_col':0, 'timezone':'America/Los_Angeles', 'freq':'1min'},
-    'Colombo_V1': {'splits':11, 'counts_val':1, 'counts_col':4,  'date_col':0, 'timezone':'Asia/Colombo', 'freq':'1min'},
-    'Colombo_V2': {'splits':5, 'counts_val':1, 'counts_col':2,  'date_col':5, 'timezone':'Asia/Colombo', 'freq':'1min'},
-    'OneParkPlace': {'splits':5, 'counts_val':1, 'counts_col':2, 'date_col':5, 'timezone':'America/New_York', 'freq':'1min'},
-    'Rm415_Muon001': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min'},
-    'SantaMarta': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/Bogota', 'freq':'1min'},
-    'Serbia_Belgrade_Det1':{'splits':4, 'counts_val':1, 'counts_col':1, 'date_col':4, 'timezone':'Europe/Belgrade', 'freq':'1min'},
-    'Serbia_Belgrade_Det2':{'splits':4, 'counts_val':1, 'counts_col':1, 'date_col':4, 'timezone':'Europe/Belgrade', 'freq':'1min'},
-    'UvaWellassa_Muon001':{'splits':11, 'counts_val':1, 'counts_col':4, 'date_col':0, 'timezone':'Asia/Colombo', 'freq':'1min'},
+    '2Paddle': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min', 'layout':'ctime_space'}, 
+    '4Paddle': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min', 'layout':'ctime_space'},
+    'MarkV': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min', 'layout':'ctime_space'},
+    'Abuja': {'splits':3, 'counts_val':2, 'counts_col':1, 'date_col':3, 'timezone':'Africa/Lagos', 'freq':'1min', 'layout':'ctime_comma'},
+    'APO': {'splits':3, 'counts_val':2, 'counts_col':1, 'date_col':3, 'timezone':'US/Mountain', 'freq':'1min', 'layout':'ctime_comma'},
+    'Chara_Muon002': {'splits':11, 'counts_val':1, 'counts_col':4,  'date_col':0, 'timezone':'America/Los_Angeles', 'freq':'1min', 'layout':'iso_comma'},
+    'Colombo_V1': {'splits':11, 'counts_val':1, 'counts_col':4,  'date_col':0, 'timezone':'Asia/Colombo', 'freq':'1min', 'layout':'iso_comma'},
+    'Colombo_V2': {'splits':5, 'counts_val':1, 'counts_col':2,  'date_col':5, 'timezone':'Asia/Colombo', 'freq':'1min', 'layout':'ctime_comma'},
+    'OneParkPlace': {'splits':5, 'counts_val':1, 'counts_col':2, 'date_col':5, 'timezone':'America/New_York', 'freq':'1min', 'layout':'ctime_comma'},
+    'Rm415_Muon001': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/New_York', 'freq':'1min', 'layout':'ctime_comma'},
+    'SantaMarta': {'splits':3, 'counts_val':1, 'counts_col':0, 'date_col':3, 'timezone':'America/Bogota', 'freq':'1min', 'layout':'ctime_comma'},
+    'Serbia_Belgrade_Det1':{'splits':4, 'counts_val':1, 'counts_col':1, 'date_col':4, 'timezone':'Europe/Belgrade', 'freq':'1min', 'layout':'ctime_comma'},
+    'Serbia_Belgrade_Det2':{'splits':4, 'counts_val':1, 'counts_col':1, 'date_col':4, 'timezone':'Europe/Belgrade', 'freq':'1min', 'layout':'ctime_comma'},
+    'UvaWellassa_Muon001':{'splits':11, 'counts_val':1, 'counts_col':4, 'date_col':0, 'timezone':'Asia/Colombo', 'freq':'1min', 'layout':'iso_comma'},
 }
\ No newline at end of file
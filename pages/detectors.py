@@ -1,13 +1,12 @@
 import dash
-from dash import callback, html, Input, Output, State, dcc, ctx
+from dash import callback, clientside_callback, html, Input, Output, State, dcc, ctx, Patch
 import dash_bootstrap_components as dbc
 import pylayout
 from os.path import exists
 dash.register_page(__name__)
 import pandas as pd
 import pyfigure
-from datetime import datetime, timedelta
-from io import StringIO
+import pyexport
 
 def serve_layout():
     return dbc.Container(
@@ -39,8 +38,9 @@ def serve_layout():
                     ),
                     html.Hr(style = {'size' : '50', 'borderColor':'#332348','borderHeight': "10vh", "width": "95%",}),
                     pylayout.HTML_DATA_HISTORY,
-                    dcc.Store(id='graph1-df'),
-                    dcc.Store(id='graph2-df'),
+                    dcc.Store(id='graph1-detector'),
+                    dcc.Store(id='graph2-detector'),
+                    dcc.Store(id='graph-width'),
                 ],
                 style={'padding':'0px 8vw 50px 8vw'},
             ),
@@ -51,6 +51,18 @@ def serve_layout():
 
 
 layout = serve_layout()
+''' 
+Clientside callback storing width of browser window once page loads, so graphs are
+downsampled to the pixels available to draw them
+
+Returns:    - int width in pixels
+'''
+clientside_callback(
+    'function(id) { return window.innerWidth; }',
+    Output('graph-width', 'data'),
+    Input('graph-width', 'id'),
+)
+
 ''' 
 Callback to display two detector graphs instead of one
 
@@ -88,6 +100,16 @@ def dual_detector(n_clicks):
         return dash.no_update
 
 
+def download_links(detector):
+    '''
+    Builds the links of the download buttons of a detector to the export route of app.py
+
+    Args:       - str detector name as on detector_locations.csv
+
+    Returns:    - list of str urls for last 30 days, moving average and all data
+    '''
+    return [pyexport.download_url(detector, label) for label in pyexport.DOWNLOADS]
+
 ''' 
 Callback for displaying graphs of selected detector data on multiple
 choice dropdown menu.
@@ -101,22 +123,29 @@ Returns:
             dcc.Button style dictionary,
             dcc.Button style dictionary,
             dcc.Button style dictionary,
+            dcc.Button href str,
+            dcc.Button href str,
+            dcc.Button href str,
         ]
 '''
 @callback(
     [
         Output('h-warnings', 'children'),
         Output('load-graph','children'),
-        Output('graph1-df', 'data'),
+        Output('graph1-detector', 'data'),
         Output("btn-download-30", 'style'),
         Output("btn-download-mov", 'style'),
         Output("btn-download-all", 'style'),
+        Output("btn-download-30", 'href'),
+        Output("btn-download-mov", 'href'),
+        Output("btn-download-all", 'href'),
     ],
     Input('map-plot','clickData'),
     State('map-plot', 'map'),
+    State('graph-width', 'data'),
     prevent_initial_call=True
 )
-def update_graph(clickData, state):
+def update_graph(clickData, state, width):
 
     # Extract id of current input being used
     button_id = ctx.triggered_id if not None else 'No clicks yet'
@@ -131,7 +160,7 @@ def update_graph(clickData, state):
         # by returning a dash component
         if button_id == 'map-plot':
             
-            fig, data_df = pyfigure.update_detector_figure(detector)
+            fig = pyfigure.update_detector_figure(detector, width)
 
         # Notify user if graph can be reproduced via title change and 
         # Set up additional buttons for display accordingly
@@ -142,13 +171,12 @@ def update_graph(clickData, state):
                         figure=fig,
             ),
 
-            if not data_df.empty:
-                json_data = data_df.to_json()
-            else:
-                json_data = None
+            # Buttons link to the export route, which streams files outside of callbacks
+            links = download_links(detector)
 
             title = None
             style = {}
+            graph_detector = detector
         else:
             print('Fig is none')
             # In case data is not available, revert to empty figure display
@@ -160,15 +188,17 @@ def update_graph(clickData, state):
             ),
             title = f'Data for {detector} Detector Not Available at This Time. Try again.'
             style = {'display':'none'}
-            json_data = None
+            graph_detector = None
+            links = [None, None, None]
         
         return [
             title, 
             detector_graph,
-            json_data,
+            graph_detector,
             style, 
             style, 
             style, 
+            *links,
         ]
     # else, no update occurs
     return dash.no_update
@@ -186,22 +216,29 @@ Returns:
             dcc.Button style dictionary,
             dcc.Button style dictionary,
             dcc.Button style dictionary,
+            dcc.Button href str,
+            dcc.Button href str,
+            dcc.Button href str,
         ]
 '''
 @callback(
     [
         Output('h-warnings2', 'children'),
         Output('load-graph2','children'),
-        Output('graph2-df', 'data'),
+        Output('graph2-detector', 'data'),
         Output("btn-download-30-2", 'style'),
         Output("btn-download-mov-2", 'style'),
         Output("btn-download-all-2", 'style'),
+        Output("btn-download-30-2", 'href'),
+        Output("btn-download-mov-2", 'href'),
+        Output("btn-download-all-2", 'href'),
     ],
     Input('map-plot2','clickData'),
     State('map-plot2', 'map'),
+    State('graph-width', 'data'),
     prevent_initial_call=True
 )
-def update_graph(clickData, state):
+def update_graph(clickData, state, width):
 
     # Extract id of current input being used
     button_id = ctx.triggered_id if not None else 'No clicks yet'
@@ -212,17 +249,12 @@ def update_graph(clickData, state):
         # Extract detector name and use to display graph
         detector = clickData['points'][0]['text']
         # print('button name: ', button_id, 'detector: ', detector)
-        # Format detector name to lowercase and check formatting of name 
-        # doesn't have number up front
-        detector_name = detector.lower()
-        if detector_name.startswith('2') or detector_name.startswith('4'):
-            detector_name = detector_name[1:]+detector_name[0]
 
         # Update graph to replace empty graph figure or current graph
         # by returning a dash component
         if button_id == 'map-plot2':
             
-            fig, data_df = pyfigure.update_detector_figure(detector_name, detector)
+            fig = pyfigure.update_detector_figure(detector, width)
 
             
         # Notify user if graph can be reproduced via title change and 
@@ -234,13 +266,12 @@ def update_graph(clickData, state):
                         figure=fig,
             ),
 
-            if not data_df.empty:
-                json_data = data_df.to_json()
-            else:
-                json_data = None
+            # Buttons link to the export route, which streams files outside of callbacks
+            links = download_links(detector)
 
             title = None
             style = {}
+            graph_detector = detector
         else:
             # In case data is not available, revert to empty figure display
             detector_graph = dcc.Graph(
@@ -251,160 +282,98 @@ def update_graph(clickData, state):
             ),
             title = f'Data for {detector} Detector Not Available at This Time. Try again.'
             style = {'display':'none'}
-            json_data = None
+            graph_detector = None
+            links = [None, None, None]
         
         return [
             title, 
             detector_graph,
-            json_data,
+            graph_detector,
             style, 
             style, 
             style, 
+            *links,
         ]
     # else, no update occurs
     return dash.no_update
 
 
-''' 
-Callback to handle download data requests depending on prefered type
+def relayout_window(relayout):
+    '''
+    Reads the x axis window a zoom or pan of a graph left it showing
 
-Args:   - int 0 or 1 depending if user clicked button(s)
+    Args:       - dict relayoutData of dcc.Graph
 
-Returns:    - csv file
-
-'''
-@callback(
-    Output('download-warnings', 'children'),
-    Output('download_df_csv', 'data'),
-    [   
-        Input('graph1-df','data'),
-        Input("btn-download-30", 'n_clicks'),
-        Input("btn-download-mov", 'n_clicks'),
-        Input("btn-download-all", 'n_clicks'),
-    ],
-    State('load-graph', 'children'),
-    prevent_initial_call=True,
-)
-def download_csv(json_data, btn24, btnmov, btnall, state):
-
-    # If a button has been clicked extract id of current input being used
-    button_id = ctx.triggered_id if not None else 'No clicks yet'
-    
-    # List of buttons for sorting task
-    download_buttons = ["btn-download-30", "btn-download-mov", "btn-download-all"]
-    
-    if button_id in download_buttons:
-        text = None
-        # Retrieve detector name
-        detector_name = state[0]['props']['figure']['layout']['title']['text'].strip().split(':')[0].strip()
-
-        # Read json data from dcc.Store
-        df = pd.read_json(StringIO(json_data))
-        # print(df.iloc[0].name)
-        # print(type(df.iloc[0].name))
-
-        # Trim based on request
-        if button_id == "btn-download-all":
-            final_df = df
-            filename = f'{detector_name}_all_data.csv'
-
-        elif button_id == "btn-download-30":
-            # Get current datetime and 30 days prior
-            today = datetime.now()
-            day30 = today - timedelta(30)
-
-            # Slice df
-            final_df = df.loc[:day30]
-
-            filename = f'{detector_name}_30days_data.csv'
-
-        else: # button_id == "btn-download-mov":
-            # Slice df
-            final_df = df.loc[:,'hourly_average']
-            filename = f'{detector_name}_hourly_moving_ave_data.csv'
-
-        if final_df.empty:
-            final_df = None
-            filename = ''
-            text = f'Unable to download data'
-
-        # Return a csv for download
-        return [text, dcc.send_data_frame(final_df.to_csv, filename)]
-    
+    Returns:    - Tuple [start, end] as UTC timestamps, [None, None] when axis was reset, or None
+                  when event did not change x axis
+    '''
+    if not relayout:
+        return None
+    if relayout.get('xaxis.autorange'):
+        return None, None
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        bounds = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        bounds = relayout['xaxis.range']
     else:
+        return None
+    # Dates on axis are shown as UTC without offset
+    return [pd.Timestamp(bound).tz_localize('UTC') for bound in bounds]
+
+def patch_traces(detector, relayout, width):
+    '''
+    Patches points of each trace of a detector graph with the window it was zoomed or panned to,
+    leaving layout and the rest of figure on the browser
+
+    Args:       - str detector name as on detector_locations.csv
+                - dict relayoutData of dcc.Graph
+                - int width of browser window in pixels
+
+    Returns:    - dash.Patch of figure, or dash.no_update
+    '''
+    window = relayout_window(relayout)
+    if detector is None or window is None:
         return dash.no_update
 
+    traces = pyfigure.update_detector_window(detector, *window, width)
+    if traces is None:
+        return dash.no_update
 
-''' 
-Callback # 2 to handle download data requests depending on prefered type
-for detector 2 when dual detector display is chosen
+    patched = Patch()
+    for i, trace in enumerate(traces):
+        patched['data'][i]['x'] = trace.index
+        patched['data'][i]['y'] = trace.to_numpy()
+    return patched
 
-Args:   - int 0 or 1 depending if user clicked button(s)
+''' 
+Callbacks refreshing traces of each detector graph when it is zoomed or panned, with points read
+only within the visible window at the finest resolution it fits
 
-Returns:    - csv file
+Args:   - dict relayoutData of dcc.Graph
+        - str detector name on graph
+        - int width of browser window in pixels
 
+Returns:    - dash.Patch of figure
 '''
 @callback(
-    Output('download-warnings-2', 'children'),
-    Output('download_df_csv-2', 'data'),
-    [   
-        Input('graph2-df','data'),
-        Input("btn-download-30-2", 'n_clicks'),
-        Input("btn-download-mov-2", 'n_clicks'),
-        Input("btn-download-all-2", 'n_clicks'),
-    ],
-    State('load-graph2', 'children'),
+    Output('graph-detector-display', 'figure'),
+    Input('graph-detector-display', 'relayoutData'),
+    State('graph1-detector', 'data'),
+    State('graph-width', 'data'),
     prevent_initial_call=True,
 )
-def download_csv(json_data, btn24, btnmov, btnall, state):
-
-    # If a button has been clicked extract id of current input being used
-    button_id = ctx.triggered_id if not None else 'No clicks yet'
-    
-    # List of buttons for sorting task
-    download_buttons = ["btn-download-30-2", "btn-download-mov-2", "btn-download-all-2"]
-    
-    if button_id in download_buttons:
-        text = None
-        # Retrieve detector name
-        detector_name = state[0]['props']['figure']['layout']['title']['text'].strip().split(':')[0].strip()
-
-        # Read json data from dcc.Store
-        df = pd.read_json(StringIO(json_data))
-        print(df.iloc[0].name)
-        print(type(df.iloc[0].name))
-
-        # Trim based on request
-        if button_id == "btn-download-all-2":
-            final_df = df
-            filename = f'{detector_name}_all_data.csv'
-
-        elif button_id == "btn-download-30-2":
-            # Get current datetime and 30 days prior
-            today = datetime.now()
-            day30 = today - timedelta(30)
-
-            # Slice df
-            final_df = df.loc[day30:]
-
-            filename = f'{detector_name}_30days_data.csv'
-
-        else: # button_id == "btn-download-mov":
-            # Slice df
-            final_df = df.loc[:,'hourly_average']
-            filename = f'{detector_name}_hourly_moving_ave_data.csv'
-
-        if final_df.empty:
-            final_df = None
-            filename = ''
-            text = f'Unable to download data'
-
-        # Return a csv for download
-        return [text, dcc.send_data_frame(final_df.to_csv, filename)]
-    
-    else:
-        return dash.no_update
+def zoom_graph(relayout, detector, width):
+    return patch_traces(detector, relayout, width)
 
+@callback(
+    Output('graph-detector-display-2', 'figure'),
+    Input('graph-detector-display-2', 'relayoutData'),
+    State('graph2-detector', 'data'),
+    State('graph-width', 'data'),
+    prevent_initial_call=True,
+)
+def zoom_graph(relayout, detector, width):
+    return patch_traces(detector, relayout, width)
 
 ''' 
 Callback for refreshing and displaying available history of 
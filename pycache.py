@@ -0,0 +1,145 @@
+''' 
+
+Module caching figures and data built for each detector, keyed by the version of its data
+
+Entries are keyed by (detector, data version, view parameters). Versions are bumped by the nightly
+ingestion whenever it writes new data, so a new version makes every entry of the older ones
+unreachable right away instead of waiting for a time to live. Each worker keeps its most recently
+used entries in memory, and when the FIGURE_CACHE_DIR .env variable is set, entries are also pickled
+into that folder so every gunicorn worker of the host can reuse what another one built.
+
+'''
+import glob
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import getenv
+
+# Entries kept in memory by each worker, least recently used ones are evicted first
+CACHE_MEMORY_ENTRIES = 32
+
+# Entries in memory by key, oldest used first
+_memory = OrderedDict()
+_lock = threading.Lock()
+
+# Lookups served by each tier and built from scratch on this process
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _disk_path(cache_dir, name, version, params):
+    '''
+    Builds path of the file holding an entry on the disk tier, params are hashed so any of them
+    can be used without escaping
+
+    '''
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{name}@{version}@{digest}.pkl')
+
+@contextmanager
+def atomic_write(path):
+    '''
+    Opens a file written in place of path under a temporary name, renamed to path once the block
+    completes so other workers never read a partial file. Nothing is left behind if the block
+    raises or, on generators, is closed before completing.
+
+    Args:       path    -> str path of file, its folder is created if missing
+    Returns:    context manager giving the binary file open for writing, temporary path on its name
+
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _remember(key, value):
+    '''
+    Stores an entry in memory, dropping entries of older versions of the same detector and then
+    the least recently used ones above CACHE_MEMORY_ENTRIES
+
+    '''
+    name, version, _ = key
+    with _lock:
+        for old_key in [k for k in _memory if k[0] == name and k[1] != version]:
+            del _memory[old_key]
+        _memory[key] = value
+        _memory.move_to_end(key)
+        while len(_memory) > CACHE_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+            _stats['evictions'] += 1
+
+def cached(name, version, params, build):
+    '''
+    Gets the value cached for a detector at given data version and view parameters, building and
+    caching it on a miss. Cached values are shared by every caller, so they must not be modified.
+
+    Args:       name    -> str with formatted detector name
+                version -> int data version from database.get_data_version
+                params  -> tuple of view parameters the value depends on, with a stable repr
+                build   -> callable with no arguments returning the value, pickleable for the disk tier
+    Returns:    cached or newly built value
+
+    '''
+    key = (name, version, params)
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            _stats['memory_hits'] += 1
+            return _memory[key]
+
+    cache_dir = getenv('FIGURE_CACHE_DIR')
+    path = _disk_path(cache_dir, name, version, params) if cache_dir else None
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except Exception:
+            # Entry removed or replaced by another worker meanwhile
+            value = None
+        else:
+            with _lock:
+                _stats['disk_hits'] += 1
+            _remember(key, value)
+            return value
+
+    value = build()
+    with _lock:
+        _stats['misses'] += 1
+    _remember(key, value)
+
+    if path is not None:
+        with atomic_write(path) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Files of older versions are never read again
+        for old_path in glob.glob(os.path.join(cache_dir, f'{glob.escape(name)}@*@*.pkl')):
+            if int(os.path.basename(old_path).split('@')[1]) < version:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    return value
+
+def cache_stats():
+    '''
+    Reports lookups served by each tier of the cache on this process
+
+    Args:       None
+    Returns:    dict with pid, hits by tier, misses, evictions, hit ratio and entries in memory
+
+    '''
+    with _lock:
+        stats = dict(_stats)
+        stats['memory_entries'] = len(_memory)
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    stats['disk_dir'] = getenv('FIGURE_CACHE_DIR') or None
+
+    return {'pid': os.getpid(), **stats}
@@ -0,0 +1,150 @@
+''' 
+
+Module containing functions to downsample time series before they are plotted
+
+Series are reduced to a number of points close to the pixels available to draw them, as more
+points than pixels only add to the figure payload and not to what is seen. Gaps of missing data
+wider than one bucket of the target resolution are kept as gaps, shorter ones are not visible at
+that resolution and are bridged.
+
+'''
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, n_out):
+    '''
+    Largest-Triangle-Three-Buckets downsampling. Keeps first and last points, and from each bucket
+    in between the point forming the largest triangle with the point kept on the previous bucket
+    and the average of the next bucket, which keeps the visual shape of the series.
+
+    Args:       x       -> numpy float array sorted ascending, without NaN
+                y       -> numpy float array of same length, without NaN
+                n_out   -> int number of points to keep
+    Returns:    numpy int array with sorted positions of points kept
+
+    '''
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+
+    # Middle points split into n_out - 2 buckets, first and last points are buckets of their own
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        # Twice the triangle area, sign left out
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return kept
+
+def minmax(x, y, n_out):
+    '''
+    Min-max downsampling. Keeps the lowest and highest points of each of n_out / 2 buckets of equal
+    number of points, plus first and last points, so every spike stays on the plot.
+
+    Args:       x       -> numpy float array sorted ascending, without NaN
+                y       -> numpy float array of same length, without NaN
+                n_out   -> int number of points to keep
+    Returns:    numpy int array with sorted positions of points kept
+
+    '''
+    n = len(y)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+
+    buckets = max(n_out // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    # Sorting by bucket then value leaves the min of each bucket at its start and the max at its end
+    order = np.lexsort((y, np.repeat(np.arange(buckets), np.diff(edges))))
+
+    return np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1], [0, n - 1]]))
+
+# Downsampling methods by name, each taking x, y and number of points and returning positions kept
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': minmax}
+
+def bucket_width(series, n_out):
+    '''
+    Time spanned by each of n_out buckets over the valid points of a series, the narrowest gap that
+    stays visible once series is downsampled to n_out points
+
+    Args:       series  -> pandas series indexed by dates sorted ascending, NaN where data is missing
+                n_out   -> int number of points
+    Returns:    pandas timedelta
+
+    '''
+    dates = series.index[series.notna().to_numpy()]
+    if len(dates) < 2:
+        return pd.Timedelta(0)
+    return (dates[-1] - dates[0]) / max(n_out, 1)
+
+def downsample(series, n_out, method='lttb', min_gap=None):
+    '''
+    Downsamples a date indexed series to about n_out points. Series is split on gaps between valid
+    points wider than bucket_width, whether dates are missing or hold NaN, each part gets points in
+    proportion to its length, and a NaN is placed halfway across each of those gaps so the plotted
+    line breaks over it. Series sampled coarser than a bucket, as zoomed windows are, need min_gap
+    so consecutive points are not taken for gaps.
+
+    Args:       series  -> pandas series indexed by dates sorted ascending, NaN where data is missing
+                n_out   -> int number of points to keep
+                method  -> str key of DOWNSAMPLERS
+                min_gap -> optional pandas timedelta, narrower gaps are bridged even if wider than a bucket
+    Returns:    pandas series with points kept and NaN on gaps
+
+    '''
+    positions = np.flatnonzero(series.notna().to_numpy())
+    if len(positions) == 0:
+        return series.iloc[:0]
+
+    x = series.index.asi8[positions].astype('float64')
+    y = series.to_numpy(dtype='float64')[positions]
+
+    # Valid points after which a gap wider than a bucket starts
+    breaks = np.flatnonzero(np.diff(x) > max(bucket_width(series, n_out), pd.Timedelta(min_gap or 0)).value)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks + 1, [len(positions)]])
+
+    downsampler = DOWNSAMPLERS[method]
+    kept = []
+    for start, end in zip(starts, ends):
+        points = max(int(round(n_out * (end - start) / len(positions))), 2)
+        kept.append(start + downsampler(x[start:end] - x[start], y[start:end], points))
+    kept = np.concatenate(kept)
+
+    # Gap markers go halfway across each gap, on a whole second as plotly drops finer precision
+    middles = (series.index.asi8[positions[ends[:-1] - 1]] + series.index.asi8[positions[starts[1:]]]) // 2
+    dates = np.concatenate([series.index.asi8[positions[kept]], middles - middles % 10**9])
+    values = np.concatenate([y[kept], np.full(len(ends) - 1, np.nan)])
+    order = np.argsort(dates, kind='stable')
+
+    return pd.Series(values[order], index=pd.DatetimeIndex(dates[order], tz=series.index.tz, name=series.index.name), name=series.name)
+
+def gap_edges(series, min_gap):
+    '''
+    Finds the points bordering each gap between valid points wider than min_gap, whether dates are
+    missing or hold NaN, to draw a line across the gaps alone
+
+    Args:       series  -> pandas series indexed by dates sorted ascending, NaN where data is missing
+                min_gap -> pandas timedelta, narrower gaps are left out
+    Returns:    pandas series with last point before and first point after each gap, separated by NaN
+
+    '''
+    valid = series.dropna()
+    wide = np.flatnonzero(np.diff(valid.index.asi8) > pd.Timedelta(min_gap).value)
+
+    # Each gap as its two edges followed by NaN so edges of different gaps are not joined
+    values = np.column_stack([valid.to_numpy()[wide], valid.to_numpy()[wide + 1], np.full(len(wide), np.nan)]).ravel()
+    dates = np.column_stack([valid.index.asi8[wide], valid.index.asi8[wide + 1], valid.index.asi8[wide + 1]]).ravel()
+
+    return pd.Series(values, index=pd.DatetimeIndex(dates, tz=series.index.tz, name=series.index.name), name=series.name)
@@ -0,0 +1,379 @@
+''' 
+
+Module exporting the series of each detector as files for download
+
+Exports are written chunk by chunk, read from the detector's derived series table on db through a
+server-side cursor, so a worker never holds a whole history, and each chunk is streamed to the
+client as soon as it is written. The products of the download buttons (DOWNLOADS) are the same for
+every visitor until the next upload, so they are also saved into EXPORT_DIR, written ahead by the
+nightly ingestion with build_downloads, and served from their file with HTTP Range and ETag
+support. Other exports are only streamed, so requests can not fill the disk.
+
+'''
+import glob
+import gzip
+import hashlib
+import io
+import os
+import re
+from os import getenv
+from urllib.parse import quote, urlencode
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from flask import jsonify, request, send_file, Response, stream_with_context
+
+from database import table_name, stream_series, get_data_version, DERIVED_SUFFIX
+import pycache
+from pyfigure import DATA_COLUMNS, WEATHER_COLUMNS, WEATHER_CHANGE_COLUMNS
+
+# Folder holding export files, EXPORT_DIR .env variable overrides it
+EXPORT_DIR = os.path.join('app_data', 'exports')
+
+# Rows of each chunk read and written at once
+EXPORT_CHUNK_ROWS = 50000
+
+# Mimetype of each export format
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file',
+}
+
+# Export files not written or replaced for longer than EXPORT_RETENTION are removed by expire_exports
+EXPORT_RETENTION = '7D'
+
+# Columns of the derived series tables that can be exported
+EXPORT_COLUMNS = [*DATA_COLUMNS, *WEATHER_COLUMNS, *WEATHER_CHANGE_COLUMNS]
+
+# Products of the download buttons of the detector pages by label, as query parameters of the
+# export route. Label is appended to the detector name for the name of the downloaded file
+DOWNLOADS = {
+    '30days_data': {'days': 30, 'format': 'csv.gz'},
+    'hourly_moving_ave_data': {'columns': 'hourly_mov_average', 'format': 'csv.gz'},
+    'all_data': {'format': 'csv.gz'},
+}
+
+
+def _export_dir():
+    '''
+    Gets folder of export files
+
+    '''
+    return getenv('EXPORT_DIR') or EXPORT_DIR
+
+def _to_utc(value):
+    '''
+    Parses a date given as text, dates without offset are taken as UTC
+
+    '''
+    date = pd.Timestamp(value)
+    return date.tz_localize('UTC') if date.tzinfo is None else date.tz_convert('UTC')
+
+def _is_download(columns, fmt, days):
+    '''
+    Tells whether an export without start or end is one of the products of DOWNLOADS
+
+    '''
+    for params in DOWNLOADS.values():
+        product_columns = params['columns'].split(',') if 'columns' in params else DATA_COLUMNS
+        product_days = float(params['days']) if 'days' in params else None
+        if (params['format'], product_columns, product_days) == (fmt, columns, days):
+            return True
+    return False
+
+def export_request(detector_name_og, start=None, end=None, columns=None, fmt='csv', days=None, filename=None, day=None):
+    '''
+    Validates the parameters of an export and resolves the file it is served from
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+                start               -> optional str or datetime where export starts (included)
+                end                 -> optional str or datetime where export ends (included)
+                columns             -> optional str of comma separated EXPORT_COLUMNS, DATA_COLUMNS if None
+                fmt                 -> str key of EXPORT_FORMATS
+                days                -> optional number of days before now export starts at, instead of start
+                filename            -> optional str name of downloaded file, without extension
+                day                 -> optional UTC day days are counted back from, the current one if None
+    Returns:    dict describing the export, with the path of its file if it is saved or None, or None if
+                detector has no data
+    Raises:     ValueError if a parameter is not valid
+
+    '''
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(EXPORT_FORMATS)}')
+
+    columns = DATA_COLUMNS if not columns else [col.strip() for col in columns.split(',')]
+    unknown = [col for col in columns if col not in EXPORT_COLUMNS]
+    if unknown or len(set(columns)) != len(columns):
+        raise ValueError(f'columns must be distinct among {", ".join(EXPORT_COLUMNS)}')
+
+    # Only products of the download buttons are saved, other windows and columns are streamed alone
+    days = float(days) if days is not None else None
+    saved = start is None and end is None and _is_download(columns, fmt, days)
+
+    # Relative windows start on a whole UTC day, so exports asked on the same day share the file the
+    # nightly ingestion wrote for them
+    if days is not None:
+        day = pd.Timestamp.now(tz='UTC') if day is None else _to_utc(day)
+        start = day.floor('D') - pd.Timedelta(days=days)
+    start = _to_utc(start) if start is not None else None
+    end = _to_utc(end) if end is not None else None
+
+    detector_name = table_name(detector_name_og)
+
+    version = get_data_version(detector_name)
+    if version is None:
+        return None
+
+    digest = hashlib.sha1(repr((fmt, columns, start, end)).encode()).hexdigest()[:16]
+    filename = re.sub(r'[^\w.-]', '_', filename or f'{detector_name_og}_data')
+
+    return {
+        'detector_name_og': detector_name_og,
+        'name': detector_name,
+        'version': version,
+        'columns': columns,
+        'start': start,
+        'end': end,
+        'format': fmt,
+        'mimetype': EXPORT_FORMATS[fmt],
+        'filename': f'{filename}.{fmt}',
+        'etag': f'{detector_name}-{version}-{digest}',
+        'path': os.path.join(_export_dir(), f'{detector_name}@{version}@{digest}.{fmt}') if saved else None,
+    }
+
+def export_url(detector_name_og, **params):
+    '''
+    Builds the url of the export route of app.py for a detector
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+                params              -> query parameters of export_request, 'format' for fmt
+    Returns:    str url
+
+    '''
+    return f'/export/{quote(detector_name_og)}?{urlencode(params)}'
+
+def download_url(detector_name_og, label):
+    '''
+    Builds the url a download button of the detector pages links to
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+                label               -> str key of DOWNLOADS
+    Returns:    str url
+
+    '''
+    return export_url(detector_name_og, filename=f'{detector_name_og}_{label}', **DOWNLOADS[label])
+
+def export_chunks(spec):
+    '''
+    Reads the rows of an export chunk by chunk from the derived series table
+
+    Args:       spec    -> dict from export_request
+    Returns:    generator of pandas dfs with spec columns indexed by UTC 'date', in ascending order
+
+    '''
+    yield from stream_series(spec['name'] + DERIVED_SUFFIX, spec['columns'], spec['start'], spec['end'], chunksize=EXPORT_CHUNK_ROWS)
+
+def _write_export(spec, f):
+    '''
+    Writes the rows of an export into an open binary file in its format, yielding after each chunk
+    so what is written so far can be sent
+
+    '''
+    empty = pd.DataFrame({col: pd.Series(dtype='float64') for col in spec['columns']}, index=pd.DatetimeIndex([], tz='UTC', name='date'))
+    fmt = spec['format']
+
+    if fmt in ('csv', 'csv.gz'):
+        out = gzip.GzipFile(fileobj=f, mode='wb') if fmt == 'csv.gz' else f
+        header = True
+        for chunk in export_chunks(spec):
+            out.write(chunk.to_csv(header=header).encode())
+            header = False
+            yield
+        if header:
+            out.write(empty.to_csv().encode())
+        if out is not f:
+            out.close()
+        return
+
+    # Columnar formats get a row group or record batch per chunk, all sharing the schema of the columns
+    schema = pa.Schema.from_pandas(empty)
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(f, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(f, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    for chunk in export_chunks(spec):
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema))
+        yield
+    writer.close()
+
+def _remove_old_exports(spec):
+    '''
+    Removes export files of older data versions of a detector
+
+    '''
+    for old_path in glob.glob(os.path.join(_export_dir(), f'{glob.escape(spec["name"])}@*@*')):
+        try:
+            if int(os.path.basename(old_path).split('@')[1]) < spec['version']:
+                os.remove(old_path)
+        except (ValueError, OSError):
+            pass
+
+class _ChunkSink(io.RawIOBase):
+    '''
+    Write-only file keeping what is written until taken, for exports streamed without a file
+
+    '''
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def stream_export(spec):
+    '''
+    Writes an export, yielding the bytes of each chunk once written. Exports with a path are saved
+    into their file on EXPORT_DIR, which only replaces spec path once complete, so an interrupted
+    download leaves nothing behind.
+
+    Args:       spec    -> dict from export_request
+    Returns:    generator of bytes
+
+    '''
+    if spec['path'] is None:
+        sink = _ChunkSink()
+        for _ in _write_export(spec, sink):
+            data = sink.take()
+            if data:
+                yield data
+        data = sink.take()
+        if data:
+            yield data
+        return
+
+    with pycache.atomic_write(spec['path']) as f, open(f.name, 'rb') as reader:
+        for _ in _write_export(spec, f):
+            f.flush()
+            data = reader.read()
+            if data:
+                yield data
+        f.flush()
+        data = reader.read()
+        if data:
+            yield data
+
+    _remove_old_exports(spec)
+
+def build_export(spec):
+    '''
+    Writes an export into its file on EXPORT_DIR unless it is already there
+
+    Args:       spec    -> dict from export_request, with a path
+    Returns:    str path of export file
+
+    '''
+    if not os.path.exists(spec['path']):
+        for _ in stream_export(spec):
+            pass
+    return spec['path']
+
+def export_response(detector_name_og):
+    '''
+    Answers a request of the export route of app.py, with the query parameters of export_request
+    ('format' for fmt). Saved products are served from their file with Range, If-Range and
+    If-None-Match support, a Range request waiting for the file to be written; other requests get
+    the rows streamed as they are read, or a 304 if their ETag matches
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+    Returns:    flask response
+
+    '''
+    args = request.args
+    try:
+        spec = export_request(
+            detector_name_og, args.get('start'), args.get('end'), args.get('columns'),
+            args.get('format', 'csv'), args.get('days'), args.get('filename'),
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if spec is None:
+        return jsonify(error=f'No data for detector {detector_name_og}'), 404
+
+    saved = spec['path'] is not None
+    if saved and (os.path.exists(spec['path']) or request.range is not None):
+        return send_file(
+            build_export(spec), mimetype=spec['mimetype'], as_attachment=True,
+            download_name=spec['filename'], conditional=True, etag=spec['etag'],
+        )
+
+    if request.if_none_match.contains(spec['etag']):
+        response = Response(status=304)
+    else:
+        response = Response(stream_with_context(stream_export(spec)), mimetype=spec['mimetype'])
+        response.headers.set('Content-Disposition', 'attachment', filename=spec['filename'])
+    response.set_etag(spec['etag'])
+    if saved:
+        response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def build_downloads(detector_name_og):
+    '''
+    Writes the export file of every product of DOWNLOADS for the current data version of a
+    detector, so download requests are served from a file written ahead. Products of relative
+    windows are written for the current and the next UTC day, as the nightly ingestion runs on
+    local time and its files must still be found once the UTC day turns
+
+    Args:       detector_name_og    -> str name of detector as on detector_locations.csv
+    Returns:    dict with list of export file paths by DOWNLOADS label, empty if detector has no data
+
+    '''
+    today = pd.Timestamp.now(tz='UTC').floor('D')
+    paths = {}
+    for label, params in DOWNLOADS.items():
+        params = dict(params)
+        fmt = params.pop('format')
+        days = [today, today + pd.Timedelta(days=1)] if 'days' in params else [None]
+        for day in days:
+            spec = export_request(detector_name_og, fmt=fmt, day=day, **params)
+            if spec is None:
+                return paths
+            paths.setdefault(label, []).append(build_export(spec))
+
+    return paths
+
+def expire_exports(retention=EXPORT_RETENTION):
+    '''
+    Removes export files not written for longer than retention, like those of relative windows of
+    past days whose data version did not change since
+
+    Args:       retention   -> str or pandas timedelta
+    Returns:    int number of files removed
+
+    '''
+    cutoff = pd.Timestamp.now().timestamp() - pd.Timedelta(retention).total_seconds()
+    removed = 0
+    for path in glob.glob(os.path.join(_export_dir(), '*@*@*')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+
+    return removed
@@ -4,11 +4,39 @@ Module containing functions to generate graphs for each detector
 
 '''
 import plotly.graph_objects as go
-from database import connect_to_db, format_sql
-from sqlalchemy import text
+from database import table_name, get_engine, fetch_series, fetch_rollup, pick_resolution, get_data_version, get_last_date, ROLLUPS, RAW_SUFFIX, DERIVED_SUFFIX, DERIVED_ROLLUP_COLUMNS
+from detector_info_settings.detector_format_settings import detector_settings
+import pycache
+from pydownsample import downsample, gap_edges, bucket_width
 import pandas as pd
 import numpy as np
 
+# Weather columns plotted along counts
+WEATHER_COLUMNS = ['temp_in_f', 'sea_l_pressure_millibar', 'alti_pressure']
+
+# Changes of the weather columns kept on the derived series tables, scaled % change and difference to the mean
+WEATHER_CHANGE_COLUMNS = ['temp_pct', 'alti_press_pct', 'sea_l_press_pct', 'delta_temp', 'delta_alti_pressure', 'delta_sea_l_pressure']
+
+# Counts columns downloaded from the detector pages
+DATA_COLUMNS = ['counts', 'hourly_mov_average', 'counts_pct', 'delta_counts']
+
+# Traces are downsampled to POINTS_PER_PIXEL points per pixel of graph width, with the method of
+# pydownsample.DOWNSAMPLERS below. Widths are rounded up to GRAPH_WIDTH_STEP pixels so screens of
+# similar size share cached figures, DEFAULT_GRAPH_WIDTH is used when page did not report one
+POINTS_PER_PIXEL = 1
+DOWNSAMPLE_METHOD = 'lttb'
+GRAPH_WIDTH_STEP = 200
+DEFAULT_GRAPH_WIDTH = 1600
+
+# Zoomed windows are read with WINDOW_MARGIN of their span on each side, so short pans do not show
+# blank edges before the next read. Windows holding at most RAW_ROWS_PER_POINT raw rows per point
+# of the graph are drawn from the raw rows of the detector while these have not expired, windows
+# spanning more hours than points from the daily or weekly rollups of its derived series, and the
+# rest from its hourly rows. Gaps shorter than GAP_ROWS rows are bridged however deep the zoom
+WINDOW_MARGIN = 0.25
+RAW_ROWS_PER_POINT = 16
+GAP_ROWS = 2
+
 LABEL_GRAPH_DETECTOR = {
     "title": "<b>Detector</b>",
     "yaxis": {"title": "<b>Flux percentage change</b>"},
@@ -63,122 +91,159 @@ def generate_empty_figure(text: str= '', size: int = 40):
     return go.Figure(data, layout)
 
 
-def update_detector_figure(detector_name_og):
+def update_detector_figure(detector_name_og, width=None):
     '''
-    Generates graph figure based on provided detector data
+    Generates graph figure based on provided detector data, built once per version of the detector's
+    data and graph width and then served from pycache
     
     Args:       - detector_name (str): Name of detector for which data is being retrieved
+                - width (int, optional): Width of graph in pixels, traces are downsampled to fit it
 
-    Returns:    - px.line figure: An plotly express figure showing glowcost data
+    Returns:    - go.Figure, or None if no data
 
     '''
-    # Format detector name to lowercase and check formatting of name doesn't have number up front
-    detector_name = detector_name_og.lower()
-    if detector_name.startswith('2') or detector_name.startswith('4'):
-        detector_name = detector_name[1:]+detector_name[0]
-
-    detectors = pd.read_csv('detector_info_settings/detector_locations.csv', sep=',')
-    detector_station = detectors.loc[detectors['name'] == detector_name_og, 'weather_station'].item()
-    detector_station = detector_station.lower()
-
-    # Extract tables from db
-    # try:
-    db = connect_to_db()
-    with db.connect() as conn:
-        query = text(f'SELECT * FROM {detector_name}')
-        result = conn.execute(query)
-        counts_data = result.fetchall()
-        conn.close()
-    
-    db = connect_to_db()
-    with db.connect() as conn:
+    detector_name = table_name(detector_name_og)
 
-        query = text(f'SELECT * FROM {detector_station}')
-        result = conn.execute(query)
-        weather_data = result.fetchall()
-        conn.close()
-    
-    # Close connection
-    db.dispose()
-    
-    # Format data into pandas df
-    df = format_sql(counts_data)
-    wdf = format_sql(weather_data)
-
-    # Slice based on counts df indexes
-    wdf = wdf.loc[pd.to_datetime(df.head(1).index.values[0],utc=True):]
-    wdf = wdf.loc[:pd.to_datetime(df.tail(1).index.values[0],utc=True)]
-
-    # Format all columns appropiately to a numeric type
-    columns_types = wdf.dtypes.to_list()
-    if len(set(columns_types)) > 1:
-        for col in wdf.columns.to_list():
-            wdf[col] = pd.to_numeric(wdf[col])
-    
-    # Remove spikes of data points that are errors via standard deviation
-    wdf.loc[(wdf['alti_pressure'] > wdf['alti_pressure'].mean() + (4*wdf['alti_pressure'].std())) | (wdf['alti_pressure'] < wdf['alti_pressure'].mean() - (4*wdf['alti_pressure'].std()))] = np.nan
+    # Series are derived by the nightly ingestion, which stamps them with a version
+    version = get_data_version(detector_name)
+    if version is None:
+        return None
 
-    df.sort_index(inplace=True)
-    # Calculate hourly moving average
-    df['hourly_mov_average'] = df['counts'].rolling(window='24h').mean()
+    width = int(np.ceil((width or DEFAULT_GRAPH_WIDTH) / GRAPH_WIDTH_STEP) * GRAPH_WIDTH_STEP)
+    return pycache.cached(detector_name, version, ('figure', width, DOWNSAMPLE_METHOD), lambda: build_detector_figure(detector_name, detector_name_og, width))
 
-    ''' 
-    The Percentage Change quantifies the change from one number to another 
-    and expresses the change as an increase or decrease.
+def update_detector_window(detector_name_og, start=None, end=None, width=None):
+    '''
+    Gets the points of each trace of update_detector_figure within a zoomed time window, read from
+    db at the finest resolution the window fits, so traces can be patched in place on zoom and pan.
+    Only rows within the window are read, so deep zooms take the same time whatever the length
+    of the history. Whole traces of the cached figure are returned when no window is given.
+
+    Args:       - detector_name_og (str): Name of detector as on detector_locations.csv
+                - start (datetime, optional): Start of window, UTC
+                - end (datetime, optional): End of window, UTC
+                - width (int, optional): Width of graph in pixels
+
+    Returns:    - list of pandas series, one per trace of figure in its order, or None if no data
+
+    '''
+    fig = update_detector_figure(detector_name_og, width)
+    if fig is None:
+        return None
+    if start is None or end is None:
+        return [pd.Series(trace.y, index=pd.DatetimeIndex(trace.x)) for trace in fig.data]
+
+    detector_name = table_name(detector_name_og)
 
-        i.e.: 10 apples to 20 apples change = 100% increase (change)
+    window_start, window_end = pd.Timestamp(start), pd.Timestamp(end)
+    margin = (window_end - window_start) * WINDOW_MARGIN
+    start, end = window_start - margin, window_end + margin
+    width = int(np.ceil((width or DEFAULT_GRAPH_WIDTH) / GRAPH_WIDTH_STEP) * GRAPH_WIDTH_STEP)
+    n_points = int(width * POINTS_PER_PIXEL * (1 + 2 * WINDOW_MARGIN))
 
-    Percentage change equals the change in value divided by the 
-    absolute value of the original value, multiplied by 100.
+    if pick_resolution(start, end, n_points) != 'hour':
+        # Windows spanning more hours than points are read from the rollups of the derived series, at
+        # the coarsest resolution whose buckets are no wider than a point
+        rollup, resolution = fetch_rollup(detector_name + DERIVED_SUFFIX, DERIVED_ROLLUP_COLUMNS, start, end, n_points)
+        counts, wdf = rollup['counts_pct'], rollup
+        step = weather_step = pd.Timedelta(hours=ROLLUPS[resolution][1] if resolution in ROLLUPS else 1)
+    else:
+        derived = fetch_series(detector_name + DERIVED_SUFFIX, ['counts', *DERIVED_ROLLUP_COLUMNS, 'has_weather'], start, end)
+        counts = derived['counts_pct']
+        wdf = derived.loc[derived['has_weather'] == 1]
+        step = weather_step = pd.Timedelta('1h')
 
-        i.e.: (V2 - V1)/ |V1|  * 100
+        # Raw rows are only read when the window is narrow enough and they cover it, since they expire
+        freq = pd.Timedelta(detector_settings.get(detector_name_og, {}).get('freq', '1min'))
+        raw_last = get_last_date(detector_name + RAW_SUFFIX, get_engine())
+        valid = derived.loc[derived['counts_pct'].notna()]
+        if (end - start) / freq <= n_points * RAW_ROWS_PER_POINT and raw_last is not None and raw_last >= window_start and not valid.empty:
+            raw = fetch_series(detector_name + RAW_SUFFIX, ['counts'], start, end)['counts']
+            if not raw.empty and raw.index[0] <= window_start + step:
+                # Mean of hourly counts the percentages are relative to, recovered from the window's own rows
+                mean = (valid['counts'] / (1 + valid['counts_pct'] / 100)).median()
+                counts = (raw * (step / freq) / mean - 1) * 100
+                step = freq
 
-    For purposes of this calculation, our V2 is the mean of the counts of muons
+    gap = max(bucket_width(counts, n_points), step * GAP_ROWS)
+    traces = [
+        gap_edges(counts, gap),
+        downsample(counts, n_points, DOWNSAMPLE_METHOD, gap),
+        downsample(wdf['temp_pct'], n_points, DOWNSAMPLE_METHOD, weather_step * GAP_ROWS),
+        downsample(wdf['alti_press_pct'], n_points, DOWNSAMPLE_METHOD, weather_step * GAP_ROWS),
+        downsample(wdf['sea_l_press_pct'], n_points, DOWNSAMPLE_METHOD, weather_step * GAP_ROWS),
+    ]
+    return traces[:len(fig.data)]
+
+def build_detector_figure(detector_name, detector_name_og, width=DEFAULT_GRAPH_WIDTH):
     '''
-    df['counts_pct'] = ((df['counts'] - df['counts'].mean()) / df['counts'].mean() * 100)
-    wdf['temp_pct']=0.2*((wdf['temp_in_f'] - wdf['temp_in_f'].mean())/ wdf['temp_in_f'].mean()*100)
-    wdf['alti_press_pct'] = 5*((wdf['alti_pressure'] - wdf['alti_pressure'].mean()) / wdf['alti_pressure'].mean() * 100)
-    wdf['sea_l_press_pct'] = ((wdf['sea_l_pressure_millibar'] - wdf['sea_l_pressure_millibar'].mean()) / wdf['sea_l_pressure_millibar'].mean() * 100)
-    
-    # Change/delta of counts, pressure and temp - not really used but physics lab was calculating for later use
-    df['delta_counts'] = np.log(df['counts'] / df['counts'].mean())
-    wdf['delta_temp'] = wdf['temp_in_f'] - wdf['temp_in_f'].mean()
-    wdf['delta_alti_pressure'] = wdf['alti_pressure'] - wdf['alti_pressure'].mean()
-    wdf['delta_sea_l_pressure'] = wdf['sea_l_pressure_millibar'] - wdf['sea_l_pressure_millibar'].mean()
-    
-    
-    # make counts df tz-naive
-    # df.index = df.index.tz_localize(None)
-    
+    Builds the graph figure of a detector from its derived series
+
+    Args:       - detector_name (str): Formatted name of detector, as its tables on db
+                - detector_name_og (str): Name of detector as on detector_locations.csv
+                - width (int): Width of graph in pixels
+
+    Returns:    - go.Figure
+
+    '''
+    # Weather series are plotted on dates station had a row for
+    derived = fetch_series(detector_name + DERIVED_SUFFIX)
+    df = derived[DATA_COLUMNS]
+    wdf = derived.loc[derived['has_weather'] == 1, [*WEATHER_COLUMNS, *WEATHER_CHANGE_COLUMNS]]
+
+    return detector_figure(df, wdf, detector_name_og, width * POINTS_PER_PIXEL)
+
+def detector_figure(df, wdf, detector_name_og, n_points, method=DOWNSAMPLE_METHOD):
+    '''
+    Builds the graph figure of a detector with each trace downsampled to about n_points. Gaps in the
+    counts wider than what a point covers, and than GAP_ROWS hourly rows, stay as gaps, and the
+    dashed 'Offline' trace only joins the edges of those gaps.
+
+    Args:       - df (pandas df): Counts series by date, with 'counts_pct'
+                - wdf (pandas df): Weather series by date, with 'temp_pct', 'alti_press_pct' and 'sea_l_press_pct'
+                - detector_name_og (str): Name of detector as on detector_locations.csv
+                - n_points (int): Number of points to keep on each trace
+                - method (str): Key of pydownsample.DOWNSAMPLERS
+
+    Returns:    - go.Figure
+
+    '''
+    # Series shorter than n_points have buckets under an hour, so gaps are never narrower than the rows
+    step = pd.Timedelta('1h')
+    gap = max(bucket_width(df['counts_pct'], n_points), step * GAP_ROWS)
+    counts = downsample(df['counts_pct'], n_points, method, gap)
+    offline = gap_edges(df['counts_pct'], gap)
+    temp = downsample(wdf['temp_pct'], n_points, method, step * GAP_ROWS)
+    alti = downsample(wdf['alti_press_pct'], n_points, method, step * GAP_ROWS)
+
     # Create a figure
     fig = go.Figure(
         [   # Offline
             go.Scatter(
-                x=df.index,
-                y=df['counts_pct'],
+                x=offline.index,
+                y=offline,
                 name='Offline',
                 line=dict(dash='dash', color='red', width=0.5),
-                connectgaps=True
             ),
             # Muon counts
             go.Scatter(
-                x=df.index,
-                y=df['counts_pct'],
+                x=counts.index,
+                y=counts,
                 name='Muon Counts % Change',
                 line=dict(color='red', width=1)
             ),
             # temperature
             go.Scatter(
-                x=wdf.index,
-                y=wdf['temp_pct'],
+                x=temp.index,
+                y=temp,
                 name='Temp(°F) % Change',
                 line=dict(color='green', width=1),
                 connectgaps=True
             ),
             # Altitude pressure
             go.Scatter(
-                x=wdf.index,
-                y=wdf['alti_press_pct'],
+                x=alti.index,
+                y=alti,
                 name='Alt. Pressure % Change',
                 line=dict(color='blue', width=1),
                 connectgaps=True
@@ -189,11 +254,12 @@ def update_detector_figure(detector_name_og):
     # If sea level pressure available, plot it
     # print('any sea: ', pd.isna(wdf['sea_l_pressure_millibar']).all())
     if not pd.isna(wdf['sea_l_pressure_millibar']).all():
+        sea_l = downsample(wdf['sea_l_press_pct'], n_points, method, step * GAP_ROWS)
         fig.add_trace(
             # Sea level pressure
             go.Scatter(
-                x=wdf.index,
-                y=wdf['sea_l_press_pct'],
+                x=sea_l.index,
+                y=sea_l,
                 name='Sea Level Press % Change',
                 line=dict(color='orange', width=1)
             ),
@@ -211,10 +277,12 @@ def update_detector_figure(detector_name_og):
         },
         height=280,
         margin=dict(l=0, r=0, t=25, b=0),
+        # Keeps zoom of user while traces are patched with the window it shows
+        uirevision=detector_name_og,
     )
     
-    return fig, df
+    return fig
     
     # except:
     #     print('Data fetch failed')
-    #     return None, None
\ No newline at end of file
+    #     return None, None
@@ -444,6 +444,7 @@ HTML_GRAPHS = html.Div(
                     "Download Data for Last 30 Days", 
                     id="btn-download-30", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -453,6 +454,7 @@ HTML_GRAPHS = html.Div(
                     "Download Moving Average Data", 
                     id="btn-download-mov", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -462,12 +464,12 @@ HTML_GRAPHS = html.Div(
                     "Download All Data", 
                     id="btn-download-all", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
                     size='md',
                     ),
-                dcc.Download(id="download_df_csv"),
             ],
             style={'padding': '50px 0px 50px 0px'},
             className='gap-5 d-md-flex justify-content-center',
@@ -597,6 +599,7 @@ HTML_DUAL_DET = html.Div(
                     "Download Data for Last 30 Days", 
                     id="btn-download-30", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -606,6 +609,7 @@ HTML_DUAL_DET = html.Div(
                     "Download Moving Average Data", 
                     id="btn-download-mov", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -615,12 +619,12 @@ HTML_DUAL_DET = html.Div(
                     "Download All Data", 
                     id="btn-download-all", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
                     size='md',
                     ),
-                dcc.Download(id="download_df_csv"),
             ],
             style={'padding': '40px 0px 30px 0px'},
             className='gap-5 d-md-flex justify-content-center',
@@ -638,6 +642,7 @@ HTML_DUAL_DET = html.Div(
                     "Download Data for Last 30 Days", 
                     id="btn-download-30-2", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -647,6 +652,7 @@ HTML_DUAL_DET = html.Div(
                     "Download Moving Average Data", 
                     id="btn-download-mov-2", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
@@ -656,12 +662,12 @@ HTML_DUAL_DET = html.Div(
                     "Download All Data", 
                     id="btn-download-all-2", 
                     style = {'display':'none'},
+                    external_link=True,
                     color = 'secondary',
                     outline=False,
                     class_name='text-center',
                     size='md',
                     ),
-                dcc.Download(id="download_df_csv-2"),
             ],
             style={'padding': '0px 0px 50px 0px'},
             className='gap-5 d-md-flex justify-content-center',
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.fixture(scope='session')
+def database(tmp_path_factory):
+    # The engine is created once per process from .env, so every test shares this db and uses its own tables
+    mp = pytest.MonkeyPatch()
+    mp.setenv('DB_BACKEND', 'sqlite')
+    mp.setenv('SQLITE_PATH', str(tmp_path_factory.mktemp('db') / 'test.sqlite'))
+    yield
+    mp.undo()
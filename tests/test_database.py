@@ -0,0 +1,66 @@
+'''
+
+Reads and writes of database.py on the embedded sqlite backend: column and time window projection,
+upserts replacing stored hours, and the rollup pyramid zoomed out windows are read from.
+
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from database import (connect_to_db, upsert_df, fetch_series, stream_series, get_last_date, get_column_sums,
+                      rollup_series, pick_resolution, fetch_rollup, table_name)
+
+
+@pytest.fixture
+def series(database):
+    index = pd.date_range('2024-01-01', periods=24*7*8, freq='h', tz='UTC', name='date')
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'counts': rng.normal(1000, 30, len(index)), 'temp': rng.normal(50, 5, len(index))}, index=index)
+    df.iloc[100:130] = np.nan
+    upsert_df(df, 'database_test', connect_to_db())
+    return df
+
+
+def test_table_name():
+    assert [table_name(name) for name in ['2Paddle', '4Paddle', 'Colombo_V1']] == ['paddle2', 'paddle4', 'colombo_v1']
+
+
+def test_fetch_series_window_and_columns(series):
+    start, end = series.index[200], series.index[300]
+    window = fetch_series('database_test', ['temp'], start, end)
+
+    pd.testing.assert_frame_equal(window, series.loc[start:end, ['temp']], check_freq=False)
+    pd.testing.assert_frame_equal(pd.concat(stream_series('database_test', chunksize=100)), series, check_freq=False)
+    assert get_last_date('database_test', connect_to_db()) == series.index[-1]
+    assert get_last_date('missing_table', connect_to_db()) is None
+
+
+def test_upsert_replaces_stored_hours(series):
+    update = series.iloc[-5:] + 1
+    upsert_df(update, 'database_test', connect_to_db())
+
+    pd.testing.assert_frame_equal(fetch_series('database_test', start=series.index[-5]), update, check_freq=False)
+    sums = get_column_sums('database_test', ['counts'], connect_to_db(), start=series.index[-5])['counts']
+    assert sums[0] == 5 and sums[1] == pytest.approx(update['counts'].sum())
+
+
+def test_rollups_match_hourly_means(series):
+    rollup_series('database_test', ['counts'], bind=connect_to_db())
+    start, end = series.index[0], series.index[-1]
+
+    # Buckets are read once they are no wider than a pixel
+    assert pick_resolution(start, end, 1000) == 'hour'
+    assert pick_resolution(start, end, 40) == 'day'
+    assert pick_resolution(start, end, 5) == 'week'
+
+    daily, resolution = fetch_rollup('database_test', ['counts'], start, end, 40)
+    assert resolution == 'day'
+    expected = series['counts'].resample('D').mean()
+    np.testing.assert_allclose(daily['counts'].to_numpy(), expected.to_numpy())
+    np.testing.assert_allclose(daily['counts_count'].to_numpy(), series['counts'].resample('D').count().to_numpy())
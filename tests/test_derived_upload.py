@@ -0,0 +1,51 @@
+''' 
+
+Nightly rebuilds of the derived series must only bump a detector's data version when its series
+changed, so figure caches and export files of unchanged detectors stay valid.
+
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import daily_data_upload as u
+from database import connect_to_db, create_series_table, series_table, upsert_df, get_data_version, fetch_series
+
+
+@pytest.fixture
+def detector(database, tmp_path, monkeypatch):
+    # Settings csv of a single detector, with a month of counts and weather on db
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('detector_info_settings')
+    pd.DataFrame({'name': ['Derived_Test'], 'weather_station': ['KDRV'], 'name_path': ['Derived_Test']}) \
+        .to_csv('detector_info_settings/detector_locations.csv', index=False)
+
+    index = pd.date_range('2024-01-01', periods=24*30, freq='h', tz='UTC', name='date')
+    rng = np.random.default_rng(0)
+    engine = connect_to_db()
+    upsert_df(pd.DataFrame({'counts': rng.normal(1000, 30, len(index))}, index=index), 'derived_test', engine)
+    with engine.begin() as conn:
+        create_series_table(series_table('kdrv', u.WEATHER_COLUMNS, u.HOURLY_PARTITION), conn, u.HOURLY_PARTITION)
+    upsert_df(pd.DataFrame({col: rng.normal(50, 5, len(index)) for col in u.WEATHER_COLUMNS}, index=index), 'kdrv', engine)
+
+    return 'derived_test'
+
+
+def test_version_only_bumped_on_changes(detector):
+    assert u.daily_derived_to_db() == {detector: 1}
+    derived = fetch_series(detector + u.DERIVED_SUFFIX)
+
+    # Nothing new, table and version stay as they are
+    assert u.daily_derived_to_db() == {}
+    assert get_data_version(detector) == 1
+    pd.testing.assert_frame_equal(fetch_series(detector + u.DERIVED_SUFFIX), derived)
+
+    # A new hour of counts changes the series
+    upsert_df(pd.DataFrame({'counts': [1000.0]}, index=pd.DatetimeIndex([derived.index[-1] + pd.Timedelta('1h')], name='date')), detector, connect_to_db())
+    assert u.daily_derived_to_db() == {detector: 2}
+    assert get_data_version(detector) == 2
@@ -0,0 +1,59 @@
+'''
+
+Downsampling of detector traces keeps about the number of points asked for, with the first and last
+point of each stretch of data, and breaks lines only over gaps wider than a point or min_gap.
+
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from pydownsample import DOWNSAMPLERS, downsample, gap_edges, bucket_width
+
+
+def hourly(hours, start='2024-01-01'):
+    index = pd.date_range(start, periods=hours, freq='h', tz='UTC', name='date')
+    return pd.Series(np.sin(np.arange(hours) / 24) + np.random.default_rng(0).normal(0, 0.1, hours), index=index)
+
+
+@pytest.mark.parametrize('method', list(DOWNSAMPLERS))
+def test_downsampler_keeps_ends_and_extremes(method):
+    series = hourly(10000)
+    series.iloc[5000] = 10
+
+    points = downsample(series, 500, method)
+
+    assert 450 <= len(points) <= 550
+    assert points.index[0] == series.index[0] and points.index[-1] == series.index[-1]
+    assert points.max() == 10
+    assert points.notna().all()
+
+
+@pytest.mark.parametrize('method', list(DOWNSAMPLERS))
+def test_gaps_break_line_once(method):
+    series = hourly(10000)
+    series.iloc[4000:4500] = np.nan
+
+    points = downsample(series, 500, method)
+    edges = gap_edges(series, bucket_width(series, 500))
+
+    gaps = points[points.isna()]
+    assert len(gaps) == 1
+    assert series.index[3999] < gaps.index[0] < series.index[4500]
+    assert edges.index[:2].tolist() == [series.index[3999], series.index[4500]]
+
+
+def test_min_gap_bridges_rows_wider_than_a_bucket():
+    # Fewer rows than points, as short series and zoomed windows have
+    series = hourly(300)
+    series.iloc[100:103] = np.nan
+
+    assert downsample(series, 1200).isna().sum() > 1
+    points = downsample(series, 1200, min_gap=pd.Timedelta('2h'))
+    assert points.isna().sum() == 1
+    assert len(gap_edges(series, max(bucket_width(series, 1200), pd.Timedelta('2h')))) == 3
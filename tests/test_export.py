@@ -0,0 +1,89 @@
+'''
+
+Export route of the detector downloads. Products of the download buttons are saved and served from
+their file with Range and ETag support, other exports are streamed without being saved, and repeated
+requests of the same data version get a 304.
+
+'''
+import gzip
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import pyexport
+from database import connect_to_db, upsert_df, bump_data_version, DERIVED_SUFFIX
+
+DETECTOR = 'Export_Test'
+
+
+@pytest.fixture
+def client(database, tmp_path, monkeypatch):
+    monkeypatch.setenv('EXPORT_DIR', str(tmp_path / 'exports'))
+
+    index = pd.date_range('2024-01-01', periods=24*30, freq='h', tz='UTC', name='date')
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({col: rng.normal(0, 1, len(index)) for col in pyexport.EXPORT_COLUMNS}, index=index)
+    engine = connect_to_db()
+    upsert_df(df, 'export_test' + DERIVED_SUFFIX, engine)
+    with engine.begin() as conn:
+        bump_data_version('export_test', conn)
+
+    # Route as registered on app.server
+    app = Flask(__name__)
+    app.add_url_rule('/export/<detector>', view_func=lambda detector: pyexport.export_response(detector))
+    return app.test_client(), df
+
+
+def exported_files():
+    folder = os.environ['EXPORT_DIR']
+    return sorted(os.listdir(folder)) if os.path.exists(folder) else []
+
+
+def test_download_is_saved_and_served_by_range(client):
+    client, df = client
+    url = pyexport.download_url(DETECTOR, 'all_data')
+
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers['Accept-Ranges'] == 'bytes'
+    body = first.get_data()
+    stored = pd.read_csv(io.BytesIO(gzip.decompress(body)), index_col='date', parse_dates=['date'])
+    np.testing.assert_allclose(stored.to_numpy(), df[pyexport.DATA_COLUMNS].to_numpy())
+    assert len(exported_files()) == 1
+
+    part = client.get(url, headers={'Range': 'bytes=10-99'})
+    assert part.status_code == 206
+    assert part.get_data() == body[10:100]
+
+    cached = client.get(url, headers={'If-None-Match': first.headers['ETag'].strip('"')})
+    assert cached.status_code == 304
+
+
+def test_adhoc_export_is_streamed_without_file(client):
+    client, df = client
+    url = pyexport.export_url(DETECTOR, start='2024-01-10', end='2024-01-11', columns='counts,temp_pct', format='csv')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'Accept-Ranges' not in response.headers
+    stored = pd.read_csv(io.BytesIO(response.get_data()), index_col='date', parse_dates=['date'])
+    assert list(stored.columns) == ['counts', 'temp_pct']
+    assert len(stored) == 25
+    assert exported_files() == []
+
+    cached = client.get(url, headers={'If-None-Match': response.headers['ETag'].strip('"')})
+    assert cached.status_code == 304
+
+
+def test_invalid_requests(client):
+    client, _ = client
+    assert client.get(pyexport.export_url(DETECTOR, format='xlsx')).status_code == 400
+    assert client.get(pyexport.export_url(DETECTOR, columns='counts,counts')).status_code == 400
+    assert client.get(pyexport.export_url('Missing_Detector')).status_code == 404
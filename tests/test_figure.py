@@ -0,0 +1,39 @@
+'''
+
+Detector figures must keep hourly series whole when they hold fewer points than the graph has room
+for, breaking lines and drawing the 'Offline' trace only over hours without counts.
+
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from pyfigure import detector_figure, DATA_COLUMNS, WEATHER_COLUMNS, WEATHER_CHANGE_COLUMNS
+
+
+def short_series(hours=400, gap=slice(200, 204)):
+    index = pd.date_range('2024-01-01', periods=hours, freq='h', tz='UTC', name='date')
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({col: rng.normal(0, 1, hours) for col in DATA_COLUMNS}, index=index)
+    df.iloc[gap] = np.nan
+    wdf = pd.DataFrame({col: rng.normal(0, 1, hours) for col in [*WEATHER_COLUMNS, *WEATHER_CHANGE_COLUMNS]}, index=index)
+    return df, wdf
+
+
+def test_short_series_only_breaks_on_missing_hours():
+    df, wdf = short_series()
+    fig = detector_figure(df, wdf, 'SantaMarta', 1200)
+    offline, counts = fig.data[0], fig.data[1]
+
+    # Every valid hour is kept and a single NaN breaks the line over the missing ones
+    assert len(counts.y) == df['counts_pct'].notna().sum() + 1
+    assert np.isnan(np.asarray(counts.y, dtype=float)).sum() == 1
+    # Offline trace joins the two hours around the gap alone
+    assert len(offline.y) == 3
+    assert pd.Timestamp(offline.x[0]) == df.index[199] and pd.Timestamp(offline.x[1]) == df.index[204]
+    # Weather traces have no gaps to break on
+    assert not np.isnan(np.asarray(fig.data[2].y, dtype=float)).any()
@@ -0,0 +1,85 @@
+''' 
+
+Incremental uploads of detector logs must store the same hourly counts as full uploads on the hours
+the new logs cover. Both run on the repository's data against a temporary sqlite db, each into its
+own table seeded with the detector's history csv. Logs too large to be parsed whole must merge into
+the same hours when folded block by block into hourly sums.
+
+'''
+import glob
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import daily_data_upload as u
+from database import fetch_series, upsert_df, connect_to_db
+
+# Detectors with a history csv and new logs on data/, by name and folder
+DETECTORS = [
+    ('2Paddle', '2Paddle'),
+    ('Colombo_V1', 'Colombo/V1'),
+    ('Rm415_Muon001', 'Rm415_Muon001'),
+    ('UvaWellassa_Muon001', 'UvaWellassa_Muon001'),
+]
+
+
+@pytest.fixture
+def workdir(database, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def upload(workdir, monkeypatch, name, name_path, table_name, incremental):
+    '''
+    Seeds table_name with the history csv of a detector and uploads its logs into it, from a copy of
+    its folder with its own checkpoints, as uploads delete older logs
+
+    '''
+    folder = workdir / table_name
+    shutil.copytree(os.path.join(REPO, 'data', name_path), folder)
+    monkeypatch.setattr(u, 'CHECKPOINT_DIR', str(folder / 'checkpoints'))
+
+    history = [f for f in glob.glob(str(folder / '*_all_logs.csv')) if os.path.basename(f).lower() == f'{name.lower()}_all_logs.csv'][0]
+    df = pd.read_csv(history, usecols=['date', 'counts'], dtype={'counts': 'float64'})
+    df['date'] = pd.to_datetime(df['date'], utc=True)
+    upsert_df(df.set_index('date').sort_index(), table_name, connect_to_db())
+
+    detector_data = None if incremental else u.get_detector_data(table_name)
+    u.process_and_upload_logs(detector_data, str(folder), name, table_name, incremental=incremental)
+
+    return folder
+
+
+@pytest.mark.parametrize('name, name_path', DETECTORS)
+def test_incremental_matches_full_upload(workdir, monkeypatch, name, name_path):
+    table_name = u.format_name(name)
+    folder = upload(workdir, monkeypatch, name, name_path, f'{table_name}_full', incremental=False)
+    upload(workdir, monkeypatch, name, name_path, f'{table_name}_incremental', incremental=True)
+
+    # Hours covered by the new logs
+    logs = u.all_detector_logs_to_dfs(os.path.join(REPO, 'data', name_path), name)
+    window_start = u.merge_log_dfs(logs, name).index.min()
+
+    full = fetch_series(f'{table_name}_full', ['counts'], start=window_start)
+    incremental = fetch_series(f'{table_name}_incremental', ['counts'], start=window_start)
+    assert not full.empty
+    pd.testing.assert_frame_equal(incremental, full)
+
+
+@pytest.mark.parametrize('name, name_path', DETECTORS)
+def test_streamed_logs_match_parsed_logs(monkeypatch, name, name_path):
+    # Logs parsed block by block into hourly sums must merge into the same hours, and checkpoint the
+    # same last line, as logs parsed whole
+    path = os.path.join(REPO, 'data', name_path)
+    parsed_checkpoints, streamed_checkpoints = {}, {}
+    parsed = u.merge_log_dfs(u.all_detector_logs_to_dfs(path, name, parsed_checkpoints), name)
+    monkeypatch.setattr(u, 'STREAM_CHUNK_BYTES', 2**16)
+    streamed = u.merge_log_dfs(u.all_detector_logs_to_dfs(path, name, streamed_checkpoints), name)
+
+    pd.testing.assert_frame_equal(streamed, parsed, check_dtype=False)
+    assert streamed_checkpoints == parsed_checkpoints
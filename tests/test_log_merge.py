@@ -0,0 +1,74 @@
+'''
+
+Merging of detector logs into hourly counts and tail reading of logs from their checkpoints. Logs
+that start later take precedence on the hours they share with earlier ones, each log's first and
+last hour are trimmed, and lines appended to a log since its checkpoint merge into the same hours
+as the whole log.
+
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import daily_data_upload as u
+
+
+def minute_log(start, end, counts):
+    index = pd.date_range(start, end, freq='min', tz='UTC', name='date')
+    return pd.DataFrame({'counts': np.full(len(index), counts, dtype=float)}, index=index)
+
+
+def test_later_log_takes_precedence_and_edges_are_trimmed():
+    first = minute_log('2024-01-01 00:00', '2024-01-01 05:59', 1)
+    second = minute_log('2024-01-01 03:30', '2024-01-01 08:59', 2)
+    third = minute_log('2024-01-01 12:00', '2024-01-01 15:59', 3)
+
+    # Order on the list does not matter, only where each log starts
+    merged = u.merge_log_dfs([second, third, first], 'Test')
+
+    hours = pd.date_range('2024-01-01 01:00', '2024-01-01 14:00', freq='h', tz='UTC', name='date')
+    expected = pd.Series(np.nan, index=hours)
+    expected['2024-01-01 01:00':'2024-01-01 03:00'] = 60
+    expected['2024-01-01 04:00':'2024-01-01 07:00'] = 120
+    expected['2024-01-01 13:00':'2024-01-01 14:00'] = 180
+    pd.testing.assert_series_equal(merged['counts'], expected, check_names=False, check_freq=False)
+
+
+def test_zero_hours_are_missing():
+    log = minute_log('2024-01-01 00:00', '2024-01-01 05:59', 1)
+    log.loc['2024-01-01 03:00':'2024-01-01 03:59', 'counts'] = 0
+
+    merged = u.merge_log_dfs([log], 'Test')
+
+    assert merged['counts'].isna().tolist() == [False, False, True, False]
+
+
+def test_appended_lines_merge_like_whole_log(tmp_path):
+    name = 'Rm415_Muon001'
+    source = os.path.join(REPO, 'data', name, 'Rm415_Muon001_2024_08_30_to_2024-09-09.log')
+    with open(source, 'rb') as f:
+        lines = f.readlines()
+    full = u.merge_log_dfs(u.all_detector_logs_to_dfs(os.path.dirname(source), name), name)
+
+    # First half of the log, then the rest appended as the detector keeps writing
+    log_path = tmp_path / os.path.basename(source)
+    log_path.write_bytes(b''.join(lines[:len(lines) // 2]))
+    checkpoints = {}
+    u.all_detector_logs_to_dfs(str(tmp_path), name, checkpoints)
+    with open(log_path, 'ab') as f:
+        f.write(b''.join(lines[len(lines) // 2:]))
+    new_logs = u.all_detector_logs_to_dfs(str(tmp_path), name, checkpoints)
+    tail = u.merge_log_dfs(new_logs, name)
+
+    # Only lines from the hour before the last parsed one are read again
+    assert sum(len(df) for df in new_logs) < len(lines) // 2 + 120
+    assert tail.index.max() == full.index.max()
+    pd.testing.assert_frame_equal(tail, full.loc[tail.index], check_freq=False)
+    assert checkpoints[str(log_path)]['size'] == os.path.getsize(log_path)
+
+    # Nothing new, nothing read
+    assert u.all_detector_logs_to_dfs(str(tmp_path), name, checkpoints) == []
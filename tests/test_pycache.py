@@ -0,0 +1,59 @@
+'''
+
+Figure cache keyed by data version: values are built once per (detector, version, view parameters),
+shared between workers through the disk tier, and a new version makes older entries unreachable.
+
+'''
+import os
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import pycache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('FIGURE_CACHE_DIR', str(tmp_path / 'figures'))
+    monkeypatch.setattr(pycache, '_memory', pycache.OrderedDict())
+    return tmp_path / 'figures'
+
+
+def test_values_built_once_per_version(cache):
+    builds = []
+    def build(value):
+        builds.append(value)
+        return value
+
+    assert pycache.cached('detector', 1, ('figure', 1200), lambda: build('a')) == 'a'
+    assert pycache.cached('detector', 1, ('figure', 1200), lambda: build('b')) == 'a'
+    assert pycache.cached('detector', 1, ('figure', 1600), lambda: build('c')) == 'c'
+    assert pycache.cached('detector', 2, ('figure', 1200), lambda: build('d')) == 'd'
+    assert builds == ['a', 'c', 'd']
+
+    # Older versions are dropped from both tiers
+    assert all(key[1] == 2 for key in pycache._memory)
+    assert [name.split('@')[1] for name in os.listdir(cache)] == ['2']
+
+
+def test_disk_tier_shared_between_workers(cache, monkeypatch):
+    pycache.cached('detector', 1, ('figure', 1200), lambda: {'traces': [1, 2, 3]})
+
+    # Another worker starts with an empty memory tier
+    monkeypatch.setattr(pycache, '_memory', pycache.OrderedDict())
+    hits = pycache.cache_stats()['disk_hits']
+    assert pycache.cached('detector', 1, ('figure', 1200), lambda: None) == {'traces': [1, 2, 3]}
+    assert pycache.cache_stats()['disk_hits'] == hits + 1
+
+
+def test_memory_tier_evicts_least_recently_used(monkeypatch):
+    monkeypatch.delenv('FIGURE_CACHE_DIR', raising=False)
+    monkeypatch.setattr(pycache, '_memory', pycache.OrderedDict())
+    monkeypatch.setattr(pycache, 'CACHE_MEMORY_ENTRIES', 2)
+
+    for width in (1, 2, 3):
+        pycache.cached('detector', 1, ('figure', width), lambda: width)
+
+    assert [key[2] for key in pycache._memory] == [('figure', 2), ('figure', 3)]